@@ -1,16 +1,40 @@
 from abc import ABC, abstractmethod
 import requests
 import time
+from threading import Lock, Thread
 import os
 from tools.helper import yaml_read
-from tools.Vrops import Vrops
+from tools.Vrops import Vrops, transport
+from tools.Governor import caller, VM_STATS, STATS, PROPERTIES
 from prometheus_client.core import GaugeMetricFamily, InfoMetricFamily, UnknownMetricFamily
 
 
 class BaseCollector(ABC):
+    # vm -> project mapping shared by all vm collectors of the process, see get_project_ids_by_target
+    project_cache = {'iteration': 0, 'full_iteration': 0, 'parents': dict(), 'project_ids': dict()}
+    project_cache_lock = Lock()
+    project_refresh = None
+    # (target, kinds) -> (etag, iteration, bundle) of the last inventory response, shared by all collectors of the
+    # process. the watcher refreshes them as soon as the inventory has a new iteration
+    inventory_cache = dict()
+    inventory_watcher = None
+    inventory_watcher_lock = Lock()
+    latest_iteration = 0
+    # the fields of the inventory the collectors use
+    inventory_fields = {
+        'vcenters': ['uuid', 'name'],
+        'datacenters': ['uuid', 'name', 'vcenter'],
+        'clusters': ['uuid', 'name', 'parent_dc_name', 'vcenter'],
+        'hosts': ['uuid', 'name', 'parent_cluster_name', 'datacenter', 'vcenter'],
+        'datastores': ['uuid', 'name', 'type', 'parent_host_name', 'cluster', 'datacenter', 'vcenter'],
+        'vms': ['uuid', 'name', 'parent_host_uuid', 'parent_host_name', 'cluster', 'datacenter', 'vcenter']
+    }
 
     def __init__(self):
         self.vrops_entity_name = 'base'
+        self.vrops = transport()
+        # tokens are cached in the process, a missing or rejected token is asked from the inventory once
+        Vrops.token_source = self.get_inventory_token
         while os.environ['TARGET'] not in self.get_target_tokens():
             print(os.environ['TARGET'], "has no resources in inventory")
             time.sleep(1800)
@@ -25,57 +49,136 @@ class BaseCollector(ABC):
         return config_file
 
     def get_vcenters(self, target):
-        current_iteration = self.get_iteration()
-        url = "http://" + os.environ['INVENTORY'] + "/" + target + "/vcenters/{}".format(current_iteration)
-        request = requests.get(url)
-        self.vcenters = request.json()
+        self.vcenters = self.get_inventory(target, 'vcenters')
         return self.vcenters
 
     def get_datacenters(self, target):
-        current_iteration = self.get_iteration()
-        url = "http://" + os.environ['INVENTORY'] + "/" + target + "/datacenters/{}".format(current_iteration)
-        request = requests.get(url)
-        self.datacenters = request.json()
+        self.datacenters = self.get_inventory(target, 'datacenters')
         return self.datacenters
 
     def get_clusters(self, target):
-        current_iteration = self.get_iteration()
-        url = "http://" + os.environ['INVENTORY'] + "/" + target + "/clusters/{}".format(current_iteration)
-        request = requests.get(url)
-        self.clusters = request.json()
+        self.clusters = self.get_inventory(target, 'clusters')
         return self.clusters
 
     def get_hosts(self, target):
-        current_iteration = self.get_iteration()
-        url = "http://" + os.environ['INVENTORY'] + "/" + target + "/hosts/{}".format(current_iteration)
-        request = requests.get(url)
-        self.hosts = request.json()
+        self.hosts = self.get_inventory(target, 'hosts')
         return self.hosts
 
     def get_datastores(self, target):
-        current_iteration = self.get_iteration()
-        url = "http://" + os.environ['INVENTORY'] + "/" + target + "/datastores/{}".format(current_iteration)
-        request = requests.get(url)
-        self.datastores = request.json()
+        self.datastores = self.get_inventory(target, 'datastores')
         return self.datastores
 
     def get_vms(self, target):
-        current_iteration = self.get_iteration()
-        url = "http://" + os.environ['INVENTORY'] + "/" + target + "/vms/{}".format(current_iteration)
-        request = requests.get(url)
-        self.vms = request.json()
+        self.vms = self.get_inventory(target, 'vms')
         return self.vms
 
-    def get_iteration(self):
-        request = requests.get(url="http://" + os.environ['INVENTORY'] + "/iteration")
-        self.iteration = request.json()
-        return self.iteration
+    def get_inventory(self, target, kind):
+        return self.get_bundle(target, [kind])[kind]
 
-    def get_target_tokens(self):
-        request = requests.get(url="http://" + os.environ['INVENTORY'] + "/target_tokens")
+    # the kinds of the latest iteration, from the cache if the watcher has already fetched them
+    def get_bundle(self, target, kinds):
+        cached = BaseCollector.inventory_cache.get((target, tuple(kinds)))
+        if cached and cached[1] == BaseCollector.latest_iteration and BaseCollector.inventory_watcher and \
+                BaseCollector.inventory_watcher.is_alive():
+            self.iteration = cached[1]
+            return cached[2]
+        bundle, self.iteration = self.fetch_bundle(target, kinds)
+        return bundle
+
+    # one request for the latest iteration of the given kinds, with just the fields the collectors use. a cached
+    # bundle is brought up to date with what changed since its iteration. without one, or if the inventory does not
+    # have that iteration anymore, the whole bundle is fetched. the inventory answers 304 if the payload has the
+    # etag of the one seen last, even of an older iteration
+    def fetch_bundle(self, target, kinds):
+        fields = sorted({field for kind in kinds for field in BaseCollector.inventory_fields[kind]})
+        params = {'kinds': ','.join(kinds), 'fields': ','.join(fields)}
+        cached = BaseCollector.inventory_cache.get((target, tuple(kinds)))
+        if cached:
+            url = "http://" + os.environ['INVENTORY'] + "/" + target + "/delta/" + str(cached[1]) + "/latest"
+            request = requests.get(url, params=params)
+            if request.status_code == 200:
+                iteration = int(request.headers['X-Inventory-Iteration'])
+                bundle = BaseCollector.apply_delta(cached[2], request.json())
+                BaseCollector.inventory_cache[(target, tuple(kinds))] = (None, iteration, bundle)
+                return bundle, iteration
+        url = "http://" + os.environ['INVENTORY'] + "/" + target + "/bundle/latest"
+        headers = {'If-None-Match': cached[0]} if cached and cached[0] else None
+        request = requests.get(url, params=params, headers=headers)
+        iteration = int(request.headers['X-Inventory-Iteration'])
+        bundle = cached[2] if request.status_code == 304 and cached else request.json()
+        if 'ETag' in request.headers:
+            BaseCollector.inventory_cache[(target, tuple(kinds))] = (request.headers['ETag'], iteration, bundle)
+        return bundle, iteration
+
+    # returns a new bundle, the cached one may still be in use by other collectors
+    def apply_delta(bundle, delta):
+        applied = dict()
+        for kind, resources in bundle.items():
+            if not any(delta[kind].values()):
+                applied[kind] = resources
+                continue
+            applied[kind] = dict(resources)
+            applied[kind].update(delta[kind]['added'])
+            applied[kind].update(delta[kind]['changed'])
+            for uuid in delta[kind]['removed']:
+                applied[kind].pop(uuid, None)
+        return applied
+
+    # blocks until the inventory has another iteration than after, or timeout seconds passed
+    def wait_for_iteration(self, after, timeout=60):
+        request = requests.get(url="http://" + os.environ['INVENTORY'] + "/iteration/wait",
+                               params={'after': after, 'timeout': timeout}, timeout=timeout + 30)
+        return request.json()
+
+    def start_inventory_watcher(self):
+        with BaseCollector.inventory_watcher_lock:
+            if BaseCollector.inventory_watcher and BaseCollector.inventory_watcher.is_alive():
+                return
+            BaseCollector.inventory_watcher = Thread(target=self.watch_inventory, name='inventory-watcher',
+                                                     daemon=True)
+            BaseCollector.inventory_watcher.start()
+
+    # refetches everything the collectors asked for once a new iteration is published, before they ask again
+    def watch_inventory(self):
+        while True:
+            try:
+                iteration = self.wait_for_iteration(BaseCollector.latest_iteration)
+                if iteration == BaseCollector.latest_iteration:
+                    continue
+                for target, kinds in list(BaseCollector.inventory_cache):
+                    self.fetch_bundle(target, list(kinds))
+                BaseCollector.latest_iteration = iteration
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                print("Problem watching the inventory, retrying in 5s. Error:", str(e))
+                time.sleep(5)
+
+    # a token vrops rejected is handed back, the inventory renews it before answering
+    def get_target_tokens(self, rejected=None):
+        request = requests.get(url="http://" + os.environ['INVENTORY'] + "/target_tokens",
+                               params={'rejected': rejected} if rejected else None)
         self.target_tokens = request.json()
         return self.target_tokens
 
+    def get_inventory_token(self, target, rejected=None):
+        token = self.get_target_tokens(rejected).get(target)
+        if not token or token == rejected:
+            return False
+        # the inventory renews its tokens before they expire, keep this one until vrops rejects it
+        return {'token': token, 'validity': None}
+
+    def set_request_flow(self):
+        # all vrops requests of this scrape queue at the governor as one flow, vm stats go first
+        if 'VMStats' in self.__class__.__name__:
+            priority = VM_STATS
+        elif 'Stats' in self.__class__.__name__:
+            priority = STATS
+        else:
+            priority = PROPERTIES
+        caller.set((self.__class__.__name__, priority))
+
+    def get_target_token(self):
+        return self.vrops.get_token(self.target)
+
     def get_clusters_by_target(self):
         cluster_dict = self.get_clusters(self.target)
         self.target_clusters = [cluster_dict[uuid]['uuid'] for uuid in cluster_dict]
@@ -96,21 +199,105 @@ class BaseCollector(ABC):
         self.target_vms = [vms_dict[uuid]['uuid'] for uuid in vms_dict]
         return self.target_vms
 
+    # folder membership hardly ever changes, so the ancestor query is only sent for vms that are new or moved to
+    # another host since the last inventory iteration. that happens in the background, the scrape goes on with the
+    # mapping known so far. every PROJECT_FULL_REFRESH iterations all vms are asked again. the cache only moves on
+    # to the iteration once the query got an answer for every chunk, a failed one is sent again with the next scrape
+    # and the vms keep the projects known so far meanwhile
     def get_project_ids_by_target(self):
-        token = self.get_target_tokens()
-        token = token[self.target]
-        uuids = self.get_vms_by_target()
-        project_ids = Vrops.get_project_ids(self.target, token, uuids)
-        return project_ids
+        vms = self.get_vms(self.target)
+        iteration = self.iteration
+        cache = BaseCollector.project_cache
+        with BaseCollector.project_cache_lock:
+            if cache['iteration'] != iteration and not (BaseCollector.project_refresh and
+                                                        BaseCollector.project_refresh.is_alive()):
+                full = iteration - cache['full_iteration'] >= int(os.environ.get('PROJECT_FULL_REFRESH', '10'))
+                changed = [uuid for uuid in vms if full or
+                           cache['parents'].get(uuid) != vms[uuid].get('parent_host_uuid')]
+                parents = {uuid: vms[uuid].get('parent_host_uuid') for uuid in vms}
+                if changed:
+                    BaseCollector.project_refresh = Thread(target=self.refresh_project_ids,
+                                                           args=(changed, parents, iteration, full), daemon=True)
+                    BaseCollector.project_refresh.start()
+                else:
+                    cache['project_ids'] = {uuid: project for uuid, project in cache['project_ids'].items()
+                                            if uuid in parents}
+                    cache['parents'] = parents
+                    cache['iteration'] = iteration
+        # nothing to go on yet for the very first scrapes
+        refresh = BaseCollector.project_refresh
+        if not cache['parents'] and refresh and refresh.is_alive():
+            refresh.join()
+        with BaseCollector.project_cache_lock:
+            return cache['project_ids']
+
+    def refresh_project_ids(self, changed, parents, iteration, full):
+        token = self.get_target_token()
+        if not token:
+            return
+        project_ids = self.vrops.get_project_ids(self.target, token, changed)
+        if project_ids is False:
+            return
+        with BaseCollector.project_cache_lock:
+            cache = BaseCollector.project_cache
+            # the index is replaced, never changed in place, so scrapes can keep reading the one they got.
+            # vms gone from the inventory are dropped
+            changed = set(changed)
+            refreshed = {uuid: project for uuid, project in cache['project_ids'].items()
+                         if uuid in parents and uuid not in changed}
+            refreshed.update(project_ids)
+            cache['project_ids'] = refreshed
+            cache['parents'] = parents
+            cache['iteration'] = iteration
+            if full:
+                cache['full_iteration'] = iteration
+
+    def get_properties_by_family(self, token, uuids, gauges, states, infos):
+        # every number, enum and info property of the collector is fetched in one go,
+        # the returned contents are split up into the families afterwards
+        number_keys = [gauges[metric_suffix]['property'] for metric_suffix in gauges]
+        enum_keys = [states[metric_suffix]['property'] for metric_suffix in states]
+        info_keys = [infos[metric_suffix]['property'] for metric_suffix in infos]
+        propkeys = list(dict.fromkeys(number_keys + enum_keys + info_keys))
+
+        number_values, enum_values, info_values = dict(), dict(), dict()
+        if not propkeys:
+            return number_values, enum_values, info_values
+        contents = self.vrops.get_latest_properties_multiple(self.target, token, uuids, propkeys)
+        if not contents:
+            print("skipping propkeys in", self.name, ", no return")
+            return number_values, enum_values, info_values
+
+        for (resource_id, propkey), content in contents.items():
+            # if we expect a number without special characters
+            if propkey in number_keys:
+                if 'values' in content:
+                    number_values[(resource_id, propkey)] = content['values'][0]
+                else:
+                    number_values[(resource_id, propkey)] = content['data'][0]
+            # if the property describes a status that has several states
+            if propkey in enum_keys and 'values' in content:
+                enum_values[(resource_id, propkey)] = content['values'][0]
+            # for all other properties that return a string or numbers with special characters
+            if propkey in info_keys:
+                if 'values' in content:
+                    info_values[(resource_id, propkey)] = content['values'][0]
+                else:
+                    info_values[(resource_id, propkey)] = 'None'
+        return number_values, enum_values, info_values
 
     def wait_for_inventory_data(self):
         iteration = 0
         while not iteration:
-            time.sleep(5)
-            iteration = self.get_iteration()
+            try:
+                iteration = self.wait_for_iteration(iteration)
+            except requests.exceptions.RequestException as e:
+                print("Problem waiting for the inventory, retrying in 5s. Error:", str(e))
+                time.sleep(5)
             if os.environ['DEBUG'] >= '1':
                 print("waiting for initial iteration: " + type(self).__name__)
         print("done: initial query " + type(self).__name__)
+        self.start_inventory_watcher()
         return
 
     def generate_gauges(self, metric_type, calling_class, vrops_entity_name, labelnames):
@@ -2,14 +2,42 @@ from flask import Flask
 from flask import request
 from flask import abort
 from flask import jsonify
+from flask import Response
 from gevent.pywsgi import WSGIServer
+import gevent
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from resources.Vcenter import Vcenter
-from tools.Vrops import Vrops
+from resources.Datacenter import Datacenter
+from resources.Cluster import Cluster
+from resources.Host import Host
+from resources.Datastore import Datastore
+from resources.VirtualMachine import VirtualMachine
+from tools.Vrops import transport, deadline, IncompleteError
+from tools.InventorySnapshot import InventorySnapshot
+from tools.RecordStore import RecordStore
+import hashlib
 import time
 import json
+import gzip
 import os
 
+# the views of a target's tree served by the REST API
+KINDS = ['vcenters', 'datacenters', 'clusters', 'hosts', 'datastores', 'vms']
+
+# the fields of those views, bundles and deltas can be narrowed down to these
+FIELDS = ['uuid', 'name', 'target', 'token', 'vcenter', 'datacenter', 'cluster', 'type', 'parent_vcenter_uuid',
+          'parent_vcenter_name', 'parent_dc_uuid', 'parent_dc_name', 'parent_cluster_uuid', 'parent_cluster_name',
+          'parent_host_uuid', 'parent_host_name']
+
+# vROps counters telling whether the children of a cluster or host changed since the last build
+SUBTREE_COUNTS = {
+    'hosts': 'summary|total_number_hosts',
+    'datastores': 'summary|total_number_datastores',
+    'vms': 'summary|total_number_vms'
+}
+
 
 class InventoryBuilder:
     def __init__(self, json, port, sleep):
@@ -21,7 +49,14 @@ class InventoryBuilder:
         self.vcenter_dict = dict()
         self.target_tokens = dict()
         self.iterated_inventory = dict()
+        self.serialized_inventory = dict()
         self.successful_iteration_list = [0]
+        self.target_threads = dict()
+        self.build_durations = dict()
+        self.subtree_counts = dict()
+        self.snapshot_iteration = None
+        self.load_snapshot()
+        self.vrops = transport()
         self.wsgi_address = '0.0.0.0'
         if 'LOOPBACK' in os.environ:
             if os.environ['LOOPBACK'] == '1':
@@ -45,43 +80,65 @@ class InventoryBuilder:
 
         @app.route('/<target>/vcenters/<int:iteration>', methods=['GET'])
         def vcenters(target, iteration):
-            return self.iterated_inventory[str(iteration)]['vcenters'][target]
+            return self.inventory_response(target, 'vcenters', iteration)
 
         @app.route('/<target>/datacenters/<int:iteration>', methods=['GET'])
         def datacenters(target, iteration):
-            return self.iterated_inventory[str(iteration)]['datacenters'][target]
+            return self.inventory_response(target, 'datacenters', iteration)
 
         @app.route('/<target>/clusters/<int:iteration>', methods=['GET'])
         def clusters(target, iteration):
-            return self.iterated_inventory[str(iteration)]['clusters'][target]
+            return self.inventory_response(target, 'clusters', iteration)
 
         @app.route('/<target>/hosts/<int:iteration>', methods=['GET'])
         def hosts(target, iteration):
-            return self.iterated_inventory[str(iteration)]['hosts'][target]
+            return self.inventory_response(target, 'hosts', iteration)
 
         @app.route('/<target>/datastores/<int:iteration>', methods=['GET'])
         def datastores(target, iteration):
-            return self.iterated_inventory[str(iteration)]['datastores'][target]
+            return self.inventory_response(target, 'datastores', iteration)
 
         @app.route('/<target>/vms/<int:iteration>', methods=['GET'])
         def vms(target, iteration):
-            return self.iterated_inventory[str(iteration)]['vms'][target]
+            return self.inventory_response(target, 'vms', iteration)
+
+        # several kinds of one target in one response, ?kinds=vms,hosts&fields=uuid,name picks what is needed.
+        # the iteration can be latest, the one served is in the X-Inventory-Iteration header
+        @app.route('/<target>/bundle/<iteration>', methods=['GET'])
+        def bundle(target, iteration):
+            return self.bundle_response(target, iteration, request.args.get('kinds'), request.args.get('fields'))
+
+        # what changed since an older iteration, takes the same arguments as bundle
+        @app.route('/<target>/delta/<int:since>/<iteration>', methods=['GET'])
+        def delta(target, since, iteration):
+            return self.delta_response(target, since, iteration, request.args.get('kinds'),
+                                       request.args.get('fields'))
 
         @app.route('/iteration', methods=['GET'])
         def iteration():
             return_iteration = self.successful_iteration_list[-1]
             return str(return_iteration)
 
+        # long-poll, answers as soon as the iteration is another than ?after=, or after ?timeout= seconds
+        @app.route('/iteration/wait', methods=['GET'])
+        def iteration_wait():
+            return str(self.wait_for_iteration(request.args.get('after', 0, type=int),
+                                               request.args.get('timeout', 60, type=float)))
+
         # debugging purpose
         @app.route('/iteration_store', methods=['GET'])
         def iteration_store():
             return_iteration = self.successful_iteration_list
             return(json.dumps(return_iteration))
 
-        # FIXME: this could basically be the always active token list. no active token? refresh!
+        # how long the last build of every target took. the builds write it meanwhile, so a copy is serialized
+        @app.route('/build_durations', methods=['GET'])
+        def build_durations():
+            return json.dumps(dict(self.build_durations))
+
         @app.route('/target_tokens', methods=['GET'])
         def token():
-            return json.dumps(self.target_tokens)
+            return json.dumps(self.get_target_tokens(request.args.get('rejected')))
 
         try:
             if os.environ['DEBUG'] >= '2':
@@ -93,6 +150,143 @@ class InventoryBuilder:
             print('Current used options:', str(self.wsgi_address), 'on port', str(self.port))
             print(e)
 
+    # tokens come from the token cache without waiting for vrops, expiring ones are renewed in the background.
+    # the token of the last build is handed out if the cache has none. a token an exporter got a 401 for is renewed
+    # right away, on a thread of the hub so the other requests are served meanwhile
+    def get_target_tokens(self, rejected=None):
+        if rejected:
+            for target, token in list(self.target_tokens.items()):
+                if rejected in (token, self.vrops.get_cached_token(target)):
+                    self.target_tokens[target] = gevent.get_hub().threadpool.apply(
+                        self.vrops.refresh_token, (target, rejected)) or None
+        return {target: self.vrops.get_cached_token(target) or token
+                for target, token in list(self.target_tokens.items())}
+
+    def inventory_response(self, target, kind, iteration):
+        return self.serialized_response(iteration, (kind, target), lambda: self.get_view(kind, iteration, target))
+
+    # answers with the payload serialized for the newest iteration, gzipped if the client takes it. the etag is
+    # the hash of the payload, so a client that has it already gets a 304, even for a newer iteration. payloads of
+    # an iteration loaded from the snapshot are marked with X-Inventory-Stale
+    def serialized_response(self, iteration, key, view):
+        published = self.serialized_inventory.get(str(iteration))
+        serialized = published.get(key) if published is not None else None
+        if not serialized:
+            # older iterations are only kept as trees, their views are serialized on every request
+            serialized = self.serialize(view(), compress=published is not None)
+            if published is not None and self.cacheable(published, key):
+                published[key] = serialized
+        gzipped = serialized['gzip'] is not None and 'gzip' in request.accept_encodings
+        if request.if_none_match.contains(serialized['etag']) or \
+                request.if_none_match.contains(serialized['etag'] + '-gzip'):
+            response = Response(status=304)
+        elif gzipped:
+            response = Response(serialized['gzip'], mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(serialized['body'] or gzip.decompress(serialized['gzip']), mimetype='application/json')
+        # the gzipped payload is another representation, so it needs its own strong etag
+        response.set_etag(serialized['etag'] + ('-gzip' if gzipped else ''))
+        response.headers['Vary'] = 'Accept-Encoding'
+        if iteration == self.snapshot_iteration:
+            response.headers['X-Inventory-Stale'] = '1'
+        return response
+
+    # the payloads of the views are all kept, those of bundles and deltas only up to INVENTORY_CACHED_PAYLOADS per
+    # iteration. any combination of kinds, fields and since can be asked for, they are serialized per request then
+    def cacheable(self, published, key):
+        if len(key) == 2:
+            return True
+        cached = sum(1 for published_key in published if len(published_key) > 2)
+        return cached < int(os.environ.get('INVENTORY_CACHED_PAYLOADS', '32'))
+
+    # the server is not monkey patched, so waiting must not block its thread but only yield to the other requests
+    def wait_for_iteration(self, after, timeout):
+        deadline = time.monotonic() + min(timeout, 300)
+        while self.successful_iteration_list[-1] == after and time.monotonic() < deadline:
+            gevent.sleep(0.2)
+        return self.successful_iteration_list[-1]
+
+    # checks the arguments of bundle and delta requests, returns them parsed. kinds and fields are put in the order
+    # of KINDS and FIELDS, so the same request always finds the same payload
+    def parse_arguments(self, target, iteration, kinds, fields):
+        if iteration == 'latest':
+            iteration = self.successful_iteration_list[-1]
+        elif iteration.isdigit():
+            iteration = int(iteration)
+        else:
+            abort(400)
+        kinds = set(kinds.split(',')) if kinds else set(KINDS)
+        fields = set(fields.split(',')) if fields else None
+        if not kinds <= set(KINDS) or fields and not fields <= set(FIELDS):
+            abort(400)
+        kinds = tuple(kind for kind in KINDS if kind in kinds)
+        fields = tuple(field for field in FIELDS if field in fields) if fields else None
+        if target not in self.iterated_inventory.get(str(iteration), dict()):
+            abort(404)
+        return iteration, kinds, fields
+
+    def bundle_response(self, target, iteration, kinds, fields):
+        iteration, kinds, fields = self.parse_arguments(target, iteration, kinds, fields)
+        response = self.serialized_response(iteration, ('bundle', target, kinds, fields),
+                                            lambda: self.get_bundle(iteration, target, kinds, fields))
+        response.headers['X-Inventory-Iteration'] = str(iteration)
+        return response
+
+    # 404 if the iteration to start from is not retained anymore, the client has to get a whole bundle then
+    def delta_response(self, target, since, iteration, kinds, fields):
+        iteration, kinds, fields = self.parse_arguments(target, iteration, kinds, fields)
+        if target not in self.iterated_inventory.get(str(since), dict()):
+            abort(404)
+        response = self.serialized_response(iteration, ('delta', target, since, kinds, fields),
+                                            lambda: self.get_delta(since, iteration, target, kinds, fields))
+        response.headers['X-Inventory-Iteration'] = str(iteration)
+        return response
+
+    def get_bundle(self, iteration, target, kinds, fields):
+        return {kind: self.get_projection(kind, iteration, target, fields) for kind in kinds}
+
+    # what was added, changed and removed in every kind between the iterations since and iteration
+    def get_delta(self, since, iteration, target, kinds, fields):
+        delta = dict()
+        for kind in kinds:
+            before = self.get_projection(kind, since, target, fields)
+            after = self.get_projection(kind, iteration, target, fields)
+            delta[kind] = {
+                'added': {uuid: resource for uuid, resource in after.items() if uuid not in before},
+                'changed': {uuid: resource for uuid, resource in after.items()
+                            if uuid in before and before[uuid] != resource},
+                'removed': [uuid for uuid in before if uuid not in after]
+            }
+        return delta
+
+    def get_projection(self, kind, iteration, target, fields):
+        view = self.get_view(kind, iteration, target)
+        if not fields:
+            return view
+        return {uuid: {field: resource[field] for field in fields if field in resource}
+                for uuid, resource in view.items()}
+
+    # only the gzipped body is kept if there is one, almost every client takes it
+    def serialize(self, resources, compress=True):
+        body = json.dumps(resources, separators=(',', ':')).encode()
+        compressed = gzip.compress(body) if compress and os.environ.get('INVENTORY_GZIP', '1') == '1' else None
+        return {
+            'body': None if compressed else body,
+            'etag': hashlib.sha256(body).hexdigest(),
+            'gzip': compressed
+        }
+
+    def serialize_iteration(self, iteration):
+        self.serialized_inventory = {str(iteration): {
+            (kind, target): self.serialize(self.get_view(kind, iteration, target))
+            for target in self.iterated_inventory[str(iteration)] for kind in KINDS}}
+
+    # the json view of one kind of resources of a target, built from the tree of the iteration. the records don't
+    # keep tokens, every view has the current token of the target
+    def get_view(self, kind, iteration, target):
+        return getattr(self, 'get_' + kind)(self.iterated_inventory[str(iteration)][target])
+
     def get_vrops(self):
         with open(self.json) as json_file:
             netbox_json = json.load(json_file)
@@ -100,13 +294,13 @@ class InventoryBuilder:
                            target['labels']['job'] == "vrops"]
 
     def query_inventory_permanent(self):
-        # first iteration to fill is 1. while this is not ready,
-        # curl to /iteration would still report 0 to wait for actual data
-        self.iteration = 1
+        # first iteration to fill is 1, or the one after a loaded snapshot. while this is not ready,
+        # curl to /iteration would still report 0 (or the snapshot) to wait for actual data
+        self.iteration = self.successful_iteration_list[-1] + 1
         while True:
             # get vrops targets every run in case we have new targets appearing
             self.get_vrops()
-            if len(self.successful_iteration_list) > 3:
+            if len(self.successful_iteration_list) > int(os.environ.get('RETAINED_ITERATIONS', '3')):
                 iteration_to_be_deleted = self.successful_iteration_list.pop(0)
                 # initial case, since 0 is never filled in iterated_inventory
                 if iteration_to_be_deleted == 0:
@@ -115,22 +309,15 @@ class InventoryBuilder:
                 if os.environ['DEBUG'] >= '1':
                     print("deleting iteration", str(iteration_to_be_deleted))
 
-            # initialize empty inventory per iteration
-            self.iterated_inventory[str(self.iteration)] = dict()
             if os.environ['DEBUG'] >= '1':
                 print("real run " + str(self.iteration))
-            for vrops in self.vrops_list:
-                if not self.query_vrops(vrops):
-                    if os.environ['DEBUG'] >= '1':
-                        print("retrying connection to", vrops, "in next iteration", str(self.iteration + 1))
-            self.get_vcenters()
-            self.get_datacenters()
-            self.get_clusters()
-            self.get_hosts()
-            self.get_datastores()
-            self.get_vms()
-            if len(self.iterated_inventory[str(self.iteration)]['vcenters']) > 0:
+            self.query_targets()
+            # an iteration keeps the trees of its targets, the json views are made when they are asked for
+            self.iterated_inventory[str(self.iteration)] = dict(self.vcenter_dict)
+            if len(self.iterated_inventory[str(self.iteration)]) > 0:
+                self.serialize_iteration(self.iteration)
                 self.successful_iteration_list.append(self.iteration)
+                self.save_snapshot()
             else:
                 # immediately withdraw faulty inventory
                 if os.environ['DEBUG'] >= '1':
@@ -141,159 +328,342 @@ class InventoryBuilder:
                 print("inventory relaxing before going to work again")
             time.sleep(int(self.sleep))
 
+    # with SNAPSHOT set, the last iteration of the previous run is served until the first build is done. its targets
+    # are listed in /target_tokens without a token, so the collectors start right away instead of waiting for them
+    def load_snapshot(self):
+        if not os.environ.get('SNAPSHOT'):
+            return
+        snapshot = InventorySnapshot.load(os.environ['SNAPSHOT'])
+        if not snapshot:
+            return
+        iteration, inventory = snapshot
+        for target in inventory.get('vcenters', dict()):
+            vcenter = self.tree_from_views(target, inventory)
+            if vcenter:
+                self.vcenter_dict[target] = RecordStore.share(vcenter)
+        if not self.vcenter_dict:
+            return
+        self.iterated_inventory[str(iteration)] = dict(self.vcenter_dict)
+        self.serialize_iteration(iteration)
+        self.successful_iteration_list.append(iteration)
+        self.snapshot_iteration = iteration
+        for target in self.vcenter_dict:
+            self.target_tokens[target] = None
+        print("serving snapshot of iteration", str(iteration), "from", os.environ['SNAPSHOT'],
+              "until the first build is done")
+
+    # the snapshot keeps the json views, their parent uuids are enough to put the tree together again
+    def tree_from_views(self, target, inventory):
+        objects = dict()
+        vcenter = None
+        for uuid, entry in inventory['vcenters'][target].items():
+            vcenter = Vcenter(target=target, token=entry['token'], name=entry['name'], uuid=uuid)
+            objects[uuid] = vcenter
+        for kind, resource_class, parent_key, attribute in [
+                ('datacenters', Datacenter, 'parent_vcenter_uuid', 'datacenter'),
+                ('clusters', Cluster, 'parent_dc_uuid', 'clusters'),
+                ('hosts', Host, 'parent_cluster_uuid', 'hosts'),
+                ('datastores', Datastore, 'parent_host_uuid', 'datastores'),
+                ('vms', VirtualMachine, 'parent_host_uuid', 'vms')]:
+            for uuid, entry in inventory.get(kind, dict()).get(target, dict()).items():
+                if entry[parent_key] not in objects:
+                    continue
+                resource_object = resource_class(target=target, token=entry['token'], name=entry['name'], uuid=uuid)
+                getattr(objects[entry[parent_key]], attribute).append(resource_object)
+                objects[uuid] = resource_object
+        return vcenter
+
+    def save_snapshot(self):
+        if not os.environ.get('SNAPSHOT'):
+            return
+        try:
+            InventorySnapshot.save(os.environ['SNAPSHOT'], self.iteration, {
+                kind: {target: self.get_view(kind, self.iteration, target)
+                       for target in self.iterated_inventory[str(self.iteration)]} for kind in KINDS})
+        except Exception as e:
+            print("Problem saving inventory snapshot", os.environ['SNAPSHOT'], "Error:", str(e))
+
+    # every target is built in its own thread. a target that fails or is not done by TARGET_DEADLINE keeps the
+    # inventory of its last successful build, a late build is dropped. it sends no more requests after the deadline
+    # and winds down, the target is built again with the next iteration
+    def query_targets(self):
+        results = dict()
+        threads = dict()
+        until = time.monotonic() + int(os.environ.get('TARGET_DEADLINE', '600'))
+        for vrops in self.vrops_list:
+            if vrops in self.target_threads and self.target_threads[vrops].is_alive():
+                print("previous build of", vrops, "missed its deadline and is still winding down, building it again")
+            threads[vrops] = Thread(target=self.query_target, args=(vrops, self.iteration, results, until),
+                                    name='inventory-' + vrops, daemon=True)
+            threads[vrops].start()
+        self.target_threads.update(threads)
+        for vrops, thread in threads.items():
+            thread.join(max(0, until - time.monotonic()))
+            if thread.is_alive():
+                print(vrops, "missed the deadline of", os.environ.get('TARGET_DEADLINE', '600'),
+                      "seconds, keeping its last inventory")
+            elif vrops in results:
+                self.vcenter_dict[vrops] = results[vrops]
+            elif os.environ['DEBUG'] >= '1':
+                print("retrying connection to", vrops, "in next iteration", str(self.iteration + 1))
+
+    def query_target(self, vrops, iteration, results, until):
+        # the crawler and the request workers copy the context, so the deadline holds for all requests of the build
+        deadline.set(until)
+        start = time.monotonic()
+        try:
+            vcenter = self.query_vrops(vrops)
+        except Exception as e:
+            print("Problem building the inventory of", vrops, "Error:", str(e))
+            vcenter = False
+        # a build done after the deadline is dropped, so it is no success either
+        success = bool(vcenter) and time.monotonic() <= until
+        if success:
+            results[vrops] = vcenter
+        self.build_durations[vrops] = {
+            'iteration': iteration,
+            'seconds': round(time.monotonic() - start, 3),
+            'success': success
+        }
+        if os.environ['DEBUG'] >= '1':
+            print("built", vrops, "in", self.build_durations[vrops]['seconds'], "seconds")
+
     def query_vrops(self, vrops):
         if os.environ['DEBUG'] >= '1':
             print("querying " + vrops)
-        token = Vrops.get_token(target=vrops)
+        token = self.vrops.get_token(target=vrops)
         if not token:
             return False
         self.target_tokens[vrops] = token
-        vcenter = self.create_resource_objects(vrops, token)
-        self.vcenter_dict[vrops] = vcenter
-        return True
+        return self.create_resource_objects(vrops, token)
 
     def create_resource_objects(self, vrops, token):
-        for adapter in Vrops.get_adapter(target=vrops, token=token):
+        if os.environ.get('INVENTORY_MODE', 'crawl') == 'bulk':
+            return self.create_resource_objects_bulk(vrops, token)
+        for adapter in self.vrops.get_adapter(target=vrops, token=token):
             if os.environ['DEBUG'] >= '2':
                 print("Collecting vcenter: " + adapter['name'])
             vcenter = Vcenter(target=vrops, token=token, name=adapter['name'], uuid=adapter['uuid'])
             vcenter.add_datacenter()
-            for dc_object in vcenter.datacenter:
-                if os.environ['DEBUG'] >= '2':
-                    print("Collecting Datacenter: " + dc_object.name)
-                dc_object.add_cluster()
-                for cl_object in dc_object.clusters:
-                    if os.environ['DEBUG'] >= '2':
-                        print("Collecting Cluster: " + cl_object.name)
-                    cl_object.add_host()
-                    for hs_object in cl_object.hosts:
-                        if os.environ['DEBUG'] >= '2':
-                            print("Collecting Host: " + hs_object.name)
-                        hs_object.add_datastore()
-                        for ds_object in hs_object.datastores:
-                            if os.environ['DEBUG'] >= '2':
-                                print("Collecting Datastore: " + ds_object.name)
-                        hs_object.add_vm()
-                        for vm_object in hs_object.vms:
-                            if os.environ['DEBUG'] >= '2':
-                                print("Collecting VM: " + vm_object.name)
+            delta = self.get_delta_base(vrops)
+            counts = dict()
+            # the hierarchy is crawled level by level, all objects of a level at once. every object only appends
+            # to its own lists, so the tree comes out the same as when crawled one by one
+            with ThreadPoolExecutor(max_workers=int(os.environ.get('INVENTORY_CONCURRENCY', '8')),
+                                    thread_name_prefix='crawl-' + vrops) as crawler:
+                datacenters = vcenter.datacenter
+                self.crawl(crawler, datacenters, 'Datacenter', 'add_cluster')
+                clusters = [cl_object for dc_object in datacenters for cl_object in dc_object.clusters]
+                self.crawl(crawler, self.get_changed(vrops, token, clusters, ['hosts'], delta, counts),
+                           'Cluster', 'add_host')
+                hosts = [hs_object for cl_object in clusters for hs_object in cl_object.hosts]
+                self.crawl(crawler, self.get_changed(vrops, token, hosts, ['datastores', 'vms'], delta, counts),
+                           'Host', 'add_datastore', 'add_vm')
+            # the counts below must refer to the tree that is kept
+            vcenter = RecordStore.share(vcenter)
+            if delta is not None:
+                # counts that don't match what was crawled are not trusted, those subtrees are crawled again
+                self.subtree_counts[vrops] = (vcenter, {
+                    uuid: now for uuid, (resource_object, attributes, now) in counts.items()
+                    if now == tuple(len(getattr(resource_object, attribute)) for attribute in attributes)})
+            if os.environ['DEBUG'] >= '2':
+                for hs_object in hosts:
+                    for ds_object in hs_object.datastores:
+                        print("Collecting Datastore: " + ds_object.name)
+                    for vm_object in hs_object.vms:
+                        print("Collecting VM: " + vm_object.name)
             return vcenter
 
-    def get_vcenters(self):
+    # with INVENTORY_BUILD=delta returns the clusters and hosts of the last build of the target by uuid and their
+    # counts, nothing to reuse every INVENTORY_FULL_REBUILD iterations. None if every build is a full one
+    def get_delta_base(self, vrops):
+        if os.environ.get('INVENTORY_BUILD', 'full') != 'delta':
+            return None
+        previous_vcenter, previous_counts = self.subtree_counts.get(vrops, (None, dict()))
+        if self.iteration % int(os.environ.get('INVENTORY_FULL_REBUILD', '6')) == 0 or \
+                previous_vcenter is None or previous_vcenter is not self.vcenter_dict.get(vrops):
+            return dict(), dict()
+        previous = dict()
+        for dc_object in previous_vcenter.datacenter:
+            for cl_object in dc_object.clusters:
+                previous[cl_object.uuid] = cl_object
+                for hs_object in cl_object.hosts:
+                    previous[hs_object.uuid] = hs_object
+        return previous, previous_counts
+
+    # returns the objects whose children have to be crawled. the others get the children of the last build, if
+    # the vROps counters of their children are the same as then
+    def get_changed(self, vrops, token, objects, attributes, delta, counts):
+        if delta is None or not objects:
+            return objects
+        previous, previous_counts = delta
+        keys = [SUBTREE_COUNTS[attribute] for attribute in attributes]
+        stats = self.vrops.get_latest_stats_multiple(vrops, token, [resource_object.uuid for resource_object in
+                                                                    objects], keys) or dict()
+        changed = list()
+        for resource_object in objects:
+            now = tuple(stats.get((resource_object.uuid, key)) for key in keys)
+            counts[resource_object.uuid] = (resource_object, attributes, now)
+            if None in now or previous_counts.get(resource_object.uuid) != now or \
+                    resource_object.uuid not in previous:
+                changed.append(resource_object)
+                continue
+            for attribute in attributes:
+                setattr(resource_object, attribute, [
+                    type(child)(target=vrops, token=token, name=child.name, uuid=child.uuid)
+                    for child in getattr(previous[resource_object.uuid], attribute)])
+        if os.environ['DEBUG'] >= '1':
+            print(vrops, "reusing", len(objects) - len(changed), "of", len(objects), "subtrees with", attributes)
+        return changed
+
+    # calls the add methods of all objects on the crawler's threads and waits for them. the crawler threads are
+    # not the ones of the request executor, so the pages they fetch in turn can't starve them
+    def crawl(self, crawler, objects, kind, *methods):
+        futures = list()
+        for resource_object in objects:
+            if os.environ['DEBUG'] >= '2':
+                print("Collecting " + kind + ": " + resource_object.name)
+            for method in methods:
+                futures.append(crawler.submit(copy_context().run, getattr(resource_object, method)))
+        for future in futures:
+            future.result()
+
+    # every kind is listed once for the whole target and hung below its parents, which are looked up with chunked
+    # bulk relationship queries. this needs a few requests per kind instead of one per parent
+    def create_resource_objects_bulk(self, vrops, token):
+        for adapter in self.vrops.get_adapter(target=vrops, token=token):
+            if os.environ['DEBUG'] >= '2':
+                print("Collecting vcenter: " + adapter['name'])
+            vcenter = Vcenter(target=vrops, token=token, name=adapter['name'], uuid=adapter['uuid'])
+            vcenter.add_datacenter()
+            datacenters = {dc_object.uuid: dc_object for dc_object in vcenter.datacenter}
+            clusters = self.add_children(vrops, token, datacenters, 'Datacenter', 'ClusterComputeResource', Cluster,
+                                         'clusters')
+            hosts = self.add_children(vrops, token, clusters, 'ClusterComputeResource', 'HostSystem', Host, 'hosts')
+            self.add_children(vrops, token, hosts, 'HostSystem', 'Datastore', Datastore, 'datastores')
+            self.add_children(vrops, token, hosts, 'HostSystem', 'VirtualMachine', VirtualMachine, 'vms')
+            return RecordStore.share(vcenter)
+
+    # adds every resource of resourcekind to the list attribute of each of its parents and returns the added
+    # objects by uuid. a resource with several parents, like a datastore mounted on several hosts, is added to each.
+    # resources without a known parent would be missing from the tree, so the build fails if chunks were given up on
+    def add_children(self, vrops, token, parents, parentkind, resourcekind, resource_class, attribute):
+        children = dict()
+        resources = self.vrops().get_resources(target=vrops, token=token, resourcekind=resourcekind, parentid=None)
+        if not resources or not parents:
+            return children
+        relationships = self.vrops.get_relationships(vrops, token, [resource['uuid'] for resource in resources],
+                                                     'PARENT', parentkind)
+        if relationships is False:
+            raise IncompleteError("parents of " + resourcekind + " of " + vrops + " could not all be looked up")
+        for resource in resources:
+            for parent_uuid in relationships.get(resource['uuid'], list()):
+                if parent_uuid not in parents:
+                    continue
+                if os.environ['DEBUG'] >= '2':
+                    print("Collecting " + resourcekind + ": " + resource['name'])
+                child = resource_class(target=vrops, token=token, name=resource['name'], uuid=resource['uuid'])
+                getattr(parents[parent_uuid], attribute).append(child)
+                children[resource['uuid']] = child
+        return children
+
+    def get_vcenters(self, vcenter):
+        token = self.target_tokens.get(vcenter.target)
+        tree = dict()
+        tree[vcenter.uuid] = {
+                'uuid': vcenter.uuid,
+                'name': vcenter.name,
+                'target': vcenter.target,
+                'token': token,
+                }
+        return tree
+
+    def get_datacenters(self, vcenter):
+        token = self.target_tokens.get(vcenter.target)
         tree = dict()
-        for vcenter_entry in self.vcenter_dict:
-            vcenter = self.vcenter_dict[vcenter_entry]
-            tree[vcenter.target] = dict()
-            tree[vcenter.target][vcenter.uuid] = {
-                    'uuid': vcenter.uuid,
-                    'name': vcenter.name,
-                    'target': vcenter.target,
-                    'token': vcenter.token,
+        for dc in vcenter.datacenter:
+            tree[dc.uuid] = {
+                    'uuid': dc.uuid,
+                    'name': dc.name,
+                    'parent_vcenter_uuid': vcenter.uuid,
+                    'parent_vcenter_name': vcenter.name,
+                    'vcenter': vcenter.name,
+                    'target': dc.target,
+                    'token': token,
                     }
-        self.iterated_inventory[str(self.iteration)]['vcenters'] = tree
         return tree
 
-    def get_datacenters(self):
+    def get_clusters(self, vcenter):
+        token = self.target_tokens.get(vcenter.target)
         tree = dict()
-        for vcenter_entry in self.vcenter_dict:
-            vcenter = self.vcenter_dict[vcenter_entry]
-            tree[vcenter.target] = dict()
-            for dc in vcenter.datacenter:
-                tree[vcenter.target][dc.uuid] = {
-                        'uuid': dc.uuid,
-                        'name': dc.name,
-                        'parent_vcenter_uuid': vcenter.uuid,
-                        'parent_vcenter_name': vcenter.name,
+        for dc in vcenter.datacenter:
+            for cluster in dc.clusters:
+                tree[cluster.uuid] = {
+                        'uuid': cluster.uuid,
+                        'name': cluster.name,
+                        'parent_dc_uuid': dc.uuid,
+                        'parent_dc_name': dc.name,
                         'vcenter': vcenter.name,
-                        'target': dc.target,
-                        'token': dc.token,
+                        'target': cluster.target,
+                        'token': token,
                         }
-        self.iterated_inventory[str(self.iteration)]['datacenters'] = tree
         return tree
 
-    def get_clusters(self):
+    def get_hosts(self, vcenter):
+        token = self.target_tokens.get(vcenter.target)
         tree = dict()
-        for vcenter_entry in self.vcenter_dict:
-            vcenter = self.vcenter_dict[vcenter_entry]
-            tree[vcenter.target] = dict()
-            for dc in vcenter.datacenter:
-                for cluster in dc.clusters:
-                    tree[vcenter.target][cluster.uuid] = {
-                            'uuid': cluster.uuid,
-                            'name': cluster.name,
-                            'parent_dc_uuid': dc.uuid,
-                            'parent_dc_name': dc.name,
+        for dc in vcenter.datacenter:
+            for cluster in dc.clusters:
+                for host in cluster.hosts:
+                    tree[host.uuid] = {
+                            'uuid': host.uuid,
+                            'name': host.name,
+                            'parent_cluster_uuid': cluster.uuid,
+                            'parent_cluster_name': cluster.name,
+                            'datacenter': dc.name,
                             'vcenter': vcenter.name,
-                            'target': cluster.target,
-                            'token': cluster.token,
+                            'target': host.target,
+                            'token': token,
                             }
-        self.iterated_inventory[str(self.iteration)]['clusters'] = tree
         return tree
 
-    def get_hosts(self):
+    def get_datastores(self, vcenter):
+        token = self.target_tokens.get(vcenter.target)
         tree = dict()
-        for vcenter_entry in self.vcenter_dict:
-            vcenter = self.vcenter_dict[vcenter_entry]
-            tree[vcenter.target] = dict()
-            for dc in vcenter.datacenter:
-                for cluster in dc.clusters:
-                    for host in cluster.hosts:
-                        tree[vcenter.target][host.uuid] = {
-                                'uuid': host.uuid,
-                                'name': host.name,
-                                'parent_cluster_uuid': cluster.uuid,
-                                'parent_cluster_name': cluster.name,
+        for dc in vcenter.datacenter:
+            for cluster in dc.clusters:
+                for host in cluster.hosts:
+                    for ds in host.datastores:
+                        tree[ds.uuid] = {
+                                'uuid': ds.uuid,
+                                'name': ds.name,
+                                'type': ds.type,
+                                'parent_host_uuid': host.uuid,
+                                'parent_host_name': host.name,
+                                'cluster': cluster.name,
                                 'datacenter': dc.name,
                                 'vcenter': vcenter.name,
-                                'target': host.target,
-                                'token': host.token,
+                                'target': ds.target,
+                                'token': token,
                                 }
-        self.iterated_inventory[str(self.iteration)]['hosts'] = tree
         return tree
 
-    def get_datastores(self):
+    def get_vms(self, vcenter):
+        token = self.target_tokens.get(vcenter.target)
         tree = dict()
-        for vcenter_entry in self.vcenter_dict:
-            vcenter = self.vcenter_dict[vcenter_entry]
-            tree[vcenter.target] = dict()
-            for dc in vcenter.datacenter:
-                for cluster in dc.clusters:
-                    for host in cluster.hosts:
-                        for ds in host.datastores:
-                            tree[vcenter.target][ds.uuid] = {
-                                    'uuid': ds.uuid,
-                                    'name': ds.name,
-                                    'type': ds.type,
-                                    'parent_host_uuid': host.uuid,
-                                    'parent_host_name': host.name,
-                                    'cluster': cluster.name,
-                                    'datacenter': dc.name,
-                                    'vcenter': vcenter.name,
-                                    'target': ds.target,
-                                    'token': ds.token,
-                                    }
-        self.iterated_inventory[str(self.iteration)]['datastores'] = tree
-        return tree
-
-    def get_vms(self):
-        tree = dict()
-        for vcenter_entry in self.vcenter_dict:
-            vcenter = self.vcenter_dict[vcenter_entry]
-            tree[vcenter.target] = dict()
-            for dc in vcenter.datacenter:
-                for cluster in dc.clusters:
-                    for host in cluster.hosts:
-                        for vm in host.vms:
-                            tree[vcenter.target][vm.uuid] = {
-                                    'uuid': vm.uuid,
-                                    'name': vm.name,
-                                    'parent_host_uuid': host.uuid,
-                                    'parent_host_name': host.name,
-                                    'cluster': cluster.name,
-                                    'datacenter': dc.name,
-                                    'vcenter': vcenter.name,
-                                    'target': vm.target,
-                                    'token': vm.token,
-                                    }
-        self.iterated_inventory[str(self.iteration)]['vms'] = tree
+        for dc in vcenter.datacenter:
+            for cluster in dc.clusters:
+                for host in cluster.hosts:
+                    for vm in host.vms:
+                        tree[vm.uuid] = {
+                                'uuid': vm.uuid,
+                                'name': vm.name,
+                                'parent_host_uuid': host.uuid,
+                                'parent_host_name': host.name,
+                                'cluster': cluster.name,
+                                'datacenter': dc.name,
+                                'vcenter': vcenter.name,
+                                'target': vm.target,
+                                'token': token,
+                                }
         return tree
@@ -1,5 +1,4 @@
 from BaseCollector import BaseCollector
-from tools.Vrops import Vrops
 import os
 
 
@@ -12,6 +11,7 @@ class ClusterPropertiesCollector(BaseCollector):
         self.vrops_entity_name = 'cluster'
 
     def collect(self):
+        self.set_request_flow()
         gauges = self.generate_gauges('property', self.name, self.vrops_entity_name,
                                       ['vcenter', 'vccluster', 'datacenter'])
         infos = self.generate_infos(self.name, self.vrops_entity_name,
@@ -22,23 +22,20 @@ class ClusterPropertiesCollector(BaseCollector):
         if os.environ['DEBUG'] >= '1':
             print(self.name, 'starts with collecting the metrics')
 
-        token = self.get_target_tokens()
-        token = token[self.target]
+        token = self.get_target_token()
 
         if not token:
             print("skipping", self.target, "in", self.name, ", no token")
+            return
 
         uuids = self.get_clusters_by_target()
+        number_values, enum_values, info_values = self.get_properties_by_family(token, uuids, gauges, states, infos)
         for metric_suffix in gauges:
             propkey = gauges[metric_suffix]['property']
-            values = Vrops.get_latest_number_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'data' not in value_entry:
+            for cluster_id in uuids:
+                if (cluster_id, propkey) not in number_values:
                     continue
-                metric_value = value_entry['data']
-                cluster_id = value_entry['resourceId']
+                metric_value = number_values[(cluster_id, propkey)]
                 gauges[metric_suffix]['gauge'].add_metric(
                     labels=[self.clusters[cluster_id]['vcenter'],
                             self.clusters[cluster_id]['name'],
@@ -47,31 +44,24 @@ class ClusterPropertiesCollector(BaseCollector):
 
         for metric_suffix in states:
             propkey = states[metric_suffix]['property']
-            values = Vrops.get_latest_enum_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'value' not in value_entry:
+            for cluster_id in uuids:
+                if (cluster_id, propkey) not in enum_values:
                     continue
-                metric_value = (1 if states[metric_suffix]['expected'] == value_entry['value'] else 0)
-                cluster_id = value_entry['resourceId']
+                value = enum_values[(cluster_id, propkey)]
+                metric_value = (1 if states[metric_suffix]['expected'] == value else 0)
                 states[metric_suffix]['state'].add_metric(
                     labels=[self.clusters[cluster_id]['vcenter'],
                             self.clusters[cluster_id]['name'],
                             self.clusters[cluster_id]['parent_dc_name'].lower(),
-                            value_entry['value']],
+                            value],
                     value=metric_value)
 
         for metric_suffix in infos:
             propkey = infos[metric_suffix]['property']
-            values = Vrops.get_latest_info_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'data' not in value_entry:
+            for cluster_id in uuids:
+                if (cluster_id, propkey) not in info_values:
                     continue
-                cluster_id = value_entry['resourceId']
-                info_value = value_entry['data']
+                info_value = info_values[(cluster_id, propkey)]
                 infos[metric_suffix]['info'].add_metric(
                     labels=[self.clusters[cluster_id]['vcenter'],
                             self.clusters[cluster_id]['name'],
@@ -1,5 +1,4 @@
 from BaseCollector import BaseCollector
-from tools.Vrops import Vrops
 import os
 
 
@@ -12,6 +11,7 @@ class DatastorePropertiesCollector(BaseCollector):
         self.vrops_entity_name = 'datastore'
 
     def collect(self):
+        self.set_request_flow()
         gauges = self.generate_gauges('property', self.name, self.vrops_entity_name,
                                       [self.vrops_entity_name, 'type', 'vcenter', 'datacenter', 'vccluster',
                                        'hostsystem'])
@@ -25,23 +25,20 @@ class DatastorePropertiesCollector(BaseCollector):
         if os.environ['DEBUG'] >= '1':
             print(self.name, 'starts with collecting the metrics')
 
-        token = self.get_target_tokens()
-        token = token[self.target]
+        token = self.get_target_token()
 
         if not token:
             print("skipping", self.target, "in", self.name, ", no token")
+            return
 
         uuids = self.get_datastores_by_target()
+        number_values, enum_values, info_values = self.get_properties_by_family(token, uuids, gauges, states, infos)
         for label in gauges:
             propkey = gauges[label]['property']
-            values = Vrops.get_latest_number_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'data' not in value_entry:
+            for datastore_id in uuids:
+                if (datastore_id, propkey) not in number_values:
                     continue
-                metric_value = value_entry['data']
-                datastore_id = value_entry['resourceId']
+                metric_value = number_values[(datastore_id, propkey)]
                 gauges[label]['gauge'].add_metric(
                     labels=[self.datastores[datastore_id]['name'],
                             self.datastores[datastore_id]['type'],
@@ -53,14 +50,11 @@ class DatastorePropertiesCollector(BaseCollector):
 
         for label in states:
             propkey = states[label]['property']
-            values = Vrops.get_latest_enum_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'value' not in value_entry:
+            for datastore_id in uuids:
+                if (datastore_id, propkey) not in enum_values:
                     continue
-                metric_value = (1 if states[label]['expected'] == value_entry['value'] else 0)
-                datastore_id = value_entry['resourceId']
+                value = enum_values[(datastore_id, propkey)]
+                metric_value = (1 if states[label]['expected'] == value else 0)
                 states[label]['state'].add_metric(
                     labels=[self.datastores[datastore_id]['name'],
                             self.datastores[datastore_id]['type'],
@@ -68,19 +62,15 @@ class DatastorePropertiesCollector(BaseCollector):
                             self.datastores[datastore_id]['datacenter'].lower(),
                             self.datastores[datastore_id]['cluster'],
                             self.datastores[datastore_id]['parent_host_name'],
-                            value_entry['value']],
+                            value],
                     value=metric_value)
 
         for label in infos:
             propkey = infos[label]['property']
-            values = Vrops.get_latest_info_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'data' not in value_entry:
+            for datastore_id in uuids:
+                if (datastore_id, propkey) not in info_values:
                     continue
-                datastore_id = value_entry['resourceId']
-                info_value = value_entry['data']
+                info_value = info_values[(datastore_id, propkey)]
                 infos[label]['info'].add_metric(
                     labels=[self.datastores[datastore_id]['name'],
                             self.datastores[datastore_id]['type'],
@@ -1,5 +1,4 @@
 from BaseCollector import BaseCollector
-from tools.Vrops import Vrops
 import os
 
 
@@ -12,6 +11,7 @@ class HostSystemPropertiesCollector(BaseCollector):
         self.vrops_entity_name = 'hostsystem'
 
     def collect(self):
+        self.set_request_flow()
         gauges = self.generate_gauges('property', self.name, self.vrops_entity_name,
                                       [self.vrops_entity_name, 'vcenter', 'datacenter', 'vccluster'])
         infos = self.generate_infos(self.name, self.vrops_entity_name,
@@ -22,23 +22,20 @@ class HostSystemPropertiesCollector(BaseCollector):
         if os.environ['DEBUG'] >= '1':
             print(self.name, 'starts with collecting the metrics')
 
-        token = self.get_target_tokens()
-        token = token[self.target]
+        token = self.get_target_token()
 
         if not token:
             print("skipping", self.target, "in", self.name, ", no token")
+            return
 
         uuids = self.get_hosts_by_target()
+        number_values, enum_values, info_values = self.get_properties_by_family(token, uuids, gauges, states, infos)
         for metric_suffix in gauges:
             propkey = gauges[metric_suffix]['property']
-            values = Vrops.get_latest_number_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'data' not in value_entry:
+            for host_id in uuids:
+                if (host_id, propkey) not in number_values:
                     continue
-                metric_value = value_entry['data']
-                host_id = value_entry['resourceId']
+                metric_value = number_values[(host_id, propkey)]
                 gauges[metric_suffix]['gauge'].add_metric(
                     labels=[self.hosts[host_id]['name'],
                             self.hosts[host_id]['vcenter'],
@@ -48,31 +45,24 @@ class HostSystemPropertiesCollector(BaseCollector):
 
         for metric_suffix in states:
             propkey = states[metric_suffix]['property']
-            values = Vrops.get_latest_enum_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'value' not in value_entry:
+            for host_id in uuids:
+                if (host_id, propkey) not in enum_values:
                     continue
-                metric_value = (1 if states[metric_suffix]['expected'] == value_entry['value'] else 0)
-                host_id = value_entry['resourceId']
+                value = enum_values[(host_id, propkey)]
+                metric_value = (1 if states[metric_suffix]['expected'] == value else 0)
                 states[metric_suffix]['state'].add_metric(
                     labels=[self.hosts[host_id]['name'],
                             self.hosts[host_id]['vcenter'],
                             self.hosts[host_id]['datacenter'].lower(),
-                            self.hosts[host_id]['parent_cluster_name'], value_entry['value']],
+                            self.hosts[host_id]['parent_cluster_name'], value],
                     value=metric_value)
 
         for metric_suffix in infos:
             propkey = infos[metric_suffix]['property']
-            values = Vrops.get_latest_info_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'data' not in value_entry:
+            for host_id in uuids:
+                if (host_id, propkey) not in info_values:
                     continue
-                host_id = value_entry['resourceId']
-                info_value = value_entry['data']
+                info_value = info_values[(host_id, propkey)]
                 infos[metric_suffix]['info'].add_metric(
                     labels=[self.hosts[host_id]['name'],
                             self.hosts[host_id]['vcenter'],
@@ -1,5 +1,4 @@
 from BaseCollector import BaseCollector
-from tools.Vrops import Vrops
 import os
 
 
@@ -12,6 +11,7 @@ class VCenterPropertiesCollector(BaseCollector):
         self.vrops_entity_name = 'vcenter'
 
     def collect(self):
+        self.set_request_flow()
         gauges = self.generate_gauges('property', self.name, self.vrops_entity_name,
                                       [self.vrops_entity_name])
         infos = self.generate_infos(self.name, self.vrops_entity_name,
@@ -22,41 +22,45 @@ class VCenterPropertiesCollector(BaseCollector):
         if os.environ['DEBUG'] >= '1':
             print(self.name, 'starts with collecting the metrics')
 
-        token = self.get_target_tokens()
-        token = token[self.target]
+        token = self.get_target_token()
         if not token:
             print("skipping", self.target, "in", self.name, ", no token")
+            return
 
         vc = self.get_vcenters(self.target)
-        uuid = [vc[uuid]['uuid'] for uuid in vc][0]
+        uuids = [vc[uuid]['uuid'] for uuid in vc]
+        number_values, enum_values, info_values = self.get_properties_by_family(token, uuids, gauges, states, infos)
         for metric_suffix in gauges:
             propkey = gauges[metric_suffix]['property']
-            metric_value = Vrops.get_property(self.target, token, uuid, propkey)
-            if not metric_value:
-                continue
-            gauges[metric_suffix]['gauge'].add_metric(
-                labels=[self.vcenters[uuid]['name']],
-                value=metric_value)
+            for uuid in uuids:
+                if (uuid, propkey) not in number_values:
+                    continue
+                metric_value = number_values[(uuid, propkey)]
+                gauges[metric_suffix]['gauge'].add_metric(
+                    labels=[self.vcenters[uuid]['name']],
+                    value=metric_value)
 
         for metric_suffix in states:
             propkey = states[metric_suffix]['property']
-            value = Vrops.get_property(self.target, token, uuid, propkey)
-            if not value:
-                continue
-            metric_value = (1 if states[metric_suffix]['expected'] == value else 0)
-            states[metric_suffix]['state'].add_metric(
-                labels=[self.vcenters[uuid]['name'],
-                        value],
-                value=metric_value)
+            for uuid in uuids:
+                if (uuid, propkey) not in enum_values:
+                    continue
+                value = enum_values[(uuid, propkey)]
+                metric_value = (1 if states[metric_suffix]['expected'] == value else 0)
+                states[metric_suffix]['state'].add_metric(
+                    labels=[self.vcenters[uuid]['name'],
+                            value],
+                    value=metric_value)
 
         for metric_suffix in infos:
             propkey = infos[metric_suffix]['property']
-            info_value = Vrops.get_property(self.target, token, uuid, propkey)
-            if not info_value:
-                continue
-            infos[metric_suffix]['info'].add_metric(
-                labels=[self.vcenters[uuid]['name']],
-                value={metric_suffix: info_value})
+            for uuid in uuids:
+                if (uuid, propkey) not in info_values:
+                    continue
+                info_value = info_values[(uuid, propkey)]
+                infos[metric_suffix]['info'].add_metric(
+                    labels=[self.vcenters[uuid]['name']],
+                    value={metric_suffix: info_value})
 
         for metric_suffix in gauges:
             yield gauges[metric_suffix]['gauge']
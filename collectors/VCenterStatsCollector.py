@@ -1,6 +1,5 @@
 from BaseCollector import BaseCollector
 import os
-from tools.Vrops import Vrops
 
 
 
@@ -13,28 +12,35 @@ class VCenterStatsCollector(BaseCollector):
         self.wait_for_inventory_data()
 
     def collect(self):
+        self.set_request_flow()
         gauges = self.generate_gauges('stats', self.name, self.vrops_entity_name,
                                       [self.vrops_entity_name])
 
         if os.environ['DEBUG'] >= '1':
             print(self.name, 'starts with collecting the metrics')
 
-        token = self.get_target_tokens()
-        token = token[self.target]
+        token = self.get_target_token()
         if not token:
             print("skipping " + self.target + " in", self.name, ", no token")
+            return
 
         vc = self.get_vcenters(self.target)
-        uuid = [vc[uuid]['uuid'] for uuid in vc][0]
+        uuids = [vc[uuid]['uuid'] for uuid in vc]
+        # one bulk query returns every statkey of every vcenter of the target
+        statkeys = [gauges[metric_suffix]['statkey'] for metric_suffix in gauges]
+        values = self.vrops.get_latest_stats_multiple(self.target, token, uuids, statkeys)
+        if not values:
+            print("skipping statkeys in", self.name, ", no return")
+            return
+
         for metric_suffix in gauges:
             statkey = gauges[metric_suffix]['statkey']
-            values = Vrops.get_latest_stat(self.target, token, uuid, statkey)
-            if not values:
-                print("skipping statkey " + str(statkey) + " in", self.name, ", no return")
-                continue
-            metric_value = float(values)
-            gauges[metric_suffix]['gauge'].add_metric(labels=[self.vcenters[uuid]['name']],
-                                                      value=metric_value)
+            for uuid in uuids:
+                if (uuid, statkey) not in values:
+                    continue
+                metric_value = float(values[(uuid, statkey)])
+                gauges[metric_suffix]['gauge'].add_metric(labels=[self.vcenters[uuid]['name']],
+                                                          value=metric_value)
 
         for metric_suffix in gauges:
             yield gauges[metric_suffix]['gauge']
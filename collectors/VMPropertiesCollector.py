@@ -1,5 +1,4 @@
 from BaseCollector import BaseCollector
-from tools.Vrops import Vrops
 import os
 
 
@@ -12,6 +11,7 @@ class VMPropertiesCollector(BaseCollector):
         self.vrops_entity_name = 'virtualmachine'
 
     def collect(self):
+        self.set_request_flow()
         gauges = self.generate_gauges('property', self.name, self.vrops_entity_name,
                                       [self.vrops_entity_name, 'vcenter', 'datacenter', 'vccluster', 'hostsystem',
                                        'project'])
@@ -27,28 +27,21 @@ class VMPropertiesCollector(BaseCollector):
         if os.environ['DEBUG'] >= '1':
             print(self.name, 'starts with collecting the metrics')
 
-        token = self.get_target_tokens()
-        token = token[self.target]
+        token = self.get_target_token()
 
         if not token:
             print("skipping", self.target, "in", self.name, ", no token")
+            return
 
         uuids = self.get_vms_by_target()
+        number_values, enum_values, info_values = self.get_properties_by_family(token, uuids, gauges, states, infos)
         for metric_suffix in gauges:
             propkey = gauges[metric_suffix]['property']
-            values = Vrops.get_latest_number_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'data' not in value_entry:
+            for vm_id in uuids:
+                if (vm_id, propkey) not in number_values:
                     continue
-                metric_value = value_entry['data']
-                vm_id = value_entry['resourceId']
-                project_id = "internal"
-                if project_ids:
-                    for vm_id_project_mapping in project_ids:
-                        if vm_id in vm_id_project_mapping:
-                            project_id = vm_id_project_mapping[vm_id]
+                metric_value = number_values[(vm_id, propkey)]
+                project_id = project_ids.get(vm_id, "internal")
                 gauges[metric_suffix]['gauge'].add_metric(
                     labels=[self.vms[vm_id]['name'],
                             self.vms[vm_id]['vcenter'],
@@ -60,44 +53,29 @@ class VMPropertiesCollector(BaseCollector):
 
         for metric_suffix in states:
             propkey = states[metric_suffix]['property']
-            values = Vrops.get_latest_enum_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'value' not in value_entry:
+            for vm_id in uuids:
+                if (vm_id, propkey) not in enum_values:
                     continue
-                data = (1 if states[metric_suffix]['expected'] == value_entry['value'] else 0)
-                vm_id = value_entry['resourceId']
-                project_id = "internal"
-                if project_ids:
-                    for vm_id_project_mapping in project_ids:
-                        if vm_id in vm_id_project_mapping:
-                            project_id = vm_id_project_mapping[vm_id]
+                value = enum_values[(vm_id, propkey)]
+                data = (1 if states[metric_suffix]['expected'] == value else 0)
+                project_id = project_ids.get(vm_id, "internal")
                 states[metric_suffix]['state'].add_metric(
                     labels=[self.vms[vm_id]['name'],
                             self.vms[vm_id]['vcenter'],
                             self.vms[vm_id]['datacenter'].lower(),
                             self.vms[vm_id]['cluster'],
                             self.vms[vm_id]['parent_host_name'],
-                            value_entry['value'],
+                            value,
                             project_id],
                     value=data)
 
         for metric_suffix in infos:
             propkey = infos[metric_suffix]['property']
-            values = Vrops.get_latest_info_properties_multiple(self.target, token, uuids, propkey)
-            if not values:
-                continue
-            for value_entry in values:
-                if 'data' not in value_entry:
+            for vm_id in uuids:
+                if (vm_id, propkey) not in info_values:
                     continue
-                vm_id = value_entry['resourceId']
-                project_id = "internal"
-                if project_ids:
-                    for vm_id_project_mapping in project_ids:
-                        if vm_id in vm_id_project_mapping:
-                            project_id = vm_id_project_mapping[vm_id]
-                info_value = value_entry['data']
+                project_id = project_ids.get(vm_id, "internal")
+                info_value = info_values[(vm_id, propkey)]
                 infos[metric_suffix]['info'].add_metric(
                     labels=[self.vms[vm_id]['name'],
                             self.vms[vm_id]['vcenter'],
@@ -1,5 +1,4 @@
 from BaseCollector import BaseCollector
-from tools.Vrops import Vrops
 import os
 
 
@@ -12,6 +11,7 @@ class VMStatsCollector(BaseCollector):
         self.name = self.__class__.__name__
 
     def collect(self):
+        self.set_request_flow()
         gauges = self.generate_gauges('stats', self.name, self.vrops_entity_name,
                                       [self.vrops_entity_name, 'vcenter', 'datacenter', 'vccluster', 'hostsystem', 'project'])
         project_ids = self.get_project_ids_by_target()
@@ -19,42 +19,38 @@ class VMStatsCollector(BaseCollector):
         if os.environ['DEBUG'] >= '1':
             print(self.name, 'starts with collecting the metrics')
 
-        token = self.get_target_tokens()
-        token = token[self.target]
+        token = self.get_target_token()
 
         if not token:
             print("skipping " + self.target + " in " + self.name + ", no token")
+            return
 
         uuids = self.get_vms_by_target()
+        statkeys = [gauges[metric_suffix]['statkey'] for metric_suffix in gauges]
+        values = self.vrops.get_latest_stats_multiple(self.target, token, uuids, statkeys)
+        if not values:
+            print("skipping statkeys in", self.name, ", no return")
+            return
+        if os.environ['DEBUG'] >= '1':
+            print(self.target, statkeys)
+            print("amount uuids", str(len(uuids)))
+            print("fetched     ", str(len(values)))
+
         for metric_suffix in gauges:
             statkey = gauges[metric_suffix]['statkey']
-            values = Vrops.get_latest_stat_multiple(self.target, token, uuids, statkey)
-            if os.environ['DEBUG'] >= '1':
-                print(self.target, statkey)
-                print("amount uuids", str(len(uuids)))
-                print("fetched     ", str(len(values)))
-            if not values:
-                print("skipping statkey " + str(statkey) + " in", self.name, ", no return")
-                continue
-
-            for value_entry in values:
-                metric_value = value_entry['stat-list']['stat'][0]['data']
-                if metric_value:
-                    metric_value = metric_value[0]
-                    vm_id = value_entry['resourceId']
-                    project_id = "internal"
-                    if project_ids:
-                        for vm_id_project_mapping in project_ids:
-                            if vm_id in vm_id_project_mapping:
-                                project_id = vm_id_project_mapping[vm_id]
-                    gauges[metric_suffix]['gauge'].add_metric(
-                        labels=[self.vms[vm_id]['name'],
-                                self.vms[vm_id]['vcenter'],
-                                self.vms[vm_id]['datacenter'].lower(),
-                                self.vms[vm_id]['cluster'],
-                                self.vms[vm_id]['parent_host_name'],
-                                project_id],
-                        value=metric_value)
+            for vm_id in uuids:
+                if (vm_id, statkey) not in values:
+                    continue
+                metric_value = values[(vm_id, statkey)]
+                project_id = project_ids.get(vm_id, "internal")
+                gauges[metric_suffix]['gauge'].add_metric(
+                    labels=[self.vms[vm_id]['name'],
+                            self.vms[vm_id]['vcenter'],
+                            self.vms[vm_id]['datacenter'].lower(),
+                            self.vms[vm_id]['cluster'],
+                            self.vms[vm_id]['parent_host_name'],
+                            project_id],
+                    value=metric_value)
 
         for metric_suffix in gauges:
             yield gauges[metric_suffix]['gauge']
@@ -1,18 +1,21 @@
-from tools.Vrops import Vrops
+from tools.Vrops import transport
 from resources.Host import Host
+import sys
 
 
 class Cluster:
+    __slots__ = ('target', 'token', 'name', 'uuid', 'hosts', '__weakref__')
+    children = ('hosts',)
 
     def __init__(self, target, token, name, uuid):
         self.target = target
         self.token = token
-        self.name = name
-        self.uuid = uuid
+        self.name = sys.intern(name)
+        self.uuid = sys.intern(uuid)
         self.hosts = list()
 
     def add_host(self):
-        vrops = Vrops()
+        vrops = transport()()
         for hosts in vrops.get_hosts(target=self.target, token=self.token, parentid=self.uuid):
             self.hosts.append(Host(target=self.target, token=self.token, name=hosts['name'],
                                    uuid=hosts['uuid']))
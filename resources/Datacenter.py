@@ -1,18 +1,21 @@
-from tools.Vrops import Vrops
+from tools.Vrops import transport
 from resources.Cluster import Cluster
+import sys
 
 
 class Datacenter:
+    __slots__ = ('target', 'token', 'name', 'uuid', 'clusters', '__weakref__')
+    children = ('clusters',)
 
     def __init__(self, target, token, name, uuid):
         self.target = target
         self.token = token
-        self.name = name
-        self.uuid = uuid
+        self.name = sys.intern(name)
+        self.uuid = sys.intern(uuid)
         self.clusters = list()
 
     def add_cluster(self):
-        vrops = Vrops()
-        for cluster in Vrops.get_cluster(vrops, target=self.target, token=self.token, parentid=self.uuid):
+        vrops = transport()()
+        for cluster in vrops.get_cluster(target=self.target, token=self.token, parentid=self.uuid):
             self.clusters.append(Cluster(target=self.target, token=self.token, name=cluster['name'],
                                          uuid=cluster['uuid']))
@@ -1,10 +1,15 @@
+import sys
+
+
 class Datastore:
+    __slots__ = ('target', 'token', 'name', 'uuid', 'type', '__weakref__')
+    children = ()
 
     def __init__(self, target, token, name, uuid):
         self.target = target
         self.token = token
-        self.name = str(name)
-        self.uuid = uuid
+        self.name = sys.intern(str(name))
+        self.uuid = sys.intern(uuid)
         self.type = self.get_type()
 
     def get_type(self):
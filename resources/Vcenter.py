@@ -1,17 +1,23 @@
-from tools.Vrops import Vrops
+from tools.Vrops import transport
 from resources.Datacenter import Datacenter
+import sys
 
 
 class Vcenter:
+    # the inventory holds the records of several iterations at once, so the resource classes have no __dict__.
+    # names and uuids are interned and shared by all iterations
+    __slots__ = ('target', 'token', 'uuid', 'name', 'datacenter', '__weakref__')
+    # attributes holding the child records, lists while crawling and tuples once shared by RecordStore
+    children = ('datacenter',)
 
     def __init__(self, target, token, name, uuid):
         self.target = target
         self.token = token
-        self.uuid = uuid
-        self.name = name
+        self.uuid = sys.intern(uuid)
+        self.name = sys.intern(name)
         self.datacenter = list()
 
     def add_datacenter(self):
-        vrops = Vrops()
-        for dc in Vrops.get_datacenter(vrops, target=self.target, token=self.token, parentid=self.uuid):
+        vrops = transport()()
+        for dc in vrops.get_datacenter(target=self.target, token=self.token, parentid=self.uuid):
             self.datacenter.append(Datacenter(target=self.target, token=self.token, name=dc['name'], uuid=dc['uuid']))
@@ -1,7 +1,12 @@
+import sys
+
+
 class VirtualMachine:
+    __slots__ = ('target', 'token', 'name', 'uuid', '__weakref__')
+    children = ()
 
     def __init__(self, target, token, name, uuid):
         self.target = target
         self.token = token
-        self.name = name
-        self.uuid = uuid
+        self.name = sys.intern(name)
+        self.uuid = sys.intern(uuid)
@@ -0,0 +1,48 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from tools.AdaptiveChunker import AdaptiveChunker
+from prometheus_client import REGISTRY
+import os
+import unittest
+
+
+class TestAdaptiveChunker(TestCase):
+    os.environ['CHUNK_MIN'] = '100'
+    os.environ['CHUNK_MAX'] = '1000'
+    os.environ['CHUNK_SLOW_SECONDS'] = '4'
+
+    def test_shrink_and_grow(self):
+        target = 'shrinking.test'
+        self.assertEqual(AdaptiveChunker.get_size(target, 'stats'), 1000, 'should start with CHUNK_MAX')
+
+        AdaptiveChunker.record(target, 'stats', 1000, 10, failed=True)
+        self.assertEqual(AdaptiveChunker.get_size(target, 'stats'), 500, 'timeouts should halve the chunk')
+        AdaptiveChunker.record(target, 'stats', 500, 6)
+        self.assertEqual(AdaptiveChunker.get_size(target, 'stats'), 375, 'slow chunks should shrink the chunk')
+        AdaptiveChunker.record(target, 'stats', 20, 0.1)
+        self.assertEqual(AdaptiveChunker.get_size(target, 'stats'), 375, 'small rest chunks say nothing')
+
+        for _ in range(5):
+            AdaptiveChunker.record(target, 'stats', 1000, 10, failed=True)
+        self.assertEqual(AdaptiveChunker.get_size(target, 'stats'), 100, 'CHUNK_MIN is the lower bound')
+        for _ in range(100):
+            AdaptiveChunker.record(target, 'stats', AdaptiveChunker.get_size(target, 'stats'), 0.2)
+        self.assertEqual(AdaptiveChunker.get_size(target, 'stats'), 1000, 'CHUNK_MAX is the upper bound')
+
+        self.assertEqual(AdaptiveChunker.get_size(target, 'properties'), 1000, 'endpoints learn separately')
+        self.assertEqual(REGISTRY.get_sample_value('vrops_exporter_chunk_size',
+                                                   {'target': target, 'endpoint': 'stats'}), 1000)
+
+    def test_chunks_follow_size(self):
+        target = 'chunking.test'
+        uuids = ['uuid-' + str(i) for i in range(2600)]
+        sizes = list()
+        for chunk in AdaptiveChunker.chunks(target, 'relationships', uuids):
+            sizes.append(len(chunk))
+            AdaptiveChunker.record(target, 'relationships', len(chunk), 9, failed=True)
+        self.assertEqual(sizes, [1000, 500, 250, 125] + [100] * 7 + [25])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from unittest.mock import patch
+from tools.CircuitBreaker import CircuitBreaker, CircuitOpenError
+from prometheus_client import REGISTRY
+import os
+import unittest
+
+
+class TestCircuitBreaker(TestCase):
+    os.environ['BREAKER_FAILURES'] = '3'
+    os.environ['BREAKER_RESET_SECONDS'] = '60'
+
+    def state_sample(self, target):
+        return REGISTRY.get_sample_value('vrops_exporter_circuit_state', {'target': target})
+
+    @patch('builtins.print')
+    def test_open_probe_close(self, mocked_print):
+        target = 'breaking.test'
+        for _ in range(3):
+            CircuitBreaker.before_request(target)
+            CircuitBreaker.failure(target)
+        self.assertEqual(CircuitBreaker.get_state(target), 'open')
+        self.assertEqual(self.state_sample(target), 2)
+        with self.assertRaises(CircuitOpenError):
+            CircuitBreaker.before_request(target)
+
+        with patch('time.monotonic', return_value=CircuitBreaker.breakers[target]['opened'] + 61):
+            CircuitBreaker.before_request(target)
+            self.assertEqual(CircuitBreaker.get_state(target), 'half-open')
+            with self.assertRaises(CircuitOpenError, msg='only one probe at a time'):
+                CircuitBreaker.before_request(target)
+            CircuitBreaker.success(target)
+        self.assertEqual(CircuitBreaker.get_state(target), 'closed')
+        self.assertEqual(self.state_sample(target), 0)
+        CircuitBreaker.before_request(target)
+
+    @patch('builtins.print')
+    def test_failed_probe_reopens(self, mocked_print):
+        target = 'still-broken.test'
+        for _ in range(3):
+            CircuitBreaker.failure(target)
+        with patch('time.monotonic', return_value=CircuitBreaker.breakers[target]['opened'] + 61):
+            CircuitBreaker.before_request(target)
+            CircuitBreaker.failure(target)
+            self.assertEqual(CircuitBreaker.get_state(target), 'open')
+            with self.assertRaises(CircuitOpenError):
+                CircuitBreaker.before_request(target)
+
+
+if __name__ == '__main__':
+    unittest.main()
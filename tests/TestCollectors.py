@@ -66,11 +66,9 @@ class TestCollectors(unittest.TestCase):
                           {'name': 'B121_Management_DS03', 'uuid': '7422-91h7-52s842060815'}])
         Vrops.get_resources = MagicMock(return_value=[{'name': 'resource1', 'uuid': '5628-9ba1-55e847050814'},
                                                       {'name': 'resource2', 'uuid': '5628-9ba1-55e847050815'}])
-        Vrops.get_latest_stat = MagicMock(return_value=1)
-        Vrops.get_property = MagicMock(return_value="test_property")
-        Vrops.get_project_ids = MagicMock(return_value=[{"3628-93a1-56e84634050814": "0815"},
-                                                        {"7422-91h7-52s842060815": "0815"},
-                                                        {"5628-9ba1-55e847050815": "internal"}])
+        Vrops.get_project_ids = MagicMock(return_value={"3628-93a1-56e84634050814": "0815",
+                                                        "7422-91h7-52s842060815": "0815",
+                                                        "5628-9ba1-55e847050815": "internal"})
         thread = Thread(target=InventoryBuilder, args=('./tests/test.json', 8000, 180))
         thread.daemon = True
         thread.start()
@@ -81,62 +79,42 @@ class TestCollectors(unittest.TestCase):
             if 'Stats' in collector:
                 # mocking all values from yaml
                 statkey_yaml = yaml_read(os.environ['CONFIG'])['statkeys']
-                multiple_metrics_generated = list()
+                multiple_stats_generated = dict()
                 for statkey_pair in statkey_yaml[collector]:
-                    multiple_metrics_generated.append({"resourceId": "3628-93a1-56e84634050814", "stat-list": {"stat": [
-                        {"timestamps": [1582797716394], "statKey": {"key": statkey_pair['statkey']}, "data": [88.0]}]}})
-                    multiple_metrics_generated.append({"resourceId": "5628-9ba1-55e847050815", "stat-list": {"stat": [
-                        {"timestamps": [1582797716394], "statKey": {"key": statkey_pair['statkey']}, "data": [44.0]}]}})
-                    multiple_metrics_generated.append({"resourceId": "7422-91h7-52s842060815", "stat-list": {"stat": [
-                        {"timestamps": [1582797716394], "statKey": {"key": statkey_pair['statkey']}, "data": [55.0]}]}})
-                Vrops.get_latest_stat_multiple = MagicMock(return_value=multiple_metrics_generated)
+                    if 'VCenter' in collector:
+                        multiple_stats_generated[("5628-9ba1-55e84701", statkey_pair['statkey'])] = 99.0
+                        continue
+                    multiple_stats_generated[("3628-93a1-56e84634050814", statkey_pair['statkey'])] = 88.0
+                    multiple_stats_generated[("5628-9ba1-55e847050815", statkey_pair['statkey'])] = 44.0
+                    multiple_stats_generated[("7422-91h7-52s842060815", statkey_pair['statkey'])] = 55.0
+                Vrops.get_latest_stats_multiple = MagicMock(return_value=multiple_stats_generated)
 
             if "Properties" in collector:
                 propkey_yaml = yaml_read(os.environ['CONFIG'])['properties']
-                multiple_enum_properties_generated = list()
+                multiple_properties_generated = dict()
+                if 'VCenter' in collector:
+                    resource_ids = ['5628-9ba1-55e84701']
+                else:
+                    resource_ids = ['3628-93a1-56e84634050814', '5628-9ba1-55e847050815', '7422-91h7-52s842060815']
                 if 'enum_metrics' in propkey_yaml[collector]:
                     for propkey_pair in propkey_yaml[collector]['enum_metrics']:
-                        multiple_enum_properties_generated.append({'resourceId': '3628-93a1-56e84634050814',
-                                                                   'propkey': propkey_pair['property'],
-                                                                   'value': "test_enum_property"})
-                        multiple_enum_properties_generated.append({'resourceId': "5628-9ba1-55e847050815",
-                                                                   'propkey': propkey_pair['property'],
-                                                                   'value': "test_enum_property"})
-                        multiple_enum_properties_generated.append({'resourceId': "7422-91h7-52s842060815",
-                                                                   'propkey': propkey_pair['property'],
-                                                                   'value': "test_enum_property"})
-                Vrops.get_latest_enum_properties_multiple = MagicMock(
-                    return_value=multiple_enum_properties_generated)
-
-                multiple_number_properties_generated = list()
+                        for resource_id in resource_ids:
+                            multiple_properties_generated[(resource_id, propkey_pair['property'])] = {
+                                'statKey': propkey_pair['property'], 'values': ["test_enum_property"]}
+
                 if 'number_metrics' in propkey_yaml[collector]:
                     for propkey_pair in propkey_yaml[collector]['number_metrics']:
-                        multiple_number_properties_generated.append({'resourceId': '3628-93a1-56e84634050814',
-                                                                     'propkey': propkey_pair['property'],
-                                                                     'data': 19.54})
-                        multiple_number_properties_generated.append({'resourceId': "5628-9ba1-55e847050815",
-                                                                     'propkey': propkey_pair['property'],
-                                                                     'data': '6.5'})
-                        multiple_number_properties_generated.append({'resourceId': "7422-91h7-52s842060815",
-                                                                     'propkey': propkey_pair['property'],
-                                                                     'data': 33})
-                Vrops.get_latest_number_properties_multiple = MagicMock(
-                    return_value=multiple_number_properties_generated)
-
-                multiple_info_properties_generated = list()
+                        for resource_id, data in zip(resource_ids, [19.54, 6.5, 33]):
+                            multiple_properties_generated[(resource_id, propkey_pair['property'])] = {
+                                'statKey': propkey_pair['property'], 'data': [data]}
+
                 if 'info_metrics' in propkey_yaml[collector]:
                     for propkey_pair in propkey_yaml[collector]['info_metrics']:
-                        multiple_info_properties_generated.append({'resourceId': '3628-93a1-56e84634050814',
-                                                                   'propkey': propkey_pair['property'],
-                                                                   'data': 'test_info_property'})
-                        multiple_info_properties_generated.append({'resourceId': "5628-9ba1-55e847050815",
-                                                                   'propkey': propkey_pair['property'],
-                                                                   'data': 'test_info_property'})
-                        multiple_info_properties_generated.append({'resourceId': "7422-91h7-52s842060815",
-                                                                   'propkey': propkey_pair['property'],
-                                                                   'data': 'test_info_property'})
-                Vrops.get_latest_info_properties_multiple = MagicMock(
-                    return_value=multiple_info_properties_generated)
+                        for resource_id in resource_ids:
+                            multiple_properties_generated[(resource_id, propkey_pair['property'])] = {
+                                'statKey': propkey_pair['property'],
+                                'values': ["test_property" if 'VCenter' in collector else "test_info_property"]}
+                Vrops.get_latest_properties_multiple = MagicMock(return_value=multiple_properties_generated)
 
             thread_list = list()
 
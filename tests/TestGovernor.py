@@ -0,0 +1,109 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from unittest.mock import patch
+from tools.Governor import Governor, caller, VM_STATS, PROPERTIES
+from threading import Thread, Lock, Timer
+import asyncio
+import time
+import os
+import unittest
+
+
+class TestGovernor(TestCase):
+
+    def setUp(self):
+        os.environ['GOVERNOR_RPS'] = '0'
+        os.environ['GOVERNOR_CONCURRENCY'] = '1'
+
+    def wait_for_queue(self, target, length):
+        while len(Governor.get_governor(target)['waiting']) < length:
+            time.sleep(0.01)
+
+    def test_priority_and_fairness(self):
+        target = 'governed.test'
+        order = list()
+        order_lock = Lock()
+
+        def request(flow):
+            caller.set(flow)
+            with Governor.slot(target):
+                with order_lock:
+                    order.append(flow[0])
+
+        Governor.acquire(target, ('busy', PROPERTIES))
+        threads = list()
+        for flow in [('PropertiesCollector', PROPERTIES), ('PropertiesCollector', PROPERTIES),
+                     ('OtherPropertiesCollector', PROPERTIES), ('VMStatsCollector', VM_STATS)]:
+            thread = Thread(target=request, args=(flow,))
+            thread.start()
+            threads.append(thread)
+            self.wait_for_queue(target, len(threads))
+        Governor.release(target)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order[0], 'VMStatsCollector', 'vm stats should jump the queue')
+        self.assertEqual(sorted(order[1:]), ['OtherPropertiesCollector', 'PropertiesCollector', 'PropertiesCollector'])
+
+        # a flow that has been served a lot waits behind one that has not
+        Governor.acquire(target, ('busy', PROPERTIES))
+        order.clear()
+        threads = list()
+        for flow in [('PropertiesCollector', PROPERTIES), ('QuietCollector', PROPERTIES)]:
+            thread = Thread(target=request, args=(flow,))
+            thread.start()
+            threads.append(thread)
+            self.wait_for_queue(target, len(threads))
+        Governor.release(target)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['QuietCollector', 'PropertiesCollector'])
+
+    def test_rate_and_nesting(self):
+        os.environ['GOVERNOR_RPS'] = '20'
+        os.environ['GOVERNOR_CONCURRENCY'] = '2'
+        target = 'rate-limited.test'
+        start = time.monotonic()
+        for _ in range(30):
+            with Governor.slot(target):
+                with Governor.slot(target):
+                    pass
+        # a burst of 20 goes through at once, the other 10 need half a second
+        self.assertGreaterEqual(time.monotonic() - start, 0.45)
+        self.assertEqual(Governor.get_governor(target)['active'], 0)
+
+    def test_async_waiters_woken(self):
+        target = 'async-governed.test'
+        admit = Governor.admit
+        admits = {'count': 0}
+
+        def counting_admit(governor, entry):
+            admits['count'] += 1
+            return admit(governor, entry)
+
+        async def request():
+            await Governor.acquire_async(target)
+            await asyncio.sleep(0.001)
+            Governor.release(target)
+
+        async def requests():
+            await asyncio.gather(*[request() for _ in range(200)])
+
+        # the slot is held by a thread, its release has to wake the coroutines on the loop
+        Governor.acquire(target)
+        Timer(0.2, Governor.release, args=(target,)).start()
+        loop = asyncio.new_event_loop()
+        try:
+            with patch.object(Governor, 'admit', new=counting_admit):
+                loop.run_until_complete(asyncio.wait_for(requests(), 10))
+        finally:
+            loop.close()
+        # once when queued and once when woken
+        self.assertLessEqual(admits['count'], 200 * 2, 'waiting coroutines should not poll their turn')
+        self.assertEqual(Governor.get_governor(target)['active'], 0)
+        self.assertEqual(Governor.get_governor(target)['async_waiters'], dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from unittest.mock import patch
+from InventoryBuilder import InventoryBuilder
+from tools.Vrops import Vrops
+from threading import Lock, Event
+import time
+import os
+import unittest
+
+
+class TestInventoryCrawl(TestCase):
+    os.environ['INVENTORY_CONCURRENCY'] = '4'
+
+    def children(self, prefix, count):
+        lock = Lock()
+        running = {'now': 0, 'most': 0}
+
+        def get_children(target, token, parentid):
+            with lock:
+                running['now'] += 1
+                running['most'] = max(running['most'], running['now'])
+            time.sleep(0.05)
+            with lock:
+                running['now'] -= 1
+            return [{'name': prefix + '-' + parentid + '-' + str(i), 'uuid': parentid + '.' + str(i)}
+                    for i in range(count)]
+        return get_children, running
+
+    def test_tree_of_concurrent_crawl(self):
+        get_datacenter, _ = self.children('dc', 2)
+        get_cluster, _ = self.children('cl', 2)
+        get_hosts, running = self.children('hs', 3)
+        get_datastores, _ = self.children('ds', 2)
+        get_vms, _ = self.children('vm', 2)
+        # no rest server and no endless loop, just the crawl
+        builder = InventoryBuilder.__new__(InventoryBuilder)
+        builder.vrops = Vrops
+        with patch.object(Vrops, 'get_adapter', return_value=[{'name': 'vc', 'uuid': 'vc'}]), \
+                patch.object(Vrops, 'get_datacenter', side_effect=get_datacenter), \
+                patch.object(Vrops, 'get_cluster', side_effect=get_cluster), \
+                patch.object(Vrops, 'get_hosts', side_effect=get_hosts), \
+                patch.object(Vrops, 'get_datastores', side_effect=get_datastores), \
+                patch.object(Vrops, 'get_virtualmachines', side_effect=get_vms):
+            vcenter = builder.create_resource_objects('crawl.test', 'token')
+
+        self.assertEqual(running['most'], 4, 'the clusters should be crawled at once, up to INVENTORY_CONCURRENCY')
+        self.assertEqual([dc.uuid for dc in vcenter.datacenter], ['vc.0', 'vc.1'])
+        hosts = [hs for dc in vcenter.datacenter for cl in dc.clusters for hs in cl.hosts]
+        self.assertEqual([hs.uuid for hs in hosts], [dc + '.' + cl + '.' + hs for dc in ['vc.0', 'vc.1']
+                                                     for cl in ['0', '1'] for hs in ['0', '1', '2']])
+        for hs in hosts:
+            self.assertEqual([ds.uuid for ds in hs.datastores], [hs.uuid + '.0', hs.uuid + '.1'])
+            self.assertEqual([vm.uuid for vm in hs.vms], [hs.uuid + '.0', hs.uuid + '.1'])
+            self.assertEqual(hs.vms[0].name, 'vm-' + hs.uuid + '-0')
+
+    def tree(self, vcenter):
+        return [(dc.uuid, [(cl.uuid, [(hs.uuid, [ds.uuid for ds in hs.datastores], [vm.name for vm in hs.vms])
+                                      for hs in cl.hosts]) for cl in dc.clusters]) for dc in vcenter.datacenter]
+
+    def test_bulk_tree_same_as_crawl(self):
+        # children of every parent, the datastore ds-shared is mounted on both hosts of cl-0
+        children = {
+            'vc': ['dc-0', 'dc-1'], 'dc-0': ['cl-0', 'cl-1'], 'dc-1': ['cl-2'],
+            'cl-0': ['hs-0', 'hs-1'], 'cl-1': ['hs-2'], 'cl-2': [],
+            'hs-0': ['ds-0', 'ds-shared', 'vm-0', 'vm-1'], 'hs-1': ['ds-shared', 'vm-2'], 'hs-2': ['ds-1', 'vm-3']
+        }
+        kinds = {'Datacenter': 'dc-', 'ClusterComputeResource': 'cl-', 'HostSystem': 'hs-', 'Datastore': 'ds-',
+                 'VirtualMachine': 'vm-'}
+        uuids = sorted({uuid for uuid_list in children.values() for uuid in uuid_list})
+
+        def get_children(prefix):
+            return lambda target, token, parentid: [{'name': 'name-' + uuid, 'uuid': uuid}
+                                                    for uuid in children[parentid] if uuid.startswith(prefix)]
+
+        def get_resources(target, token, resourcekind, parentid):
+            return [{'name': 'name-' + uuid, 'uuid': uuid} for uuid in uuids if uuid.startswith(kinds[resourcekind])]
+
+        def get_relationships(target, token, uuid_list, relationship, resourcekind):
+            return {uuid: [parent for parent, uuid_list in children.items()
+                           if uuid in uuid_list and parent.startswith(kinds[resourcekind])] for uuid in uuid_list}
+
+        builder = InventoryBuilder.__new__(InventoryBuilder)
+        builder.vrops = Vrops
+        trees = dict()
+        with patch.object(Vrops, 'get_adapter', return_value=[{'name': 'vc', 'uuid': 'vc'}]), \
+                patch.object(Vrops, 'get_datacenter', side_effect=get_children('dc-')), \
+                patch.object(Vrops, 'get_cluster', side_effect=get_children('cl-')), \
+                patch.object(Vrops, 'get_hosts', side_effect=get_children('hs-')), \
+                patch.object(Vrops, 'get_datastores', side_effect=get_children('ds-')), \
+                patch.object(Vrops, 'get_virtualmachines', side_effect=get_children('vm-')), \
+                patch.object(Vrops, 'get_resources', side_effect=get_resources), \
+                patch.object(Vrops, 'get_relationships', side_effect=get_relationships) as mocked_relationships:
+            for mode in ['crawl', 'bulk']:
+                os.environ['INVENTORY_MODE'] = mode
+                trees[mode] = self.tree(builder.create_resource_objects('bulk.test', 'token'))
+        os.environ['INVENTORY_MODE'] = 'crawl'
+
+        self.assertEqual(trees['bulk'], trees['crawl'])
+        self.assertEqual(trees['bulk'][0][1][0][1][1], ('hs-1', ['ds-shared'], ['name-vm-2']))
+        self.assertEqual(mocked_relationships.call_count, 4, 'one relationship query per kind below the datacenters')
+
+    @patch('builtins.print')
+    def test_bulk_build_fails_without_relationships(self, mocked_print):
+        def get_resources(target, token, resourcekind, parentid):
+            return [{'name': resourcekind, 'uuid': resourcekind}]
+
+        # every resource is the child of the one of the parent kind, the chunk of the vms keeps failing
+        def get_relationship_chunk(uuid_list, url, headers, payload, parse, target, chunk_iteration):
+            if uuid_list == ['VirtualMachine']:
+                return False
+            return [(uuid, payload(uuid_list)['resourceQuery']['resourceKind'][0]) for uuid in uuid_list]
+
+        builder = InventoryBuilder.__new__(InventoryBuilder)
+        builder.vrops = Vrops
+        builder.build_durations = dict()
+        results = dict()
+        os.environ.update({'INVENTORY_MODE': 'bulk', 'RETRY_BACKOFF': '0'})
+        try:
+            with patch.object(Vrops, 'get_token', return_value='token'), \
+                    patch.object(Vrops, 'get_adapter', return_value=[{'name': 'vc', 'uuid': 'vc'}]), \
+                    patch.object(Vrops, 'get_datacenter', return_value=[{'name': 'dc', 'uuid': 'Datacenter'}]), \
+                    patch.object(Vrops, 'get_resources', side_effect=get_resources), \
+                    patch.object(Vrops, 'get_relationship_chunk', side_effect=get_relationship_chunk):
+                builder.target_tokens = dict()
+                builder.query_target('incomplete.test', 1, results, time.monotonic() + 60)
+        finally:
+            os.environ['INVENTORY_MODE'] = 'crawl'
+            os.environ.pop('RETRY_BACKOFF')
+        self.assertEqual(results, dict(), 'a tree with vms missing should not be published')
+        self.assertEqual(builder.build_durations['incomplete.test']['success'], False)
+
+    @patch('builtins.print')
+    def test_delta_build(self, mocked_print):
+        children = {
+            'vc': ['dc-0'], 'dc-0': ['cl-0', 'cl-1'], 'cl-0': ['hs-0', 'hs-1'], 'cl-1': ['hs-2'],
+            'hs-0': ['ds-0', 'vm-0', 'vm-1'], 'hs-1': ['ds-0', 'vm-2'], 'hs-2': ['ds-1']
+        }
+        counts = {'summary|total_number_hosts': 'hs-', 'summary|total_number_datastores': 'ds-',
+                  'summary|total_number_vms': 'vm-'}
+
+        def get_children(prefix):
+            return lambda target, token, parentid: [{'name': 'name-' + uuid, 'uuid': uuid}
+                                                    for uuid in children[parentid] if uuid.startswith(prefix)]
+
+        def get_latest_stats_multiple(target, token, uuids, keys):
+            return {(uuid, key): float(len([child for child in children[uuid] if child.startswith(counts[key])]))
+                    for uuid in uuids for key in keys}
+
+        os.environ['INVENTORY_BUILD'] = 'delta'
+        builder = InventoryBuilder.__new__(InventoryBuilder)
+        builder.vrops = Vrops
+        builder.vcenter_dict = dict()
+        builder.subtree_counts = dict()
+        with patch.object(Vrops, 'get_adapter', return_value=[{'name': 'vc', 'uuid': 'vc'}]), \
+                patch.object(Vrops, 'get_datacenter', side_effect=get_children('dc-')), \
+                patch.object(Vrops, 'get_cluster', side_effect=get_children('cl-')), \
+                patch.object(Vrops, 'get_hosts', side_effect=get_children('hs-')) as mocked_hosts, \
+                patch.object(Vrops, 'get_datastores', side_effect=get_children('ds-')), \
+                patch.object(Vrops, 'get_virtualmachines', side_effect=get_children('vm-')) as mocked_vms, \
+                patch.object(Vrops, 'get_latest_stats_multiple', side_effect=get_latest_stats_multiple):
+            for iteration in range(1, 7):
+                # vm-2 moves to hs-2 before the second build
+                if iteration == 2:
+                    children['hs-1'].remove('vm-2')
+                    children['hs-2'].append('vm-2')
+                mocked_hosts.reset_mock()
+                mocked_vms.reset_mock()
+                builder.iteration = iteration
+                builder.vcenter_dict['delta.test'] = builder.create_resource_objects('delta.test', 'token')
+                tree = self.tree(builder.vcenter_dict['delta.test'])
+                if iteration == 2:
+                    self.assertEqual(tree, [('dc-0', [('cl-0', [('hs-0', ['ds-0'], ['name-vm-0', 'name-vm-1']),
+                                                                ('hs-1', ['ds-0'], [])]),
+                                                      ('cl-1', [('hs-2', ['ds-1'], ['name-vm-2'])])])])
+                    self.assertEqual(mocked_hosts.call_count, 0, 'the host counts of the clusters did not change')
+                    self.assertEqual(sorted(call[1]['parentid'] for call in mocked_vms.call_args_list),
+                                     ['hs-1', 'hs-2'])
+                if iteration == 3:
+                    self.assertEqual(mocked_vms.call_count, 0, 'nothing changed')
+            self.assertEqual(mocked_vms.call_count, 3, 'every INVENTORY_FULL_REBUILD iterations all is crawled')
+        os.environ['INVENTORY_BUILD'] = 'full'
+
+    @patch('builtins.print')
+    def test_targets_in_parallel(self, mocked_print):
+        os.environ['TARGET_DEADLINE'] = '1'
+        hang = Event()
+        hung = list()
+
+        def query_vrops(vrops):
+            if vrops == 'hung.test':
+                hang.wait()
+                hung.append(Vrops.past_deadline())
+            if vrops == 'broken.test':
+                raise ValueError('no adapters')
+            return 'new ' + vrops
+
+        builder = InventoryBuilder.__new__(InventoryBuilder)
+        builder.iteration = 2
+        builder.vrops_list = ['hung.test', 'broken.test', 'fine.test']
+        builder.vcenter_dict = {'hung.test': 'old hung.test', 'broken.test': 'old broken.test'}
+        builder.target_threads = dict()
+        builder.build_durations = dict()
+        builder.query_vrops = query_vrops
+        start = time.monotonic()
+        builder.query_targets()
+        self.assertLess(time.monotonic() - start, 2, 'the hung target should only hold up until the deadline')
+        self.assertEqual(builder.vcenter_dict, {'hung.test': 'old hung.test', 'broken.test': 'old broken.test',
+                                                'fine.test': 'new fine.test'})
+        self.assertEqual(builder.build_durations['broken.test']['success'], False)
+        self.assertEqual(builder.build_durations['fine.test']['iteration'], 2)
+        self.assertNotIn('hung.test', builder.build_durations)
+
+        # the hung build is abandoned and the target is built again
+        abandoned = builder.target_threads['hung.test']
+        builder.query_targets()
+        self.assertIsNot(builder.target_threads['hung.test'], abandoned)
+        self.assertEqual(builder.vcenter_dict['hung.test'], 'old hung.test')
+        hang.set()
+        abandoned.join()
+        builder.target_threads['hung.test'].join()
+        self.assertEqual(hung, [True, True], 'the builds should not send requests after their deadline')
+        self.assertEqual(builder.build_durations['hung.test']['success'], False, 'a late build is no success')
+        self.assertEqual(builder.vcenter_dict['hung.test'], 'old hung.test', 'a late build is dropped')
+        os.environ['TARGET_DEADLINE'] = '600'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+from InventoryBuilder import InventoryBuilder, KINDS, FIELDS
+from tools.Vrops import Vrops
+from resources.Vcenter import Vcenter
+from resources.Datacenter import Datacenter
+from resources.Cluster import Cluster
+from resources.Host import Host
+from resources.VirtualMachine import VirtualMachine
+from threading import Timer
+from unittest.mock import patch
+import gzip
+import time
+import json
+import os
+import unittest
+
+
+class TestInventoryServer(TestCase):
+    vm = {'uuid': 'vm-0', 'name': 'vm', 'parent_host_uuid': 'hs', 'parent_host_name': 'hs', 'cluster': 'cl',
+          'datacenter': 'dc', 'vcenter': 'vc', 'target': 'testhost.test', 'token': 'token'}
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.builder = InventoryBuilder.__new__(InventoryBuilder)
+        self.builder.serialized_inventory = dict()
+        self.builder.snapshot_iteration = None
+        self.builder.target_tokens = {'testhost.test': 'token'}
+        self.builder.iterated_inventory = {str(iteration): {'testhost.test': self.tree()} for iteration in [1, 2]}
+        self.builder.serialize_iteration(2)
+
+    def tree(self):
+        vcenter = Vcenter(target='testhost.test', token='token', name='vc', uuid='vc')
+        vcenter.datacenter.append(Datacenter(target='testhost.test', token='token', name='dc', uuid='dc'))
+        vcenter.datacenter[0].clusters.append(Cluster(target='testhost.test', token='token', name='cl', uuid='cl'))
+        host = Host(target='testhost.test', token='token', name='hs', uuid='hs')
+        host.vms.append(VirtualMachine(target='testhost.test', token='token', name='vm', uuid='vm-0'))
+        vcenter.datacenter[0].clusters[0].hosts.append(host)
+        return vcenter
+
+    def get(self, iteration, headers=None):
+        with self.app.test_request_context('/testhost.test/vms/' + str(iteration), headers=headers or dict()):
+            return self.builder.inventory_response('testhost.test', 'vms', iteration)
+
+    def test_serialized_once_with_etag(self):
+        response = self.get(1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), {'vm-0': self.vm})
+        self.assertNotIn('1', self.builder.serialized_inventory, 'only the newest iteration is kept serialized')
+        etag = response.headers['ETag']
+
+        # the same payload in a newer iteration is not sent again
+        response = self.get(2, {'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        self.assertEqual(self.get(2, {'If-None-Match': '"something-else"'}).status_code, 200)
+
+    def test_gzip(self):
+        response = self.get(2, {'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIs(response.get_data(), self.builder.serialized_inventory['2'][('vms', 'testhost.test')]['gzip'])
+        self.assertEqual(json.loads(gzip.decompress(response.get_data())), {'vm-0': self.vm})
+        self.assertNotEqual(response.headers['ETag'], self.get(2).headers['ETag'])
+        self.assertEqual(json.loads(self.get(2).get_data()), {'vm-0': self.vm})
+        self.assertEqual(self.get(1, {'If-None-Match': response.headers['ETag']}).status_code, 304)
+
+    def test_snapshot_marked_stale(self):
+        self.assertNotIn('X-Inventory-Stale', self.get(2).headers)
+        self.builder.snapshot_iteration = 2
+        self.assertEqual(self.get(2).headers['X-Inventory-Stale'], '1')
+        self.assertNotIn('X-Inventory-Stale', self.get(1).headers)
+
+    def test_unpublished_iteration(self):
+        self.builder.iterated_inventory['3'] = {'testhost.test': Vcenter(target='testhost.test', token='token',
+                                                                         name='vc', uuid='vc')}
+        response = self.get(3, {'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), b'{}')
+
+    def test_bundle_with_fields(self):
+        self.builder.successful_iteration_list = [0, 1, 2]
+        with self.app.test_request_context('/testhost.test/bundle/latest'):
+            response = self.builder.bundle_response('testhost.test', 'latest', 'vms,hosts', 'uuid,name,cluster')
+        self.assertEqual(response.headers['X-Inventory-Iteration'], '2')
+        self.assertEqual(json.loads(response.get_data()), {
+            'vms': {'vm-0': {'uuid': 'vm-0', 'name': 'vm', 'cluster': 'cl'}},
+            'hosts': {'hs': {'uuid': 'hs', 'name': 'hs'}}})
+        etag = response.headers['ETag']
+
+        # the same bundle of an older iteration has the same etag
+        with self.app.test_request_context('/testhost.test/bundle/1', headers={'If-None-Match': etag}):
+            response = self.builder.bundle_response('testhost.test', '1', 'vms,hosts', 'uuid,name,cluster')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['X-Inventory-Iteration'], '1')
+
+        with self.app.test_request_context('/testhost.test/bundle/latest'):
+            with self.assertRaises(HTTPException):
+                self.builder.bundle_response('testhost.test', 'latest', 'vms,tokens', None)
+            with self.assertRaises(HTTPException):
+                self.builder.bundle_response('testhost.test', 'latest', 'vms', 'uuid,password')
+            with self.assertRaises(HTTPException):
+                self.builder.bundle_response('unknown.test', 'latest', None, None)
+
+    def test_bundle_payloads_bounded(self):
+        self.builder.successful_iteration_list = [0, 1, 2]
+        with self.app.test_request_context('/testhost.test/bundle/latest'):
+            etag = self.builder.bundle_response('testhost.test', 'latest', 'vms,hosts', 'uuid,name').headers['ETag']
+            # the order and repetitions of kinds and fields make no other payload
+            response = self.builder.bundle_response('testhost.test', 'latest', 'hosts,vms,vms', 'name,uuid')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(self.builder.serialized_inventory['2']), len(KINDS) + 1)
+
+        os.environ['INVENTORY_CACHED_PAYLOADS'] = '2'
+        for fields in FIELDS:
+            with self.app.test_request_context('/testhost.test/bundle/latest'):
+                response = self.builder.bundle_response('testhost.test', 'latest', 'vms', fields)
+            self.assertEqual(response.status_code, 200)
+        del os.environ['INVENTORY_CACHED_PAYLOADS']
+        self.assertEqual(len(self.builder.serialized_inventory['2']), len(KINDS) + 2)
+
+    def test_delta(self):
+        self.builder.successful_iteration_list = [0, 1, 2, 3]
+        tree = self.tree()
+        host = tree.datacenter[0].clusters[0].hosts[0]
+        host.vms[0] = VirtualMachine(target='testhost.test', token='token', name='renamed', uuid='vm-0')
+        host.vms.append(VirtualMachine(target='testhost.test', token='token', name='vm', uuid='vm-1'))
+        tree.datacenter[0].clusters[0].hosts.append(Host(target='testhost.test', token='token', name='hs',
+                                                         uuid='hs-1'))
+        self.builder.iterated_inventory['3'] = {'testhost.test': tree}
+        self.builder.iterated_inventory['1']['testhost.test'].datacenter[0].clusters[0].hosts.append(
+            Host(target='testhost.test', token='token', name='gone', uuid='hs-2'))
+
+        with self.app.test_request_context('/testhost.test/delta/1/latest'):
+            response = self.builder.delta_response('testhost.test', 1, 'latest', 'vms,hosts', 'uuid,name')
+        self.assertEqual(response.headers['X-Inventory-Iteration'], '3')
+        self.assertEqual(json.loads(response.get_data()), {
+            'vms': {'added': {'vm-1': {'uuid': 'vm-1', 'name': 'vm'}},
+                    'changed': {'vm-0': {'uuid': 'vm-0', 'name': 'renamed'}},
+                    'removed': []},
+            'hosts': {'added': {'hs-1': {'uuid': 'hs-1', 'name': 'hs'}},
+                      'changed': {},
+                      'removed': ['hs-2']}})
+
+        with self.app.test_request_context('/testhost.test/delta/2/3'):
+            response = self.builder.delta_response('testhost.test', 2, '3', 'clusters', None)
+        self.assertEqual(json.loads(response.get_data()), {'clusters': {'added': {}, 'changed': {}, 'removed': []}})
+
+        # a renewed token changes no record
+        self.builder.target_tokens['testhost.test'] = 'renewed'
+        with self.app.test_request_context('/testhost.test/delta/1/2'):
+            response = self.builder.delta_response('testhost.test', 1, '2', 'vcenters,clusters', None)
+        self.assertEqual(json.loads(response.get_data()), {kind: {'added': {}, 'changed': {}, 'removed': []}
+                                                           for kind in ['vcenters', 'clusters']})
+
+        # the client has to get a whole bundle if the iteration it has is not retained anymore
+        with self.app.test_request_context('/testhost.test/delta/0/latest'):
+            with self.assertRaises(HTTPException):
+                self.builder.delta_response('testhost.test', 0, 'latest', None, None)
+
+    @patch('tools.Vrops.Vrops.acquire_token')
+    def test_rejected_token_renewed(self, mocked_acquire):
+        mocked_acquire.return_value = {'token': 'renewed', 'validity': None}
+        self.builder.vrops = Vrops
+        Vrops.tokens['testhost.test'] = {'token': 'token', 'validity': None}
+        try:
+            self.assertEqual(self.builder.get_target_tokens(), {'testhost.test': 'token'})
+            self.assertEqual(self.builder.get_target_tokens('unknown'), {'testhost.test': 'token'})
+            mocked_acquire.assert_not_called()
+
+            self.assertEqual(self.builder.get_target_tokens('token'), {'testhost.test': 'renewed'})
+            # exporters that got the same 401 meanwhile get the renewed token as well
+            self.assertEqual(self.builder.get_target_tokens('token'), {'testhost.test': 'renewed'})
+            self.assertEqual(mocked_acquire.call_count, 1)
+        finally:
+            Vrops.tokens.pop('testhost.test', None)
+
+    def test_wait_for_iteration(self):
+        self.builder.successful_iteration_list = [0, 1, 2]
+        start = time.monotonic()
+        self.assertEqual(self.builder.wait_for_iteration(1, 10), 2, 'a newer iteration is there already')
+        self.assertEqual(self.builder.wait_for_iteration(2, 0.3), 2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+
+        publish = Timer(0.3, self.builder.successful_iteration_list.append, args=(3,))
+        publish.start()
+        self.assertEqual(self.builder.wait_for_iteration(2, 10), 3)
+        self.assertLess(time.monotonic() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from unittest.mock import patch
+from tools.InventorySnapshot import InventorySnapshot
+from InventoryBuilder import InventoryBuilder
+import tempfile
+import os
+import unittest
+
+
+class TestInventorySnapshot(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'inventory.db')
+
+    def tearDown(self):
+        os.environ.pop('SNAPSHOT', None)
+        self.directory.cleanup()
+
+    def inventory(self, name):
+        target = 'testhost.test'
+        return {
+            'vcenters': {target: {'vc': {'uuid': 'vc', 'name': name, 'target': target, 'token': 'secret'}}},
+            'datacenters': {target: {'dc': {'uuid': 'dc', 'name': 'dc', 'parent_vcenter_uuid': 'vc',
+                                            'parent_vcenter_name': name, 'vcenter': name, 'target': target,
+                                            'token': 'secret'}}},
+            'clusters': {target: {'cl': {'uuid': 'cl', 'name': 'cl', 'parent_dc_uuid': 'dc', 'parent_dc_name': 'dc',
+                                         'vcenter': name, 'target': target, 'token': 'secret'}}},
+            'hosts': {target: {'hs-0': {'uuid': 'hs-0', 'name': 'hs', 'parent_cluster_uuid': 'cl',
+                                        'parent_cluster_name': 'cl', 'datacenter': 'dc', 'vcenter': name,
+                                        'target': target, 'token': 'secret'}}},
+            'vms': {target: {'vm-0': {'uuid': 'vm-0', 'name': 'vm', 'parent_host_uuid': 'hs-0',
+                                      'parent_host_name': 'hs', 'cluster': 'cl', 'datacenter': 'dc',
+                                      'vcenter': name, 'target': target, 'token': 'secret'}},
+                    'empty.test': {}}
+        }
+
+    def test_round_trip_without_tokens(self):
+        InventorySnapshot.save(self.path, 7, self.inventory('first'))
+        InventorySnapshot.save(self.path, 8, self.inventory('second'))
+        iteration, inventory = InventorySnapshot.load(self.path)
+        self.assertEqual(iteration, 8)
+        self.assertEqual(inventory['vcenters']['testhost.test']['vc']['name'], 'second')
+        self.assertEqual(inventory['vms']['testhost.test']['vm-0']['parent_host_uuid'], 'hs-0')
+        self.assertEqual(inventory['vms']['empty.test'], {})
+        self.assertIsNone(inventory['vms']['testhost.test']['vm-0']['token'])
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    @patch('builtins.print')
+    def test_missing_or_broken_snapshot(self, mocked_print):
+        self.assertIsNone(InventorySnapshot.load(self.path))
+        with open(self.path, 'w') as snapshot:
+            snapshot.write('not a database')
+        self.assertIsNone(InventorySnapshot.load(self.path))
+
+    @patch('builtins.print')
+    def test_warm_start(self, mocked_print):
+        InventorySnapshot.save(self.path, 12, self.inventory('snapshot'))
+        os.environ['SNAPSHOT'] = self.path
+        builder = InventoryBuilder.__new__(InventoryBuilder)
+        builder.iterated_inventory = dict()
+        builder.serialized_inventory = dict()
+        builder.successful_iteration_list = [0]
+        builder.vcenter_dict = dict()
+        builder.target_tokens = dict()
+        builder.snapshot_iteration = None
+        builder.load_snapshot()
+        self.assertEqual(builder.successful_iteration_list, [0, 12])
+        self.assertEqual(builder.snapshot_iteration, 12)
+        self.assertEqual(builder.target_tokens, {'testhost.test': None}, 'collectors should not wait for a token')
+        self.assertEqual(builder.iterated_inventory['12']['testhost.test'].name, 'snapshot')
+        # the tree is put together again from the parent uuids of the views
+        for kind in ['vcenters', 'datacenters', 'clusters', 'hosts', 'vms']:
+            self.assertEqual(builder.get_view(kind, 12, 'testhost.test'),
+                             {uuid: dict(resource, token=None) for uuid, resource in
+                              self.inventory('snapshot')[kind]['testhost.test'].items()})
+
+
+if __name__ == '__main__':
+    unittest.main()
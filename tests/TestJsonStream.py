@@ -0,0 +1,44 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from tools.JsonStream import JsonStream, iter_elements
+import json
+import unittest
+
+
+class TestJsonStream(TestCase):
+    document = {
+        'pageInfo': {'totalCount': 40, 'page': 0, 'pageSize': 50000},
+        'links': [],
+        'resourceList': [{'identifier': 'uuid-' + str(i), 'resourceKey': {'name': 'ä' * i}, 'value': i * 1.5}
+                         for i in range(40)],
+        'total': 12345
+    }
+
+    def test_any_split(self):
+        raw = json.dumps(self.document, ensure_ascii=False).encode()
+        # splits end up inside of keys, numbers and multibyte characters
+        for size in (1, 2, 3, 7, 64, len(raw)):
+            stream = JsonStream('resourceList')
+            elements = list(iter_elements([raw[i:i + size] for i in range(0, len(raw), size)], 'resourceList', stream))
+            self.assertEqual(elements, self.document['resourceList'])
+            self.assertEqual(stream.skeleton, {'pageInfo': self.document['pageInfo'], 'links': [], 'total': 12345})
+
+    def test_elements_before_end(self):
+        raw = json.dumps(self.document).encode()
+        stream = JsonStream('resourceList')
+        elements = stream.feed(raw[:len(raw) // 2])
+        self.assertTrue(elements, 'complete elements should be handed out before the body is complete')
+        self.assertLess(len(stream.buffer), 200, 'consumed input should not be kept')
+        self.assertEqual(elements + stream.feed(raw[len(raw) // 2:]) + stream.close(), self.document['resourceList'])
+
+    def test_truncated(self):
+        raw = json.dumps(self.document).encode()
+        stream = JsonStream('resourceList')
+        stream.feed(raw[:-20])
+        with self.assertRaises(json.decoder.JSONDecodeError):
+            stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from BaseCollector import BaseCollector
+from tools.Vrops import Vrops
+import requests
+import unittest
+import os
+
+
+class ProjectCollector(BaseCollector):
+    def __init__(self):
+        # no inventory to ask, everything is mocked below
+        self.target = 'testhost.test'
+        self.vrops = MagicMock()
+        self.vrops.get_token.return_value = 'token'
+
+    def collect(self):
+        pass
+
+
+class TestProjectCache(TestCase):
+
+    def setUp(self):
+        BaseCollector.project_cache = {'iteration': 0, 'full_iteration': 0, 'parents': dict(), 'project_ids': dict()}
+
+    def inventory(self, collector, iteration, vms):
+        def get_vms(target):
+            collector.iteration = iteration
+            return {uuid: {'uuid': uuid, 'parent_host_uuid': host} for uuid, host in vms.items()}
+        collector.get_vms = get_vms
+
+    def wait_for_refresh(self):
+        if BaseCollector.project_refresh:
+            BaseCollector.project_refresh.join()
+
+    def test_only_new_and_moved_vms(self):
+        collector = ProjectCollector()
+        collector.vrops.get_project_ids.side_effect = lambda target, token, uuids: {uuid: 'p-' + uuid
+                                                                                    for uuid in uuids}
+        self.inventory(collector, 1, {'vm1': 'host1', 'vm2': 'host1', 'vm3': 'host2'})
+        self.assertEqual(collector.get_project_ids_by_target(), {'vm1': 'p-vm1', 'vm2': 'p-vm2', 'vm3': 'p-vm3'})
+
+        # same iteration, nothing is asked again
+        collector.get_project_ids_by_target()
+        self.assertEqual(collector.vrops.get_project_ids.call_count, 1)
+
+        # vm2 moved to another host, vm3 is gone, vm4 is new
+        self.inventory(collector, 2, {'vm1': 'host1', 'vm2': 'host2', 'vm4': 'host2'})
+        collector.get_project_ids_by_target()
+        self.wait_for_refresh()
+        self.assertEqual(collector.vrops.get_project_ids.call_args[0][2], ['vm2', 'vm4'])
+        self.assertEqual(collector.get_project_ids_by_target(), {'vm1': 'p-vm1', 'vm2': 'p-vm2', 'vm4': 'p-vm4'})
+
+    @patch('BaseCollector.requests.get')
+    def test_rejected_token_handed_back(self, mocked_get):
+        collector = ProjectCollector()
+        os.environ['INVENTORY'] = 'inventory.test'
+        mocked_get.return_value.json.return_value = {'testhost.test': 'renewed'}
+        self.assertEqual(collector.get_inventory_token('testhost.test', 'rejected'),
+                         {'token': 'renewed', 'validity': None})
+        self.assertEqual(mocked_get.call_args[1]['params'], {'rejected': 'rejected'})
+
+        # the inventory could not renew it either
+        mocked_get.return_value.json.return_value = {'testhost.test': 'rejected'}
+        self.assertFalse(collector.get_inventory_token('testhost.test', 'rejected'))
+
+    def test_failed_lookup_asked_again(self):
+        collector = ProjectCollector()
+        collector.vrops.get_project_ids.return_value = False
+        self.inventory(collector, 1, {'vm1': 'host1'})
+        self.assertEqual(collector.get_project_ids_by_target(), {})
+
+        # the next scrape of the same iteration tries again
+        collector.vrops.get_project_ids.return_value = {'vm1': 'p-vm1'}
+        collector.get_project_ids_by_target()
+        self.wait_for_refresh()
+        self.assertEqual(collector.vrops.get_project_ids.call_count, 2)
+        self.assertEqual(collector.get_project_ids_by_target(), {'vm1': 'p-vm1'})
+        self.assertEqual(collector.vrops.get_project_ids.call_count, 2)
+
+    @patch('builtins.print')
+    @patch('requests.Session.request')
+    def test_failed_refresh_keeps_projects(self, mocked_request, mocked_print):
+        collector = ProjectCollector()
+        collector.target = 'failing.test'
+        collector.vrops.get_project_ids.return_value = {'vm1': 'p-vm1', 'vm2': 'p-vm2'}
+        self.inventory(collector, 1, {'vm1': 'host1', 'vm2': 'host1'})
+        self.assertEqual(collector.get_project_ids_by_target(), {'vm1': 'p-vm1', 'vm2': 'p-vm2'})
+
+        # the real client loses its connection on every chunk of the full refresh
+        mocked_request.side_effect = requests.exceptions.ConnectionError('connection lost')
+        collector.vrops = Vrops
+        os.environ.update({'PROJECT_FULL_REFRESH': '1', 'RETRY_BACKOFF': '0'})
+        try:
+            with patch.object(Vrops, 'get_token', return_value='token'):
+                self.inventory(collector, 2, {'vm1': 'host1', 'vm2': 'host2'})
+                collector.get_project_ids_by_target()
+                self.wait_for_refresh()
+        finally:
+            os.environ.pop('PROJECT_FULL_REFRESH')
+            os.environ.pop('RETRY_BACKOFF')
+        self.assertTrue(mocked_request.called)
+        self.assertEqual(collector.get_project_ids_by_target(), {'vm1': 'p-vm1', 'vm2': 'p-vm2'})
+        self.assertEqual(BaseCollector.project_cache['iteration'], 1, 'the refresh should be sent again')
+
+    def test_no_token_no_refresh(self):
+        collector = ProjectCollector()
+        collector.vrops.get_token.return_value = False
+        self.inventory(collector, 1, {'vm1': 'host1'})
+        self.assertEqual(collector.get_project_ids_by_target(), {})
+        collector.vrops.get_project_ids.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from tools.RecordStore import RecordStore
+from resources.Vcenter import Vcenter
+from resources.Datacenter import Datacenter
+from resources.Cluster import Cluster
+from resources.Host import Host
+from resources.VirtualMachine import VirtualMachine
+from resources.Datastore import Datastore
+import unittest
+
+
+class TestRecordStore(TestCase):
+    target = 'shared.test'
+
+    def build(self, vms, token='token'):
+        vcenter = Vcenter(target=self.target, token=token, name='vc', uuid='vc')
+        datacenter = Datacenter(target=self.target, token=token, name='dc', uuid='dc')
+        cluster = Cluster(target=self.target, token=token, name='cl', uuid='cl')
+        for host_uuid, vm_uuids in vms.items():
+            host = Host(target=self.target, token=token, name=host_uuid, uuid=host_uuid)
+            host.datastores.append(Datastore(target=self.target, token=token, name='ds', uuid='ds'))
+            for vm_uuid in vm_uuids:
+                host.vms.append(VirtualMachine(target=self.target, token=token, name=vm_uuid, uuid=vm_uuid))
+            cluster.hosts.append(host)
+        datacenter.clusters.append(cluster)
+        vcenter.datacenter.append(datacenter)
+        return RecordStore.share(vcenter)
+
+    def test_unchanged_records_shared(self):
+        first = self.build({'hs-0': ['vm-0', 'vm-1'], 'hs-1': ['vm-2']})
+        self.assertIs(self.build({'hs-0': ['vm-0', 'vm-1'], 'hs-1': ['vm-2']}), first)
+
+        # vm-3 is new on hs-1, hs-0 stays the same record and so does the datastore of hs-1
+        second = self.build({'hs-0': ['vm-0', 'vm-1'], 'hs-1': ['vm-2', 'vm-3']})
+        self.assertIsNot(second, first)
+        first_hosts = first.datacenter[0].clusters[0].hosts
+        second_hosts = second.datacenter[0].clusters[0].hosts
+        self.assertIs(second_hosts[0], first_hosts[0])
+        self.assertIsNot(second_hosts[1], first_hosts[1])
+        self.assertIs(second_hosts[1].vms[0], first_hosts[1].vms[0])
+        self.assertIs(second_hosts[1].datastores[0], first_hosts[0].datastores[0])
+        self.assertEqual([vm.uuid for vm in second_hosts[1].vms], ['vm-2', 'vm-3'])
+
+    def test_shared_across_tokens(self):
+        first = self.build({'hs-0': ['vm-0']})
+        # a renewed token, or none at all like in a snapshot, is the same tree
+        self.assertIs(self.build({'hs-0': ['vm-0']}, token='renewed'), first)
+        self.assertIs(self.build({'hs-0': ['vm-0']}, token=None), first)
+        self.assertIsNone(first.datacenter[0].clusters[0].hosts[0].vms[0].token)
+
+    def test_records_without_iteration_dropped(self):
+        self.build({'hs-9': ['vm-9']})
+        keys = [key for key in RecordStore.records.keys() if key[3] in ['hs-9', 'vm-9']]
+        self.assertEqual(keys, [], 'nobody refers to the tree anymore')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,338 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from tools.Vrops import Vrops, IncompleteError, deadline
+from threading import Lock, Event, Thread
+import requests
+import json
+import time
+import os
+import unittest
+
+
+def json_response(body):
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = body
+    # hand out the body in small pieces, like a slow connection would
+    raw = json.dumps(body).encode()
+    response.iter_content.side_effect = lambda chunk_size: (raw[i:i + 4096] for i in range(0, len(raw), 4096))
+    return response
+
+
+def stats_response(uuid_list, keys):
+    return json_response({'values': [
+        {'resourceId': uuid, 'stat-list': {'stat': [
+            {'timestamps': [1582797716394], 'statKey': {'key': key}, 'data': [float(len(key))]} for key in keys]}}
+        for uuid in uuid_list]})
+
+
+def properties_response(uuid_list, propkeys):
+    return json_response({'values': [
+        {'resourceId': uuid, 'property-contents': {'property-content': [
+            {'statKey': propkey, 'timestamps': [1582797716394], 'values': [uuid + propkey]} for propkey in propkeys]}}
+        for uuid in uuid_list]})
+
+
+class TestVrops(TestCase):
+    os.environ.setdefault('DEBUG', '0')
+
+    @patch('requests.Session.request')
+    def test_latest_stats_multiple_one_query_per_chunk(self, mocked_post):
+        uuids = ['uuid-' + str(i) for i in range(2500)]
+        keys = ['cpu|demandPct', 'mem|balloonPct']
+        mocked_post.side_effect = lambda method, url, data, **kwargs: stats_response(json.loads(data)['resourceId'],
+                                                                                     json.loads(data)['statKey'])
+
+        values = Vrops.get_latest_stats_multiple('testhost.test', 'token', uuids, keys)
+
+        self.assertEqual(mocked_post.call_count, 3, 'one query per 1000 uuids, regardless of the amount of keys')
+        for call_args in mocked_post.call_args_list:
+            self.assertEqual(json.loads(call_args[1]['data'])['statKey'], keys)
+        self.assertEqual(len(values), len(uuids) * len(keys))
+        self.assertEqual(values[('uuid-2499', 'cpu|demandPct')], 13.0)
+        self.assertEqual(values[('uuid-0', 'mem|balloonPct')], 14.0)
+
+    @patch('requests.Session.request')
+    def test_latest_properties_multiple_chunked(self, mocked_post):
+        uuids = ['uuid-' + str(i) for i in range(1500)]
+        propkeys = ['summary|runtime|powerState', 'config|hardware|memoryKB']
+        mocked_post.side_effect = lambda method, url, data, **kwargs: properties_response(
+            json.loads(data)['resourceIds'], json.loads(data)['propertyKeys'])
+
+        contents = Vrops.get_latest_properties_multiple('testhost.test', 'token', uuids, propkeys)
+
+        self.assertEqual(mocked_post.call_count, 2, 'one query per 1000 uuids, regardless of the amount of keys')
+        for call_args in mocked_post.call_args_list:
+            self.assertLessEqual(len(json.loads(call_args[1]['data'])['resourceIds']), 1000)
+        self.assertEqual(len(contents), len(uuids) * len(propkeys))
+        self.assertEqual(contents[('uuid-1499', 'config|hardware|memoryKB')]['values'],
+                         ['uuid-1499config|hardware|memoryKB'])
+
+    @patch('requests.Session.request')
+    def test_resources_streamed(self, mocked_request):
+        mocked_request.return_value = json_response({
+            'pageInfo': {'totalCount': 3, 'page': 0, 'pageSize': 50000},
+            'resourceList': [{'identifier': 'uuid-' + str(i), 'resourceKey': {'name': 'vm-ü' + str(i)}}
+                             for i in range(3)]})
+
+        pairs = Vrops.iter_resources('testhost.test', 'token', 'VirtualMachine', 'host-uuid')
+        self.assertEqual(next(pairs), ('uuid-0', 'vm-ü0'))
+        self.assertEqual(list(pairs), [('uuid-1', 'vm-ü1'), ('uuid-2', 'vm-ü2')])
+        self.assertTrue(mocked_request.call_args[1]['stream'])
+        mocked_request.return_value.json.assert_not_called()
+
+        self.assertEqual(Vrops().get_virtualmachines('testhost.test', 'token', 'host-uuid')[2],
+                         {'name': 'vm-ü2', 'uuid': 'uuid-2'})
+
+    @patch('requests.Session.request')
+    def test_resources_paginated(self, mocked_request):
+        os.environ['PAGE_SIZE'] = '3'
+        resources = [{'identifier': 'uuid-' + str(i), 'resourceKey': {'name': 'vm' + str(i)}} for i in range(8)]
+
+        def page(method, url, params, **kwargs):
+            page_size, number = params['pageSize'], params['page']
+            return json_response({
+                'pageInfo': {'totalCount': len(resources), 'page': number, 'pageSize': page_size},
+                'resourceList': resources[number * page_size:(number + 1) * page_size]})
+        mocked_request.side_effect = page
+
+        try:
+            pairs = list(Vrops.iter_resources('testhost.test', 'token', 'VirtualMachine', 'host-uuid'))
+        finally:
+            del os.environ['PAGE_SIZE']
+        self.assertEqual(pairs, [('uuid-' + str(i), 'vm' + str(i)) for i in range(8)])
+        self.assertEqual(sorted(call_args[1]['params']['page'] for call_args in mocked_request.call_args_list),
+                         [0, 1, 2])
+
+    @patch('time.sleep')
+    @patch('requests.Session.request')
+    def test_failed_page_retried(self, mocked_request, mocked_sleep):
+        os.environ['PAGE_SIZE'] = '1'
+        resources = [{'identifier': 'u' + str(i), 'resourceKey': {'name': 'vm' + str(i)}} for i in range(3)]
+        failing = {'left': 1}
+
+        def page(method, url, params, **kwargs):
+            if params['page'] == 1 and failing['left']:
+                failing['left'] -= 1
+                response = MagicMock()
+                response.status_code = 500
+                return response
+            return json_response({'pageInfo': {'totalCount': len(resources)},
+                                  'resourceList': resources[params['page']:params['page'] + 1]})
+        mocked_request.side_effect = page
+
+        try:
+            with patch('builtins.print'):
+                self.assertEqual(Vrops().get_resources('paging.test', 'token', 'VirtualMachine', None),
+                                 [{'name': 'vm' + str(i), 'uuid': 'u' + str(i)} for i in range(3)])
+                # a page that keeps failing fails the whole listing instead of leaving its resources out
+                failing['left'] = 10
+                with self.assertRaises(IncompleteError):
+                    Vrops().get_resources('paging.test', 'token', 'VirtualMachine', None)
+        finally:
+            del os.environ['PAGE_SIZE']
+
+    @patch('time.sleep')
+    @patch('requests.Session.request')
+    def test_failed_chunk_retried(self, mocked_request, mocked_sleep):
+        uuids = ['uuid-' + str(i) for i in range(1500)]
+        failing = {'left': 1}
+
+        def query(method, url, data, **kwargs):
+            uuid_list = json.loads(data)['resourceId']
+            if 'uuid-1499' in uuid_list and failing['left']:
+                failing['left'] -= 1
+                response = MagicMock()
+                response.status_code = 503
+                return response
+            return stats_response(uuid_list, json.loads(data)['statKey'])
+        mocked_request.side_effect = query
+
+        with patch('builtins.print'):
+            values = Vrops.get_latest_stats_multiple('retrying.test', 'token', uuids, ['cpu|demandPct'])
+        self.assertEqual(len(values), len(uuids), 'the failed chunk should be retried')
+        retried = [json.loads(call_args[1]['data'])['resourceId'] for call_args in mocked_request.call_args_list[2:]]
+        self.assertEqual(sum(retried, []), uuids[1000:], 'only the uuids of the failed chunk should be retried')
+        mocked_sleep.assert_called_once()
+
+    @patch('time.sleep')
+    @patch('requests.Session.request')
+    def test_refused_chunk_not_retried(self, mocked_request, mocked_sleep):
+        response = MagicMock()
+        response.status_code = 400
+        mocked_request.return_value = response
+
+        with patch('builtins.print'):
+            self.assertEqual(Vrops.get_latest_stats_multiple('refusing.test', 'token', ['uuid-0'], ['cpu|demandPct']),
+                             {})
+        self.assertEqual(mocked_request.call_count, 1)
+        mocked_sleep.assert_not_called()
+
+    @patch('requests.Session.request')
+    def test_timeouts_and_deadline(self, mocked_request):
+        mocked_request.return_value = json_response({'adapterInstancesInfoDto': []})
+        self.assertEqual(Vrops.get_adapter('timeout.test', 'token'), [])
+        self.assertEqual(mocked_request.call_args[1]['timeout'], (10, 60), 'every request needs a timeout')
+
+        passed = deadline.set(time.monotonic() - 1)
+        try:
+            with patch('builtins.print'):
+                self.assertFalse(Vrops.get_adapter('timeout.test', 'token'))
+                self.assertEqual(Vrops.get_latest_stats_multiple('timeout.test', 'token', ['uuid-0'],
+                                                                 ['cpu|demandPct']), {})
+        finally:
+            deadline.reset(passed)
+        self.assertEqual(mocked_request.call_count, 1, 'nothing should be sent after the deadline')
+
+    @patch('requests.Session.request')
+    def test_open_circuit_fails_fast(self, mocked_request):
+        os.environ['BREAKER_FAILURES'] = '2'
+        mocked_request.side_effect = requests.exceptions.ConnectionError('node down')
+
+        with patch('builtins.print'), patch('time.sleep'):
+            self.assertEqual(Vrops.get_latest_stats_multiple('down.test', 'token', ['uuid-0'], ['cpu|demandPct']), {})
+            calls = mocked_request.call_count
+            self.assertEqual(Vrops.get_latest_stats_multiple('down.test', 'token', ['uuid-0'], ['cpu|demandPct']), {})
+        self.assertEqual(calls, 2, 'no more retries once the circuit is open')
+        self.assertEqual(mocked_request.call_count, calls, 'an open circuit should not send requests')
+
+    @patch('requests.Session.request')
+    def test_project_ids_flat_index(self, mocked_request):
+        def relations(method, url, data, **kwargs):
+            uuid_list = json.loads(data)['resourceIds']
+            response = MagicMock()
+            response.status_code = 200
+            response.json.return_value = {'resourcesRelations': [
+                {'resource': {'resourceKey': {'name': 'Project (' + project + ')'}},
+                 'relatedResources': [uuid for uuid in uuid_list if uuid.endswith(project[-1])]}
+                for project in ['p0', 'p1']]}
+            return response
+        mocked_request.side_effect = relations
+
+        project_ids = Vrops.get_project_ids('testhost.test', 'token', ['uuid-' + str(i) for i in range(1200)])
+        self.assertEqual(len(project_ids), 240)
+        self.assertEqual(project_ids['uuid-1191'], 'p1')
+        self.assertNotIn('uuid-1192', project_ids)
+
+    @patch('requests.Session.request')
+    def test_parent_relationships(self, mocked_request):
+        def relations(method, url, data, **kwargs):
+            payload = json.loads(data)
+            self.assertEqual(payload['relationshipType'], 'PARENT')
+            self.assertEqual(payload['resourceQuery']['resourceKind'], ['HostSystem'])
+            response = MagicMock()
+            response.status_code = 200
+            # every datastore is mounted on two hosts
+            response.json.return_value = {'resourcesRelations': [
+                {'resource': {'identifier': host}, 'relatedResources': payload['resourceIds']}
+                for host in ['host-0', 'host-1']]}
+            return response
+        mocked_request.side_effect = relations
+
+        parents = Vrops.get_relationships('testhost.test', 'token', ['ds-' + str(i) for i in range(1500)], 'PARENT',
+                                          'HostSystem')
+        self.assertEqual(len(parents), 1500)
+        self.assertEqual(parents['ds-1499'], ['host-0', 'host-1'])
+        self.assertGreater(mocked_request.call_count, 1, 'the uuids should be chunked')
+
+    def test_session_per_target(self):
+        os.environ['POOL_SIZE'] = '7'
+        session = Vrops.get_session('pooled.test')
+        self.assertIs(session, Vrops.get_session('pooled.test'), 'session should be reused for the same target')
+        self.assertIsNot(session, Vrops.get_session('other.test'), 'every target should get its own session')
+        self.assertEqual(session.get_adapter('https://pooled.test')._pool_maxsize, 7)
+        self.assertFalse(session.verify)
+
+    def test_map_chunks_bounded_and_ordered(self):
+        os.environ['TARGET_CONCURRENCY'] = '3'
+        lock = Lock()
+        running = {'now': 0, 'max': 0}
+
+        def chunk_func(chunk, factor, chunk_iteration):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.05)
+            with lock:
+                running['now'] -= 1
+            return [element * factor for element in chunk]
+
+        chunks = [[i, i + 1] for i in range(0, 20, 2)]
+        results = Vrops.map_chunks('bounded.test', chunk_func, chunks, 10)
+
+        self.assertEqual(results, [[element * 10 for element in chunk] for chunk in chunks])
+        self.assertLessEqual(running['max'], 3, 'more chunks in flight than TARGET_CONCURRENCY allows')
+
+    @patch('requests.Session.request')
+    def test_token_cached_until_validity(self, mocked_request):
+        os.environ.update({'USER': 'FOO', 'PASSWORD': 'Bar', 'TOKEN_REFRESH_MARGIN': '300'})
+        issued = list()
+
+        def acquire(method, url, data, **kwargs):
+            issued.append('token-' + str(len(issued)))
+            response = MagicMock()
+            response.status_code = 200
+            # the first token is about to expire, the second one is valid for another hour
+            validity = time.time() + (60 if len(issued) == 1 else 3600)
+            response.json.return_value = {'token': issued[-1], 'validity': int(validity * 1000)}
+            return response
+        mocked_request.side_effect = acquire
+
+        self.assertEqual(Vrops.get_token('expiring.test'), 'token-0')
+        self.assertEqual(Vrops.get_token('expiring.test'), 'token-1', 'token within the margin should be renewed')
+        self.assertEqual(Vrops.get_token('expiring.test'), 'token-1')
+        self.assertEqual(mocked_request.call_count, 2)
+
+    @patch('requests.Session.request')
+    def test_retry_once_after_401(self, mocked_request):
+        Vrops.tokens['rejecting.test'] = {'token': 'stale', 'validity': None}
+        token_source = MagicMock(return_value={'token': 'fresh', 'validity': None})
+        Vrops.token_source = token_source
+
+        def query(method, url, headers, data, **kwargs):
+            if headers['Authorization'] == 'vRealizeOpsToken stale':
+                response = MagicMock()
+                response.status_code = 401
+                return response
+            return stats_response(json.loads(data)['resourceId'], json.loads(data)['statKey'])
+        mocked_request.side_effect = query
+
+        try:
+            values = Vrops.get_latest_stats_multiple('rejecting.test', 'stale', ['uuid-0'], ['cpu|demandPct'])
+        finally:
+            Vrops.token_source = None
+        self.assertEqual(values[('uuid-0', 'cpu|demandPct')], 13.0)
+        self.assertEqual(mocked_request.call_count, 2)
+        token_source.assert_called_once_with('rejecting.test', 'stale')
+        self.assertEqual(Vrops.tokens['rejecting.test']['token'], 'fresh')
+
+    def test_slow_renewal_holds_up_no_other_target(self):
+        answer = Event()
+
+        def token_source(target, stale_token):
+            if target == 'slow.test':
+                answer.wait(10)
+            return {'token': target + '-token', 'validity': None}
+        Vrops.token_source = token_source
+        try:
+            slow = Thread(target=Vrops.get_token, args=('slow.test',))
+            slow.start()
+            start = time.monotonic()
+            self.assertEqual(Vrops.get_token('fast.test'), 'fast.test-token')
+            self.assertIsNone(Vrops.get_cached_token('slow.test'), 'nothing cached yet, but no waiting either')
+            self.assertLess(time.monotonic() - start, 5)
+            answer.set()
+            slow.join()
+        finally:
+            Vrops.token_source = None
+        self.assertEqual(Vrops.get_cached_token('slow.test'), 'slow.test-token')
+
+    def test_latest_stats_multiple_without_list(self):
+        with patch('builtins.print'):
+            self.assertFalse(Vrops.get_latest_stats_multiple('testhost.test', 'token', 'uuid-0', ['cpu|demandPct']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+import sys
+sys.path.append('.')
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from tools.Vrops import Vrops, IncompleteError, transport
+from tools.VropsAsync import VropsAsync
+from tools.CircuitBreaker import CircuitBreaker
+from tools.AdaptiveChunker import AdaptiveChunker
+from tools.Governor import Governor
+from threading import Timer
+import json
+import os
+import unittest
+
+
+class FakeContent:
+    def __init__(self, raw):
+        self.raw = raw
+
+    async def iter_chunked(self, size):
+        for i in range(0, len(self.raw), 100):
+            yield self.raw[i:i + 100]
+
+
+class FakeResponse:
+    def __init__(self, body, status=200, raw=None):
+        self.status = status
+        self.body = body
+        self.content = FakeContent(raw or json.dumps(body).encode())
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return json.dumps(self.body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeSession:
+    def __init__(self):
+        self.posts = list()
+
+    def request(self, method, url, headers=None, params=None, data=None, **kwargs):
+        if method == 'GET':
+            return FakeResponse({'resourceList': [
+                {'identifier': 'uuid-' + str(i), 'resourceKey': {'name': params['resourceKind'] + str(i)}}
+                for i in range(3)]})
+        payload = json.loads(data)
+        self.posts.append(payload)
+        if url.endswith('/auth/token/acquire'):
+            return FakeResponse({'token': 'async-token', 'validity': 1582797716394})
+        return FakeResponse({'values': [
+            {'resourceId': uuid, 'stat-list': {'stat': [
+                {'timestamps': [1582797716394], 'statKey': {'key': key}, 'data': [1.0]} for key in payload['statKey']]}}
+            for uuid in payload['resourceId']]})
+
+
+class TestVropsAsync(TestCase):
+    os.environ.setdefault('DEBUG', '0')
+    os.environ.setdefault('USER', 'FOO')
+    os.environ.setdefault('PASSWORD', 'Bar')
+
+    def test_transport_switch(self):
+        os.environ['TRANSPORT'] = 'async'
+        self.assertIs(transport(), VropsAsync)
+        os.environ['TRANSPORT'] = 'sync'
+        self.assertIs(transport(), Vrops)
+
+    def test_same_surface(self):
+        os.environ['TRANSPORT'] = 'async'
+        Vrops.tokens.clear()
+        fake_session = FakeSession()
+
+        async def get_async_session(target):
+            return fake_session
+
+        with patch.object(VropsAsync, 'get_async_session', new=get_async_session):
+            self.assertEqual(VropsAsync.get_token('testhost.test'), 'async-token')
+
+            vrops = VropsAsync()
+            hosts = vrops.get_hosts(target='testhost.test', token='async-token', parentid='cluster-uuid')
+            self.assertEqual(hosts[2], {'name': 'HostSystem2', 'uuid': 'uuid-2'})
+
+            uuids = ['uuid-' + str(i) for i in range(2001)]
+            values = VropsAsync.get_latest_stats_multiple('testhost.test', 'async-token', uuids,
+                                                          ['cpu|demandPct', 'mem|balloonPct'])
+        self.assertEqual(len(values), 2 * len(uuids))
+        self.assertEqual(values[('uuid-2000', 'mem|balloonPct')], 1.0)
+        # token request plus one query per 1000 uuids
+        self.assertEqual(len(fake_session.posts), 4)
+
+    def test_chunk_sizes_adapt_within_a_list(self):
+        fake_session = FakeSession()
+
+        async def get_async_session(target):
+            return fake_session
+
+        # every chunk counts as slow, so each one that is done shrinks the ones that are still to come
+        os.environ.update({'TARGET_CONCURRENCY': '1', 'CHUNK_SLOW_SECONDS': '0'})
+        try:
+            with patch.object(VropsAsync, 'get_async_session', new=get_async_session):
+                uuids = ['uuid-' + str(i) for i in range(2000)]
+                values = VropsAsync.get_latest_stats_multiple('shrinking.test', 'async-token', uuids, ['cpu|demandPct'])
+        finally:
+            os.environ.pop('TARGET_CONCURRENCY')
+            os.environ.pop('CHUNK_SLOW_SECONDS')
+        self.assertEqual(len(values), 2000)
+        self.assertEqual([len(post['resourceId']) for post in fake_session.posts][:3], [1000, 750, 250])
+
+    def test_wait_at_governor_not_timed(self):
+        fake_session = FakeSession()
+
+        async def get_async_session(target):
+            return fake_session
+
+        os.environ.update({'GOVERNOR_RPS': '0', 'GOVERNOR_CONCURRENCY': '1'})
+        try:
+            # the only slot of the target is taken for a while, the chunk has to queue for it
+            Governor.acquire('queued.test')
+            Timer(0.5, Governor.release, args=('queued.test',)).start()
+            with patch.object(VropsAsync, 'get_async_session', new=get_async_session):
+                self.assertEqual(len(VropsAsync.get_latest_stats_multiple('queued.test', 'async-token', ['uuid-0'],
+                                                                          ['cpu|demandPct'])), 1)
+        finally:
+            os.environ.pop('GOVERNOR_RPS')
+            os.environ.pop('GOVERNOR_CONCURRENCY')
+        self.assertLess(AdaptiveChunker.states[('queued.test', 'stats')]['latency'], 0.4)
+
+    @patch('builtins.print')
+    def test_refused_or_unreadable_chunks(self, mocked_print):
+        class BrokenSession(FakeSession):
+            def request(self, method, url, headers=None, params=None, data=None, **kwargs):
+                self.posts.append(json.loads(data))
+                if 'refused' in url:
+                    return FakeResponse('bad request', status=400)
+                return FakeResponse(None, raw=b'{"values": [{"resourceId": ')
+        broken_session = BrokenSession()
+
+        async def get_async_session(target):
+            return broken_session
+
+        with patch.object(VropsAsync, 'get_async_session', new=get_async_session):
+            self.assertEqual(VropsAsync.get_latest_stats_multiple('refused.test', 'async-token', ['uuid-0'],
+                                                                  ['cpu|demandPct']), {})
+            self.assertEqual(len(broken_session.posts), 1, 'a refused chunk should not be retried')
+            # without an answer for every chunk, vms without a project can't be told apart
+            self.assertIs(VropsAsync.get_project_ids('refused.test', 'async-token', ['uuid-0']), False)
+            os.environ['RETRY_ATTEMPTS'] = '0'
+            try:
+                self.assertEqual(VropsAsync.get_latest_stats_multiple('unreadable.test', 'async-token', ['uuid-0'],
+                                                                      ['cpu|demandPct']), {})
+            finally:
+                os.environ.pop('RETRY_ATTEMPTS')
+        # vrops answered both, a body that can't be decoded says nothing about the health of the target
+        self.assertEqual(CircuitBreaker.breakers['unreadable.test']['failures'], 0)
+
+    @patch('builtins.print')
+    def test_failed_page_retried(self, mocked_print):
+        class PagingSession(FakeSession):
+            failing = 1
+
+            def request(self, method, url, headers=None, params=None, data=None, **kwargs):
+                if params['page'] == 1 and self.failing:
+                    self.failing -= 1
+                    return FakeResponse('server error', status=500)
+                return FakeResponse({'pageInfo': {'totalCount': 3}, 'resourceList': [
+                    {'identifier': 'u' + str(params['page']), 'resourceKey': {'name': 'vm' + str(params['page'])}}]})
+        paging_session = PagingSession()
+
+        async def get_async_session(target):
+            return paging_session
+
+        os.environ.update({'PAGE_SIZE': '1', 'RETRY_BACKOFF': '0'})
+        try:
+            with patch.object(VropsAsync, 'get_async_session', new=get_async_session):
+                self.assertEqual(VropsAsync().get_resources('paging.test', 'token', 'VirtualMachine', None),
+                                 [{'name': 'vm' + str(i), 'uuid': 'u' + str(i)} for i in range(3)])
+                paging_session.failing = 10
+                with self.assertRaises(IncompleteError):
+                    VropsAsync().get_resources('paging.test', 'token', 'VirtualMachine', None)
+        finally:
+            os.environ.pop('PAGE_SIZE')
+            os.environ.pop('RETRY_BACKOFF')
+
+    def test_inherits_blocking_helpers(self):
+        vrops = VropsAsync()
+        with patch.object(VropsAsync, 'get_resources', new=MagicMock(return_value=[])) as mocked_resources:
+            vrops.get_datastores(target='testhost.test', token='async-token', parentid='host-uuid')
+        mocked_resources.assert_called_once_with('testhost.test', 'async-token', parentid='host-uuid',
+                                                 resourcekind='Datastore')
+
+
+if __name__ == '__main__':
+    unittest.main()
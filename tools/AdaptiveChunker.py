@@ -0,0 +1,65 @@
+from threading import Lock
+from prometheus_client import Gauge
+import os
+
+chunk_size_gauge = Gauge('vrops_exporter_chunk_size', 'uuids per bulk query learned by the adaptive chunker',
+                         ['target', 'endpoint'])
+chunk_latency_gauge = Gauge('vrops_exporter_chunk_latency_seconds', 'moving average of the bulk query latency',
+                            ['target', 'endpoint'])
+chunk_bytes_gauge = Gauge('vrops_exporter_chunk_bytes', 'moving average of the bulk query response size',
+                          ['target', 'endpoint'])
+
+
+class AdaptiveChunker:
+    # learns the amount of uuids per bulk query for every target and endpoint (stats, properties, relationships).
+    # chunks are halved after failures, shrunk after slow or oversized responses and grown again step by step
+    # while the target answers fast. CHUNK_MIN and CHUNK_MAX bound the size, vrops itself takes up to 1000
+    states = dict()
+    lock = Lock()
+
+    def limits():
+        return int(os.environ.get('CHUNK_MIN', '100')), int(os.environ.get('CHUNK_MAX', '1000'))
+
+    def get_size(target, endpoint):
+        with AdaptiveChunker.lock:
+            return AdaptiveChunker.get_state(target, endpoint)['size']
+
+    # must be called with the lock held
+    def get_state(target, endpoint):
+        if (target, endpoint) not in AdaptiveChunker.states:
+            AdaptiveChunker.states[(target, endpoint)] = {'size': AdaptiveChunker.limits()[1], 'latency': None,
+                                                          'bytes': None}
+            chunk_size_gauge.labels(target, endpoint).set(AdaptiveChunker.limits()[1])
+        return AdaptiveChunker.states[(target, endpoint)]
+
+    # the size is looked up for every chunk, so a long list already benefits from what the first chunks taught
+    def chunks(target, endpoint, uuids):
+        position = 0
+        while position < len(uuids):
+            size = AdaptiveChunker.get_size(target, endpoint)
+            yield uuids[position:position + size]
+            position += size
+
+    def record(target, endpoint, size, seconds, failed=False, received=None):
+        chunk_min, chunk_max = AdaptiveChunker.limits()
+        slow = float(os.environ.get('CHUNK_SLOW_SECONDS', '5'))
+        max_bytes = int(os.environ.get('CHUNK_MAX_BYTES', str(32 * 1024 * 1024)))
+        with AdaptiveChunker.lock:
+            state = AdaptiveChunker.get_state(target, endpoint)
+            state['latency'] = seconds if state['latency'] is None else 0.8 * state['latency'] + 0.2 * seconds
+            if received is not None:
+                state['bytes'] = received if state['bytes'] is None else 0.8 * state['bytes'] + 0.2 * received
+
+            # only chunks of the current size say something about it
+            if failed:
+                state['size'] = max(chunk_min, min(state['size'], size) // 2)
+            elif size >= state['size'] and (seconds > slow or (received or 0) > max_bytes):
+                state['size'] = max(chunk_min, state['size'] * 3 // 4)
+            elif size >= state['size'] and seconds < slow / 4:
+                state['size'] = min(chunk_max, state['size'] + max(chunk_min // 2, state['size'] // 10))
+            state['size'] = max(chunk_min, min(chunk_max, state['size']))
+
+            chunk_size_gauge.labels(target, endpoint).set(state['size'])
+            chunk_latency_gauge.labels(target, endpoint).set(state['latency'])
+            if state['bytes'] is not None:
+                chunk_bytes_gauge.labels(target, endpoint).set(state['bytes'])
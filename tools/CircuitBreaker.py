@@ -0,0 +1,70 @@
+from threading import Lock
+from prometheus_client import Gauge
+import time
+import os
+
+STATES = {'closed': 0, 'half-open': 1, 'open': 2}
+
+circuit_state_gauge = Gauge('vrops_exporter_circuit_state', 'state of the circuit breaker of a target, '
+                                                            '0: closed, 1: half-open, 2: open', ['target'])
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # one breaker per target. after BREAKER_FAILURES failures in a row the circuit opens and every request
+    # fails fast. after BREAKER_RESET_SECONDS a single probe is let through (half-open), its outcome
+    # closes the circuit again or keeps it open for another period
+    breakers = dict()
+    lock = Lock()
+
+    # must be called with the lock held
+    def get_breaker(target):
+        if target not in CircuitBreaker.breakers:
+            CircuitBreaker.breakers[target] = {'state': 'closed', 'failures': 0, 'opened': 0, 'probing': False}
+            circuit_state_gauge.labels(target).set(STATES['closed'])
+        return CircuitBreaker.breakers[target]
+
+    def set_state(target, breaker, state):
+        if breaker['state'] != state:
+            print("circuit of", target, "is", state)
+        breaker['state'] = state
+        circuit_state_gauge.labels(target).set(STATES[state])
+
+    def get_state(target):
+        with CircuitBreaker.lock:
+            return CircuitBreaker.get_breaker(target)['state']
+
+    # raises CircuitOpenError if the target should not be asked right now
+    def before_request(target):
+        with CircuitBreaker.lock:
+            breaker = CircuitBreaker.get_breaker(target)
+            if breaker['state'] == 'closed':
+                return
+            if breaker['state'] == 'open' and \
+                    time.monotonic() - breaker['opened'] >= int(os.environ.get('BREAKER_RESET_SECONDS', '60')):
+                CircuitBreaker.set_state(target, breaker, 'half-open')
+            if breaker['state'] == 'half-open' and not breaker['probing']:
+                breaker['probing'] = True
+                return
+        raise CircuitOpenError("circuit of " + target + " is open, not sending request")
+
+    def success(target):
+        with CircuitBreaker.lock:
+            breaker = CircuitBreaker.get_breaker(target)
+            breaker['failures'] = 0
+            breaker['probing'] = False
+            if breaker['state'] != 'closed':
+                CircuitBreaker.set_state(target, breaker, 'closed')
+
+    def failure(target):
+        with CircuitBreaker.lock:
+            breaker = CircuitBreaker.get_breaker(target)
+            breaker['failures'] += 1
+            breaker['probing'] = False
+            if breaker['state'] == 'half-open' or \
+                    breaker['failures'] >= int(os.environ.get('BREAKER_FAILURES', '5')):
+                breaker['opened'] = time.monotonic()
+                CircuitBreaker.set_state(target, breaker, 'open')
@@ -0,0 +1,149 @@
+from threading import Condition, Lock
+from contextlib import contextmanager
+from contextvars import ContextVar
+import asyncio
+import heapq
+import itertools
+import time
+import os
+
+# priorities, lower is served first
+VM_STATS = 0
+STATS = 1
+PROPERTIES = 2
+INVENTORY = 3
+
+# who is sending the requests of the current thread or task: (flow name, priority)
+caller = ContextVar('vrops_caller', default=('inventory', INVENTORY))
+# targets a slot is held for in the current context, so nested sends don't queue twice
+holding = ContextVar('vrops_holding', default=frozenset())
+
+
+class Governor:
+    # one governor per target, shared by the inventory crawl and all collectors of the process. it admits at most
+    # GOVERNOR_RPS requests per second (token bucket, bursts up to the same amount) and GOVERNOR_CONCURRENCY
+    # requests at once. waiting requests are served by priority first, then the flow that got the fewest
+    # requests so far, so one busy collector can't crowd out the others
+    governors = dict()
+    lock = Lock()
+    sequence = itertools.count()
+
+    def get_governor(target):
+        with Governor.lock:
+            if target not in Governor.governors:
+                rate = float(os.environ.get('GOVERNOR_RPS', '50'))
+                Governor.governors[target] = {
+                    'condition': Condition(),
+                    'rate': rate,
+                    'tokens': rate,
+                    'refilled': time.monotonic(),
+                    'concurrency': int(os.environ.get('GOVERNOR_CONCURRENCY', '8')),
+                    'active': 0,
+                    'waiting': list(),
+                    'served': dict(),
+                    # entry -> (loop, future) of the coroutines of the async transport waiting for their turn
+                    'async_waiters': dict()
+                }
+            return Governor.governors[target]
+
+    # must be called with the condition held
+    def refill(governor):
+        now = time.monotonic()
+        governor['tokens'] = min(governor['rate'], governor['tokens'] + (now - governor['refilled']) * governor['rate'])
+        governor['refilled'] = now
+
+    # must be called with the condition held
+    def enqueue(governor, flow):
+        name, priority = flow
+        entry = (priority, governor['served'].get(name, 0), next(Governor.sequence), name)
+        heapq.heappush(governor['waiting'], entry)
+        return entry
+
+    # must be called with the condition held, returns whether entry may go and otherwise how long to wait at most
+    def admit(governor, entry):
+        Governor.refill(governor)
+        if governor['waiting'][0] is entry and governor['active'] < governor['concurrency'] and \
+                (governor['rate'] <= 0 or governor['tokens'] >= 1):
+            heapq.heappop(governor['waiting'])
+            governor['active'] += 1
+            governor['tokens'] -= 1
+            governor['served'][entry[3]] = governor['served'].get(entry[3], 0) + 1
+            # the next in line may be able to go as well
+            Governor.wake(governor)
+            return True, None
+        if governor['rate'] > 0 and governor['tokens'] < 1:
+            return False, (1 - governor['tokens']) / governor['rate']
+        return False, None
+
+    # must be called with the condition held. waiting threads check their turn on their own, of the waiting
+    # coroutines only the first in line is woken and only if there is a free slot, the others could not go anyway
+    def wake(governor):
+        governor['condition'].notify_all()
+        if governor['waiting'] and governor['active'] < governor['concurrency']:
+            waiter = governor['async_waiters'].pop(governor['waiting'][0], None)
+            if waiter:
+                loop, woken = waiter
+                loop.call_soon_threadsafe(Governor.set_woken, woken)
+
+    def set_woken(woken):
+        if not woken.done():
+            woken.set_result(None)
+
+    def acquire(target, flow=None):
+        governor = Governor.get_governor(target)
+        with governor['condition']:
+            entry = Governor.enqueue(governor, flow or caller.get())
+            while True:
+                admitted, wait = Governor.admit(governor, entry)
+                if admitted:
+                    return
+                governor['condition'].wait(wait)
+
+    # the event loop must not block, so a waiting request of the async transport awaits a future that is set
+    # once it is first in line and a slot is released. only the first in line waits for the rate as well
+    async def acquire_async(target, flow=None):
+        governor = Governor.get_governor(target)
+        loop = asyncio.get_event_loop()
+        with governor['condition']:
+            entry = Governor.enqueue(governor, flow or caller.get())
+        try:
+            while True:
+                with governor['condition']:
+                    admitted, wait = Governor.admit(governor, entry)
+                    if admitted:
+                        governor['async_waiters'].pop(entry, None)
+                        return
+                    woken = loop.create_future()
+                    governor['async_waiters'][entry] = (loop, woken)
+                    if governor['waiting'][0] is not entry:
+                        wait = None
+                await asyncio.wait([woken], timeout=wait)
+        except BaseException:
+            with governor['condition']:
+                governor['async_waiters'].pop(entry, None)
+                if entry in governor['waiting']:
+                    governor['waiting'].remove(entry)
+                    heapq.heapify(governor['waiting'])
+                    Governor.wake(governor)
+            raise
+
+    def release(target):
+        governor = Governor.get_governor(target)
+        with governor['condition']:
+            governor['active'] -= 1
+            Governor.wake(governor)
+
+    # holds one slot of the target for the enclosed requests, nested slots of the same context are free
+    @contextmanager
+    def slot(target):
+        held = holding.get()
+        if target in held:
+            yield
+            return
+        Governor.acquire(target)
+        token = holding.set(held | {target})
+        try:
+            yield
+        finally:
+            holding.reset(token)
+            Governor.release(target)
@@ -0,0 +1,46 @@
+import sqlite3
+import json
+import os
+
+
+class InventorySnapshot:
+    # keeps the last successful inventory iteration in a SQLite file, one row of compact json per kind and target.
+    # a new snapshot is written next to the old one and then moved over it, so a crash never leaves half of one.
+    # tokens are not written to disk
+
+    def save(path, iteration, inventory):
+        temporary = path + '.tmp'
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        connection = sqlite3.connect(temporary)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                connection.execute("CREATE TABLE inventory (kind TEXT, target TEXT, resources TEXT, "
+                                   "PRIMARY KEY (kind, target))")
+                connection.execute("INSERT INTO meta VALUES ('iteration', ?)", (str(iteration),))
+                connection.executemany("INSERT INTO inventory VALUES (?, ?, ?)", [
+                    (kind, target, json.dumps({uuid: dict(resource, token=None) for uuid, resource in
+                                               resources.items()}, separators=(',', ':')))
+                    for kind, tree in inventory.items() for target, resources in tree.items()])
+        finally:
+            connection.close()
+        os.replace(temporary, path)
+
+    # returns the iteration and the inventory of the snapshot, None if there is none or it can't be read
+    def load(path):
+        if not os.path.exists(path):
+            return None
+        try:
+            connection = sqlite3.connect(path)
+            try:
+                iteration = int(connection.execute("SELECT value FROM meta WHERE key = 'iteration'").fetchone()[0])
+                inventory = dict()
+                for kind, target, resources in connection.execute("SELECT kind, target, resources FROM inventory"):
+                    inventory.setdefault(kind, dict())[target] = json.loads(resources)
+            finally:
+                connection.close()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print("Problem loading inventory snapshot", path, "Error:", str(e))
+            return None
+        return iteration, inventory
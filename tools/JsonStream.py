@@ -0,0 +1,114 @@
+import codecs
+import json
+
+
+class JsonStream:
+    # incremental decoder for vrops responses of the form {"pageInfo": {..}, "<array_key>": [{..}, {..}], ..}.
+    # bytes are fed as they arrive and every element of the array is handed out as soon as it is complete,
+    # so only one element is held in memory at a time. all other top level members end up in skeleton
+    def __init__(self, array_key):
+        self.array_key = array_key
+        self.skeleton = dict()
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'start'
+        self.key = None
+        self.closed = False
+        self.received = 0
+
+    def feed(self, data):
+        self.received += len(data)
+        self.buffer += self.utf8.decode(data)
+        return list(self.elements())
+
+    def close(self):
+        self.buffer += self.utf8.decode(b'', final=True)
+        self.closed = True
+        elements = list(self.elements())
+        if self.state != 'done':
+            raise json.decoder.JSONDecodeError("Unexpected end of stream while looking for " + self.array_key,
+                                               self.buffer, self.pos)
+        return elements
+
+    def skip_whitespace(self, separators=' \t\n\r'):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in separators:
+            self.pos += 1
+        return self.pos < len(self.buffer)
+
+    def decode_next(self):
+        # values ending exactly at the end of the buffer could be cut numbers, wait for more in that case
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        except json.decoder.JSONDecodeError:
+            if self.closed:
+                raise
+            return False, None
+        if end == len(self.buffer) and not self.closed:
+            return False, None
+        self.pos = end
+        return True, value
+
+    def elements(self):
+        while self.state != 'done':
+            if self.state == 'start':
+                if not self.skip_whitespace():
+                    break
+                if self.buffer[self.pos] != '{':
+                    raise json.decoder.JSONDecodeError("Expecting object", self.buffer, self.pos)
+                self.pos += 1
+                self.state = 'key'
+            elif self.state == 'key':
+                if not self.skip_whitespace(' \t\n\r,'):
+                    break
+                if self.buffer[self.pos] == '}':
+                    self.pos += 1
+                    self.state = 'done'
+                    break
+                complete, key = self.decode_next()
+                if not complete:
+                    break
+                self.key = key
+                self.state = 'colon'
+            elif self.state == 'colon':
+                if not self.skip_whitespace():
+                    break
+                if self.buffer[self.pos] != ':':
+                    raise json.decoder.JSONDecodeError("Expecting ':' delimiter", self.buffer, self.pos)
+                self.pos += 1
+                self.state = 'value'
+            elif self.state == 'value':
+                if not self.skip_whitespace():
+                    break
+                if self.key == self.array_key and self.buffer[self.pos] == '[':
+                    self.pos += 1
+                    self.state = 'array'
+                    continue
+                complete, value = self.decode_next()
+                if not complete:
+                    break
+                self.skeleton[self.key] = value
+                self.state = 'key'
+            elif self.state == 'array':
+                if not self.skip_whitespace(' \t\n\r,'):
+                    break
+                if self.buffer[self.pos] == ']':
+                    self.pos += 1
+                    self.state = 'key'
+                    continue
+                complete, element = self.decode_next()
+                if not complete:
+                    break
+                yield element
+        # drop what has been consumed, so the buffer never grows beyond one element
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+
+
+# feeds an iterable of byte chunks and yields the array elements while the rest is still in transfer
+def iter_elements(chunks, array_key, stream=None):
+    stream = stream or JsonStream(array_key)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
@@ -0,0 +1,27 @@
+from threading import Lock
+from weakref import WeakValueDictionary
+
+
+class RecordStore:
+    # hash-conses the resource records of all retained iterations. a finished tree is shared bottom up: a record
+    # equal to one already stored, same identity and the very same child records, is replaced by the stored one.
+    # unchanged subtrees are kept once no matter how many iterations refer to them, and records no iteration
+    # refers to anymore drop out of the store on their own. the token is only needed while crawling, shared
+    # records don't keep it, so a renewed token does not make a new record
+    records = WeakValueDictionary()
+    lock = Lock()
+
+    def share(resource_object):
+        for attribute in resource_object.children:
+            setattr(resource_object, attribute,
+                    tuple(RecordStore.share(child) for child in getattr(resource_object, attribute)))
+        resource_object.token = None
+        key = (type(resource_object), resource_object.target, resource_object.name,
+               resource_object.uuid) + tuple(tuple(id(child) for child in getattr(resource_object, attribute))
+                                             for attribute in resource_object.children)
+        with RecordStore.lock:
+            shared = RecordStore.records.get(key)
+            if shared is None:
+                RecordStore.records[key] = resource_object
+                return resource_object
+            return shared
@@ -1,14 +1,199 @@
 from urllib3 import disable_warnings
 from urllib3 import exceptions
-from tools.helper import chunk_list
-from threading import Thread
+from tools.AdaptiveChunker import AdaptiveChunker
+from tools.CircuitBreaker import CircuitBreaker, CircuitOpenError
+from tools.JsonStream import JsonStream, iter_elements
+from tools.Governor import Governor
+from threading import Lock, BoundedSemaphore, Thread
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextvars import copy_context, ContextVar
+from requests.adapters import HTTPAdapter
 import requests
 import json
+import random
+import time
 import os
 
+# monotonic time after which the requests of the current thread or task are not sent anymore. the inventory sets it
+# to the deadline of a target's build, so a build that missed it winds down instead of holding on to the target
+deadline = ContextVar('vrops_deadline', default=None)
+
+
+class DeadlineError(Exception):
+    pass
+
+
+# raised when a listing is missing resources because pages of it were given up on
+class IncompleteError(Exception):
+    pass
+
 
 class Vrops:
-    def get_token(target):
+    # one keep-alive session per target, shared by all threads of the process
+    sessions = dict()
+    sessions_lock = Lock()
+
+    def get_session(target):
+        with Vrops.sessions_lock:
+            if target not in Vrops.sessions:
+                session = requests.Session()
+                session.verify = False
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(os.environ.get('POOL_SIZE', '20')))
+                session.mount('https://', adapter)
+                Vrops.sessions[target] = session
+            return Vrops.sessions[target]
+
+    # one executor for all chunked queries of the process, threads are reused across calls
+    executor = None
+    target_slots = dict()
+    executor_lock = Lock()
+
+    def get_executor():
+        with Vrops.executor_lock:
+            if not Vrops.executor:
+                Vrops.executor = ThreadPoolExecutor(max_workers=int(os.environ.get('MAX_WORKERS', '40')),
+                                                    thread_name_prefix='vrops')
+            return Vrops.executor
+
+    def get_target_slots(target):
+        with Vrops.executor_lock:
+            if target not in Vrops.target_slots:
+                Vrops.target_slots[target] = BoundedSemaphore(int(os.environ.get('TARGET_CONCURRENCY', '8')))
+            return Vrops.target_slots[target]
+
+    # runs func(chunk, *args, chunk_iteration) for every chunk on the shared executor and returns the
+    # results in chunk order. a target never occupies more than TARGET_CONCURRENCY workers, so a slow
+    # target can't starve the others. the caller waits for a free slot, not the workers
+    def map_chunks(target, func, chunks, *args):
+        return list(Vrops.imap_chunks(target, func, chunks, *args))
+
+    # same as map_chunks, but results are yielded in chunk order as soon as they are done. with complete, a chunk
+    # that failed or was given up on is yielded as False instead of being left out
+    def imap_chunks(target, func, chunks, *args, complete=False):
+        slots = Vrops.get_target_slots(target)
+        futures = deque()
+        for chunk_iteration, chunk in enumerate(chunks, start=1):
+            while futures and futures[0][1].done():
+                yield from Vrops.chunk_result(target, *futures.popleft(), complete)
+            slots.acquire()
+            try:
+                # workers send on behalf of the caller, so they queue with its priority
+                future = Vrops.get_executor().submit(copy_context().run, func, chunk, *args, chunk_iteration)
+            except Exception:
+                slots.release()
+                raise
+            future.add_done_callback(lambda f: slots.release())
+            futures.append((chunk_iteration, future))
+        while futures:
+            yield from Vrops.chunk_result(target, *futures.popleft(), complete)
+
+    # calls func(uuid_list, *args) and retries the uuids of a failed chunk with jittered exponential backoff until
+    # RETRY_ATTEMPTS or RETRY_DEADLINE are used up. retries are cut to the chunk size the target currently takes,
+    # and skipped altogether while the circuit of the target is open. func returns False for a failed chunk and
+    # None for one vrops refused (4xx), which is not retried
+    def retry_chunk(uuid_list, target, endpoint, func, *args):
+        return Vrops.retry_chunk_results(uuid_list, target, endpoint, func, *args)[0]
+
+    # same as retry_chunk, but False if any uuids were given up on or refused, for listings that are of no use
+    # with parts missing
+    def retry_complete_chunk(uuid_list, target, endpoint, func, *args):
+        results, complete = Vrops.retry_chunk_results(uuid_list, target, endpoint, func, *args)
+        return results if complete else False
+
+    # returns the results of retry_chunk and whether nothing was given up on
+    def retry_chunk_results(uuid_list, target, endpoint, func, *args):
+        retry_deadline = time.monotonic() + float(os.environ.get('RETRY_DEADLINE', '30'))
+        attempts = int(os.environ.get('RETRY_ATTEMPTS', '3'))
+        backoff = float(os.environ.get('RETRY_BACKOFF', '0.5'))
+        results = list()
+        complete = True
+        pending = [uuid_list]
+        attempt = 0
+        while pending:
+            uuids = pending.pop(0)
+            with Governor.slot(target):
+                result = func(uuids, *args)
+            if result is None:
+                complete = False
+                continue
+            if result is not False:
+                results += result
+                continue
+            attempt += 1
+            delay = random.uniform(0, backoff * 2 ** attempt)
+            if attempt > attempts or time.monotonic() + delay > retry_deadline or \
+                    CircuitBreaker.get_state(target) == 'open' or Vrops.past_deadline():
+                print("Giving up on", len(uuids), endpoint, "uuids for target", target, "after", attempt, "attempts")
+                complete = False
+                continue
+            time.sleep(delay)
+            # pages are asked one by one, there is nothing to cut
+            if len(uuids) > 1:
+                pending = list(AdaptiveChunker.chunks(target, endpoint, uuids)) + pending
+            else:
+                pending = [uuids] + pending
+        return results, complete
+
+    def chunk_result(target, chunk_iteration, future, complete=False):
+        try:
+            chunk_result = future.result()
+        except Exception as e:
+            print("Problem in chunk", str(chunk_iteration), "for target", str(target), "Error:", str(e))
+            chunk_result = False
+        if chunk_result:
+            yield chunk_result
+        elif chunk_result is False and complete:
+            yield False
+
+    # tokens are cached per target together with their validity and renewed shortly before they expire.
+    # token_source(target, stale_token) replaces the acquire endpoint, e.g. the exporter reads the inventory's token
+    # instead and passes on the one vrops rejected.
+    # renewals of a target are serialized by its own lock, so a target that is slow to answer holds up no other
+    tokens = dict()
+    tokens_lock = Lock()
+    renew_locks = dict()
+    token_source = None
+
+    # every request waits for the governor of its target. streamed responses are read within a wider
+    # Governor.slot of the caller, so the slot is held until the body has arrived
+    def send(target, method, url, headers, **kwargs):
+        disable_warnings(exceptions.InsecureRequestWarning)
+        with Governor.slot(target):
+            response = Vrops.request(target, method, url, headers, **kwargs)
+            if response.status_code == 401 and 'Authorization' in headers:
+                # the token expired or was revoked in between, renew it and try once more
+                token = Vrops.refresh_token(target, headers['Authorization'].split()[-1])
+                if token:
+                    headers = dict(headers, Authorization="vRealizeOpsToken " + token)
+                    response = Vrops.request(target, method, url, headers, **kwargs)
+        return response
+
+    def past_deadline():
+        until = deadline.get()
+        return until is not None and time.monotonic() > until
+
+    # a single request guarded by the circuit breaker of the target, server errors and lost connections count
+    # as failures. raises CircuitOpenError without touching the network while the circuit is open, and
+    # DeadlineError once the deadline of the caller has passed. requests without a timeout of their own give up
+    # after 10s without a connection or REQUEST_TIMEOUT seconds without data, also while a body is streamed
+    def request(target, method, url, headers, **kwargs):
+        if Vrops.past_deadline():
+            raise DeadlineError("deadline has passed, not sending request to " + target)
+        CircuitBreaker.before_request(target)
+        kwargs.setdefault('timeout', (10, int(os.environ.get('REQUEST_TIMEOUT', '60'))))
+        try:
+            response = Vrops.get_session(target).request(method, url, headers=headers, verify=False, **kwargs)
+        except Exception:
+            CircuitBreaker.failure(target)
+            raise
+        if response.status_code >= 500:
+            CircuitBreaker.failure(target)
+        else:
+            CircuitBreaker.success(target)
+        return response
+
+    def acquire_token(target):
         url = "https://" + target + "/suite-api/api/auth/token/acquire"
         headers = {
             'Content-Type': "application/json",
@@ -19,25 +204,68 @@ class Vrops:
             "authSource": "Local",
             "password": os.environ['PASSWORD']
         }
-        disable_warnings(exceptions.InsecureRequestWarning)
         try:
-            response = requests.post(url,
-                                     data=json.dumps(payload),
-                                     verify=False,
-                                     headers=headers,
-                                     timeout=10)
+            # not queued at the governor: renewals happen while requests of the target hold their slots
+            disable_warnings(exceptions.InsecureRequestWarning)
+            response = Vrops.request(target, 'POST', url, headers, data=json.dumps(payload), timeout=10)
         except Exception as e:
             if os.environ['DEBUG'] >= '1':
                 print("Problem connecting to " + target + ' Error: ' + str(e))
             return False
 
         if response.status_code == 200:
-            return response.json()["token"]
+            acquired = response.json()
+            return {'token': acquired["token"], 'validity': acquired.get("validity")}
         else:
             if os.environ['DEBUG'] >= '1':
                 print("problem getting token " + str(target) + ": " + response.text)
             return False
 
+    def get_renew_lock(target):
+        with Vrops.tokens_lock:
+            return Vrops.renew_locks.setdefault(target, Lock())
+
+    # validity is given in ms since epoch, tokens without validity are kept until vrops rejects them
+    def token_valid(cached):
+        return not cached['validity'] or \
+            cached['validity'] / 1000 - int(os.environ.get('TOKEN_REFRESH_MARGIN', '300')) > time.time()
+
+    def get_token(target):
+        with Vrops.tokens_lock:
+            cached = Vrops.tokens.get(target)
+        if cached and Vrops.token_valid(cached):
+            return cached['token']
+        return Vrops.refresh_token(target, cached['token'] if cached else None)
+
+    # the cached token without waiting for the network, None if there is none. an expiring one is handed out
+    # while it is renewed in the background
+    def get_cached_token(target):
+        with Vrops.tokens_lock:
+            cached = Vrops.tokens.get(target)
+        if not cached:
+            return None
+        if not Vrops.token_valid(cached) and not Vrops.get_renew_lock(target).locked():
+            Thread(target=Vrops.get_token, args=(target,), name='token-' + target, daemon=True).start()
+        return cached['token']
+
+    def refresh_token(target, stale_token):
+        with Vrops.get_renew_lock(target):
+            with Vrops.tokens_lock:
+                cached = Vrops.tokens.get(target)
+            # another thread has renewed the token already
+            if cached and cached['token'] != stale_token:
+                return cached['token']
+            if Vrops.token_source:
+                acquired = Vrops.token_source(target, stale_token)
+            else:
+                acquired = transport().acquire_token(target)
+            with Vrops.tokens_lock:
+                if not acquired:
+                    Vrops.tokens.pop(target, None)
+                    return False
+                Vrops.tokens[target] = acquired
+            return acquired['token']
+
     def get_adapter(target, token):
         url = "https://" + target + "/suite-api/api/adapters"
         querystring = {
@@ -48,24 +276,14 @@ class Vrops:
             'Accept': "application/json",
             'Authorization': "vRealizeOpsToken " + token
         }
-        adapters = list()
-        disable_warnings(exceptions.InsecureRequestWarning)
         try:
-            response = requests.get(url,
-                                    params=querystring,
-                                    verify=False,
-                                    headers=headers)
+            response = Vrops.send(target, 'GET', url, headers, params=querystring)
         except Exception as e:
             print("Problem connecting to " + target + ' Error: ' + str(e))
             return False
 
         if response.status_code == 200:
-            for resource in response.json()["adapterInstancesInfoDto"]:
-                res = dict()
-                res['name'] = resource["resourceKey"]["name"]
-                res['uuid'] = resource["id"]
-                res['adapterkind'] = resource["resourceKey"]["adapterKindKey"]
-                adapters.append(res)
+            adapters = Vrops.parse_adapters(response.json())
         else:
             print("problem getting adapter " + str(target))
             return False
@@ -73,73 +291,114 @@ class Vrops:
         return adapters
 
     def get_resources(self, target, token, resourcekind, parentid):
+        return [{'name': name, 'uuid': uuid} for uuid, name in
+                Vrops.iter_resources(target, token, resourcekind, parentid)]
+
+    # yields (uuid, name) of every resource, page by page. the first page tells the total count, the remaining
+    # pages of PAGE_SIZE resources are fetched concurrently. pages are retried like chunks, IncompleteError is
+    # raised once one is given up on, a listing with pages missing would drop their resources from the inventory
+    def iter_resources(target, token, resourcekind, parentid):
         url = "https://" + target + "/suite-api/api/resources"
         querystring = {
             'parentId': parentid,
             'adapterKind': 'VMware',
             'resourceKind': resourcekind,
-            'pageSize': '50000'
+            'pageSize': int(os.environ.get('PAGE_SIZE', '10000'))
         }
         headers = {
             'Content-Type': "application/json",
             'Accept': "application/json",
             'Authorization': "vRealizeOpsToken " + token
         }
-        resources = list()
-        disable_warnings(exceptions.InsecureRequestWarning)
+        skeleton = dict()
+        # the slot is held until the body has arrived, most listings are this one page
+        first_page = Vrops.retry_complete_chunk([0], target, 'resources', Vrops.get_resource_page, url, headers,
+                                                querystring, target, skeleton, 0)
+        if first_page is False:
+            raise IncompleteError("listing " + resourcekind + " of " + target + " failed")
+        yield from first_page
+
+        total_count = skeleton.get('pageInfo', {}).get('totalCount', 0)
+        pages = [[page] for page in range(1, -(-total_count // querystring['pageSize']))]
+        if os.environ['DEBUG'] >= '2' and pages:
+            print(target, resourcekind, 'total:', total_count, 'pages:', len(pages) + 1)
+        for page_result in Vrops.imap_chunks(target, Vrops.retry_complete_chunk, pages, target, 'resources',
+                                             Vrops.get_resource_page, url, headers, querystring, target, skeleton,
+                                             complete=True):
+            if page_result is False:
+                raise IncompleteError("listing " + resourcekind + " of " + target + " is missing pages")
+            yield from page_result
+
+    # the (uuid, name) tuples of one page, False if it failed and None if vrops refused it. the other top level
+    # members of the response end up in skeleton
+    def get_resource_page(pages, url, headers, querystring, target, skeleton, chunk_iteration):
+        page = pages[0]
         try:
-            response = requests.get(url,
-                                    params=querystring,
-                                    verify=False,
-                                    headers=headers)
+            response = Vrops.send(target, 'GET', url, headers, params=dict(querystring, page=page), stream=True)
         except Exception as e:
             print("Problem connecting to " + target + "Error: " + str(e))
-            return resources
+            return False
 
-        if response.status_code == 200:
-            try:
-                resourcelist = response.json()["resourceList"]
-                for resource in resourcelist:
-                    res = dict()
-                    res['name'] = resource["resourceKey"]["name"]
-                    res['uuid'] = resource["identifier"]
-                    resources.append(res)
-            except json.decoder.JSONDecodeError as e:
-                print("Catching JSONDecodeError for target:", str(target), "and resourcekind:", str(resourcekind),
-                      "\nerror msg:", str(e))
-        else:
-            print("problem getting resource " + str(response.json()))
+        if response.status_code != 200:
+            print("problem getting resource " + response.text)
+            return None if 400 <= response.status_code < 500 else False
+        stream = JsonStream("resourceList")
+        try:
+            resources = [Vrops.resource_tuple(resource) for resource in
+                         iter_elements(response.iter_content(chunk_size=65536), "resourceList", stream)]
+        except (json.decoder.JSONDecodeError, requests.exceptions.RequestException) as e:
+            print("Catching error while streaming for target:", str(target), "and resourcekind:",
+                  str(querystring['resourceKind']), "page:", str(page), "\nerror msg:", str(e))
+            return False
+        skeleton.update(stream.skeleton)
         return resources
 
+    # returns the project id of every vm that belongs to a project, indexed by the vm uuid. False if chunks were
+    # given up on, vms missing from a partial answer could not be told from vms without a project
     def get_project_ids(target, token, uuids):
         if not isinstance(uuids, list):
             print("Error in get project_ids: uuids must be a list with multiple entries")
             return False
-        # vrops can not handle more than 1000 uuids
-        uuids_chunked = list(chunk_list(uuids, 1000))
-        project_ids = list()
+        pairs = Vrops.get_relationship_pairs(target, token, uuids, Vrops.project_ids_payload, Vrops.parse_project_ids)
+        return dict(pairs) if pairs is not False else False
+
+    # returns the uuids of the resources of resourcekind that are in relationship to each of uuids, e.g. with
+    # relationship PARENT the parents of every resource, indexed by the resource uuid. False if chunks were given
+    # up on
+    def get_relationships(target, token, uuids, relationship, resourcekind):
+        if not isinstance(uuids, list):
+            print("Error in get relationships: uuids must be a list with multiple entries")
+            return False
+
+        def payload(uuid_list):
+            return Vrops.relationships_payload(uuid_list, relationship, resourcekind)
+
+        pairs = Vrops.get_relationship_pairs(target, token, uuids, payload, Vrops.parse_relationships)
+        if pairs is False:
+            return False
+        relationships = dict()
+        for uuid, related_uuid in pairs:
+            relationships.setdefault(uuid, list()).append(related_uuid)
+        return relationships
+
+    # posts payload(chunk) to bulk/relationships for every chunk of uuids and returns the parsed pairs of all chunks,
+    # False once a chunk was given up on
+    def get_relationship_pairs(target, token, uuids, payload, parse):
+        uuids_chunked = AdaptiveChunker.chunks(target, 'relationships', uuids)
+        pairs = list()
         url = "https://" + target + "/suite-api/api/resources/bulk/relationships"
         headers = {
             'Content-Type': "application/json",
             'Accept': "application/json",
             'Authorization': "vRealizeOpsToken " + token
         }
-        import queue
-        q = queue.Queue()
-        thread_list = list()
-        chunk_iteration = 0
-        for uuid_list in uuids_chunked:
-            chunk_iteration += 1
-            t = Thread(target=Vrops.get_project_id_chunk,
-                       args=(q, uuid_list, url, headers, target, chunk_iteration))
-            thread_list.append(t)
-            t.start()
-        for t in thread_list:
-            t.join()
-
-        while not q.empty():
-            project_ids += q.get()
-        return project_ids
+        for chunk_result in Vrops.imap_chunks(target, Vrops.retry_complete_chunk, uuids_chunked, target,
+                                              'relationships', Vrops.get_relationship_chunk, url, headers, payload,
+                                              parse, target, complete=True):
+            if chunk_result is False:
+                return False
+            pairs += chunk_result
+        return pairs
 
     def get_datacenter(self, target, token, parentid):
         return self.get_resources(target, token, parentid=parentid, resourcekind="Datacenter")
@@ -159,32 +418,6 @@ class Vrops:
     def get_project_folders(self, target, token):
         return self.get_resources(target, token, parentid=None, resourcekind="VMFolder")
 
-    # not recommended
-    def get_latest_stat(target, token, uuid, key):
-        url = "https://" + target + "/suite-api/api/resources/" + uuid + "/stats/latest"
-        headers = {
-            'Content-Type': "application/json",
-            'Accept': "application/json",
-            'Authorization': "vRealizeOpsToken " + token
-        }
-        disable_warnings(exceptions.InsecureRequestWarning)
-        try:
-            response = requests.get(url,
-                                    verify=False,
-                                    headers=headers,
-                                    timeout=10)
-        except Exception as e:
-            print("Problem getting stats error for", key, str(e))
-            return False
-
-        if response.status_code == 200:
-            for statkey in response.json()["values"][0]["stat-list"]["stat"]:
-                if statkey["statKey"]["key"] is not None and statkey["statKey"]["key"] == key:
-                    return statkey["data"][0]
-        else:
-            print("Return code not 200 for " + str(key) + ": " + str(response.json()))
-            return False
-
     # this is for a single query of a property and returns the value only
     def get_property(target, token, uuid, key):
         url = "https://" + target + "/suite-api/api/resources/" + uuid + "/properties"
@@ -193,11 +426,8 @@ class Vrops:
             'Accept': "application/json",
             'Authorization': "vRealizeOpsToken " + token
         }
-        disable_warnings(exceptions.InsecureRequestWarning)
         try:
-            response = requests.get(url,
-                                    verify=False,
-                                    headers=headers)
+            response = Vrops.send(target, 'GET', url, headers)
         except Exception as e:
             print("Problem getting stats Error: " + str(e))
             return False
@@ -210,212 +440,177 @@ class Vrops:
             print("Return code not 200 for " + str(key) + ": " + str(response.json()))
             return False
 
-    # if we expect a number without special characters
-    def get_latest_number_properties_multiple(target, token, uuids, propkey):
+    # fetches all property keys for all uuids with one query per chunk
+    # returns the latest property-content indexed by (resourceId, propkey)
+    def get_latest_properties_multiple(target, token, uuids, propkeys):
         if not isinstance(uuids, list):
             print("Error in get multiple: uuids must be a list with multiple entries")
             return False
+        if not isinstance(propkeys, list):
+            print("Error in get multiple: propkeys must be a list with multiple entries")
+            return False
 
-        return_list = list()
+        uuids_chunked = AdaptiveChunker.chunks(target, 'properties', uuids)
+        return_dict = dict()
         url = "https://" + target + "/suite-api/api/resources/properties/latest/query"
         headers = {
             'Content-Type': "application/json",
             'Accept': "application/json",
             'Authorization': "vRealizeOpsToken " + token
         }
-        payload = {
-            "resourceIds": uuids,
-            "propertyKeys": [propkey]
-        }
-        disable_warnings(exceptions.InsecureRequestWarning)
-        try:
-            response = requests.post(url,
-                                     data=json.dumps(payload),
-                                     verify=False,
-                                     headers=headers)
-        except Exception as e:
-            print("Problem getting property Error: " + str(e))
-            return False
-
-        if response.status_code == 200:
-            try:
-                if not response.json()['values']:
-                    print("skipping propkey " + str(propkey) + ", no return")
-                    return False
-            except json.decoder.JSONDecodeError as e:
-                print("Catching JSONDecodeError for target:", str(target), "and key:", str(propkey),
-                      "\nerror msg:", str(e))
-                return False
-            for resource in response.json()['values']:
-                d = dict()
-                d['resourceId'] = resource['resourceId']
-                d['propkey'] = propkey
-                content = resource['property-contents']['property-content']
-                if content:
-                    if 'values' in content[0]:
-                        d['data'] = content[0]['values'][0]
-                    else:
-                        d['data'] = content[0]['data'][0]
-                else:
-                    # resources can go away, so None is returned
-                    print("skipping resource for get", str(propkey))
-                return_list.append(d)
-            return return_list
-        else:
-            print("Return code not 200 for " + str(propkey) + ": " + response.text)
-            return False
 
-    # if the property describes a status that has several states
-    # the expected status returns a 0, all others become 1
-    def get_latest_enum_properties_multiple(target, token, uuids, propkey):
+        for chunk_result in Vrops.map_chunks(target, Vrops.retry_chunk, uuids_chunked, target, 'properties',
+                                             Vrops.get_property_chunk, url, headers, propkeys, target):
+            for resource_id, propkey, content in chunk_result:
+                return_dict[(resource_id, propkey)] = content
+        return return_dict
 
+    # fetches all statkeys for all uuids with one query per chunk
+    # returns the latest value indexed by (resourceId, statKey)
+    def get_latest_stats_multiple(target, token, uuids, keys):
         if not isinstance(uuids, list):
             print("Error in get multiple: uuids must be a list with multiple entries")
             return False
+        if not isinstance(keys, list):
+            print("Error in get multiple: keys must be a list with multiple entries")
+            return False
 
-        url = "https://" + target + "/suite-api/api/resources/properties/latest/query"
+        uuids_chunked = AdaptiveChunker.chunks(target, 'stats', uuids)
+        return_dict = dict()
+        url = "https://" + target + "/suite-api/api/resources/stats/latest/query"
         headers = {
             'Content-Type': "application/json",
             'Accept': "application/json",
             'Authorization': "vRealizeOpsToken " + token
         }
-        payload = {
-            "resourceIds": uuids,
-            "propertyKeys": [propkey]
-        }
-        disable_warnings(exceptions.InsecureRequestWarning)
+
+        for chunk_result in Vrops.map_chunks(target, Vrops.retry_chunk, uuids_chunked, target, 'stats',
+                                             Vrops.get_stat_chunk, url, headers, keys, target):
+            for resource_id, statkey, value in chunk_result:
+                return_dict[(resource_id, statkey)] = value
+        return return_dict
+
+    def get_relationship_chunk(uuid_list, url, headers, payload, parse, target, chunk_iteration):
+        if os.environ['DEBUG'] >= '2':
+            print(target, 'chunk:', chunk_iteration)
+
+        start = time.monotonic()
         try:
-            response = requests.post(url,
-                                     data=json.dumps(payload),
-                                     verify=False,
-                                     headers=headers)
+            response = Vrops.send(target, 'POST', url, headers, data=json.dumps(payload(uuid_list)))
+        except (CircuitOpenError, DeadlineError) as e:
+            print(str(e))
+            return False
         except Exception as e:
-            print("Problem getting property Error: " + str(e))
+            AdaptiveChunker.record(target, 'relationships', len(uuid_list), time.monotonic() - start, failed=True)
+            print("Problem getting relationships Error: " + str(e))
             return False
-
-        properties_list = list()
-
+        AdaptiveChunker.record(target, 'relationships', len(uuid_list), time.monotonic() - start,
+                               failed=response.status_code >= 500, received=len(response.content))
         if response.status_code == 200:
             try:
-                if not response.json()['values']:
-                    print("skipping propkey " + str(propkey) + ", no return")
-                    return False
+                return parse(response.json())
             except json.decoder.JSONDecodeError as e:
-                print("Catching JSONDecodeError for target:", str(target), "and key:", str(propkey),
-                      "\nerror msg:", str(e))
+                print("Catching JSONDecodeError for target:", str(target),
+                      "chunk_iteration:", str(chunk_iteration), "\nerror msg:", str(e))
                 return False
-            for resource in response.json()['values']:
-                d = dict()
-                d['resourceId'] = resource['resourceId']
-                d['propkey'] = propkey
-                content = resource['property-contents']['property-content']
-                if content:
-                    if 'values' in content[0]:
-                        d['value'] = content[0]['values'][0]
-                else:
-                    # resources can go away, so None is returned
-                    print("skipping resource for get", str(propkey))
-                properties_list.append(d)
-            return properties_list
         else:
-            print("Return code not 200 for " + str(propkey) + ": " + response.text)
-            return False
+            print("Return code not 200 for: " + response.text)
+            return None if 400 <= response.status_code < 500 else False
 
-    # for all other properties that return a string or numbers with special characters
-    def get_latest_info_properties_multiple(target, token, uuids, propkey):
+    def get_stat_chunk(uuid_list, url, headers, keys, target, chunk_iteration):
+        if os.environ['DEBUG'] >= '2':
+            print(target, keys, 'chunk:', chunk_iteration)
 
-        if not isinstance(uuids, list):
-            print("Error in get multiple: uuids must be a list with multiple entries")
+        payload = {
+            "resourceId": uuid_list,
+            "statKey": keys
+        }
+        start = time.monotonic()
+        try:
+            response = Vrops.send(target, 'POST', url, headers, data=json.dumps(payload), timeout=10, stream=True)
+        except (CircuitOpenError, DeadlineError) as e:
+            print(str(e))
+            return False
+        except Exception as e:
+            AdaptiveChunker.record(target, 'stats', len(uuid_list), time.monotonic() - start, failed=True)
+            print("Problem getting stats Error for", keys, str(e))
             return False
 
-        url = "https://" + target + "/suite-api/api/resources/properties/latest/query"
-        headers = {
-            'Content-Type': "application/json",
-            'Accept': "application/json",
-            'Authorization': "vRealizeOpsToken " + token
-        }
+        if response.status_code == 200:
+            stream = JsonStream('values')
+            try:
+                stats = [stat for resource in iter_elements(response.iter_content(chunk_size=65536), 'values', stream)
+                         for stat in Vrops.stat_tuples(resource)]
+            except (json.decoder.JSONDecodeError, requests.exceptions.RequestException) as e:
+                AdaptiveChunker.record(target, 'stats', len(uuid_list), time.monotonic() - start, failed=True)
+                print("Catching error while streaming for target:", str(target), "and keys:", str(keys),
+                      "chunk_iteration:", str(chunk_iteration), "\nerror msg:", str(e))
+                return False
+            AdaptiveChunker.record(target, 'stats', len(uuid_list), time.monotonic() - start,
+                                   received=stream.received)
+            return stats
+        else:
+            AdaptiveChunker.record(target, 'stats', len(uuid_list), time.monotonic() - start,
+                                   failed=response.status_code >= 500)
+            print("Return code not 200 for " + str(keys) + ": " + response.text)
+            return None if 400 <= response.status_code < 500 else False
+
+    def get_property_chunk(uuid_list, url, headers, propkeys, target, chunk_iteration):
+        if os.environ['DEBUG'] >= '2':
+            print(target, propkeys, 'chunk:', chunk_iteration)
+
         payload = {
-            "resourceIds": uuids,
-            "propertyKeys": [propkey]
+            "resourceIds": uuid_list,
+            "propertyKeys": propkeys
         }
-        disable_warnings(exceptions.InsecureRequestWarning)
+        start = time.monotonic()
         try:
-            response = requests.post(url,
-                                     data=json.dumps(payload),
-                                     verify=False,
-                                     headers=headers)
+            response = Vrops.send(target, 'POST', url, headers, data=json.dumps(payload), timeout=10, stream=True)
+        except (CircuitOpenError, DeadlineError) as e:
+            print(str(e))
+            return False
         except Exception as e:
-            print("Problem getting property Error: " + str(e))
+            AdaptiveChunker.record(target, 'properties', len(uuid_list), time.monotonic() - start, failed=True)
+            print("Problem getting property Error for", propkeys, str(e))
             return False
 
-        properties_list = list()
-
         if response.status_code == 200:
+            stream = JsonStream('values')
             try:
-                if not response.json()['values']:
-                    print("skipping propkey " + str(propkey) + ", no return")
-                    return False
-            except json.decoder.JSONDecodeError as e:
-                print("Catching JSONDecodeError for target:", str(target), "and key:", str(propkey),
-                      "\nerror msg:", str(e))
+                contents = [content for resource in
+                            iter_elements(response.iter_content(chunk_size=65536), 'values', stream)
+                            for content in Vrops.property_tuples(resource)]
+            except (json.decoder.JSONDecodeError, requests.exceptions.RequestException) as e:
+                AdaptiveChunker.record(target, 'properties', len(uuid_list), time.monotonic() - start, failed=True)
+                print("Catching error while streaming for target:", str(target), "and propkeys:", str(propkeys),
+                      "chunk_iteration:", str(chunk_iteration), "\nerror msg:", str(e))
                 return False
-            for resource in response.json()['values']:
-                d = dict()
-                d['resourceId'] = resource['resourceId']
-                d['propkey'] = propkey
-                content = resource['property-contents']['property-content']
-                if content:
-                    if 'values' in content[0]:
-                        info = content[0]['values'][0]
-                    else:
-                        info = 'None'
-                    d['data'] = info
-                else:
-                    # resources can go away, so None is returned
-                    print("skipping resource for get", str(propkey))
-                properties_list.append(d)
-            return properties_list
+            AdaptiveChunker.record(target, 'properties', len(uuid_list), time.monotonic() - start,
+                                   received=stream.received)
+            return contents
         else:
-            print("Return code not 200 for " + str(propkey) + ": " + response.text)
-            return False
+            AdaptiveChunker.record(target, 'properties', len(uuid_list), time.monotonic() - start,
+                                   failed=response.status_code >= 500)
+            print("Return code not 200 for " + str(propkeys) + ": " + response.text)
+            return None if 400 <= response.status_code < 500 else False
 
-    def get_latest_stat_multiple(target, token, uuids, key):
-        if not isinstance(uuids, list):
-            print("Error in get multiple: uuids must be a list with multiple entries")
-            return False
+    # the parsers below are shared by all transports
 
-        # vrops can not handle more than 1000 uuids
-        uuids_chunked = list(chunk_list(uuids, 1000))
-        return_list = list()
-        url = "https://" + target + "/suite-api/api/resources/stats/latest/query"
-        headers = {
-            'Content-Type': "application/json",
-            'Accept': "application/json",
-            'Authorization': "vRealizeOpsToken " + token
-        }
+    def parse_adapters(response_json):
+        adapters = list()
+        for resource in response_json["adapterInstancesInfoDto"]:
+            res = dict()
+            res['name'] = resource["resourceKey"]["name"]
+            res['uuid'] = resource["id"]
+            res['adapterkind'] = resource["resourceKey"]["adapterKindKey"]
+            adapters.append(res)
+        return adapters
 
-        import queue
-        q = queue.Queue()
-        thread_list = list()
-        chunk_iteration = 0
-        for uuid_list in uuids_chunked:
-            chunk_iteration += 1
-            t = Thread(target=Vrops.get_stat_chunk,
-                       args=(q, uuid_list, url, headers, key, target, chunk_iteration))
-            thread_list.append(t)
-            t.start()
-        for t in thread_list:
-            t.join()
-
-        while not q.empty():
-            return_list += q.get()
-        return return_list
-
-    def get_project_id_chunk(q, uuid_list, url, headers, target, chunk_iteration):
-        if os.environ['DEBUG'] >= '2':
-            print(target, 'chunk:', chunk_iteration)
+    def resource_tuple(resource):
+        return resource["identifier"], resource["resourceKey"]["name"]
 
-        payload = {
+    def project_ids_payload(uuid_list):
+        return {
             "relationshipType": "ANCESTOR",
             "resourceIds": uuid_list,
             "resourceQuery": {
@@ -425,58 +620,50 @@ class Vrops:
             },
             "hierarchyDepth": 5
         }
-        disable_warnings(exceptions.InsecureRequestWarning)
-        try:
-            response = requests.post(url,
-                                     data=json.dumps(payload),
-                                     verify=False,
-                                     headers=headers)
-        except Exception as e:
-            print("Problem getting project folder Error: " + str(e))
-            return False
-        if response.status_code == 200:
-            try:
-                for project in response.json()['resourcesRelations']:
-                    p_ids = dict()
-                    for vm_uuid in project["relatedResources"]:
-                        p_ids[vm_uuid] = project["resource"]["resourceKey"]["name"][
-                                          project["resource"]["resourceKey"]["name"].find("(") + 1:
-                                          project["resource"]["resourceKey"]["name"].find(")")]
-                    q.put([p_ids])
-            except json.decoder.JSONDecodeError as e:
-                print("Catching JSONDecodeError for target:", str(target),
-                      "chunk_iteration:", str(chunk_iteration), "\nerror msg:", str(e))
-                return False
-        else:
-            print("Return code not 200 for: " + response.text)
-            return False
 
-    def get_stat_chunk(q, uuid_list, url, headers, key, target, chunk_iteration):
-        if os.environ['DEBUG'] >= '2':
-            print(target, key, 'chunk:', chunk_iteration)
+    # returns (vm uuid, project id) pairs
+    def parse_project_ids(response_json):
+        project_ids = list()
+        for project in response_json['resourcesRelations']:
+            project_name = project["resource"]["resourceKey"]["name"]
+            project_id = project_name[project_name.find("(") + 1:project_name.find(")")]
+            for vm_uuid in project["relatedResources"]:
+                project_ids.append((vm_uuid, project_id))
+        return project_ids
 
-        payload = {
-            "resourceId": uuid_list,
-            "statKey": [key]
+    def relationships_payload(uuid_list, relationship, resourcekind):
+        return {
+            "relationshipType": relationship,
+            "resourceIds": uuid_list,
+            "resourceQuery": {
+                "adapterKind": ["VMWARE"],
+                "resourceKind": [resourcekind]
+            },
+            "hierarchyDepth": 1
         }
-        disable_warnings(exceptions.InsecureRequestWarning)
-        try:
-            response = requests.post(url,
-                                     data=json.dumps(payload),
-                                     verify=False,
-                                     headers=headers,
-                                     timeout=10)
-        except Exception as e:
-            print("Problem getting stats Error for", key, str(e))
-            return False
 
-        if response.status_code == 200:
-            try:
-                q.put(response.json()['values'])
-            except json.decoder.JSONDecodeError as e:
-                print("Catching JSONDecodeError for target:", str(target), "and key:", str(key),
-                      "chunk_iteration:", str(chunk_iteration), "\nerror msg:", str(e))
-                return False
-        else:
-            print("Return code not 200 for " + str(key) + ": " + response.text)
-            return False
+    # returns (uuid, related uuid) pairs
+    def parse_relationships(response_json):
+        relationships = list()
+        for related in response_json['resourcesRelations']:
+            for uuid in related["relatedResources"]:
+                relationships.append((uuid, related["resource"]["identifier"]))
+        return relationships
+
+    def stat_tuples(resource):
+        for stat in resource['stat-list']['stat']:
+            if stat['data']:
+                yield resource['resourceId'], stat['statKey']['key'], stat['data'][0]
+
+    def property_tuples(resource):
+        # resources can go away, so no content is returned
+        for content in resource['property-contents']['property-content']:
+            yield resource['resourceId'], content['statKey'], content
+
+
+# TRANSPORT=async switches every vROps query of the process to the asyncio client
+def transport():
+    if os.environ.get('TRANSPORT', 'sync') == 'async':
+        from tools.VropsAsync import VropsAsync
+        return VropsAsync
+    return Vrops
@@ -0,0 +1,399 @@
+from tools.Vrops import Vrops, DeadlineError, IncompleteError, deadline
+from tools.AdaptiveChunker import AdaptiveChunker
+from tools.CircuitBreaker import CircuitBreaker, CircuitOpenError
+from tools.Governor import Governor, caller
+from tools.JsonStream import JsonStream
+from threading import Thread, Lock
+from contextvars import copy_context
+import asyncio
+import time
+import aiohttp
+import json
+import random
+import os
+
+
+class VropsAsync(Vrops):
+    # same surface as Vrops, but every query is a coroutine on one event loop per process.
+    # the blocking methods below hand their coroutine over to that loop, so collectors and
+    # the InventoryBuilder can switch transports without further changes
+    loop = None
+    loop_lock = Lock()
+    async_sessions = dict()
+
+    def get_loop():
+        with VropsAsync.loop_lock:
+            if not VropsAsync.loop:
+                VropsAsync.loop = asyncio.new_event_loop()
+                thread = Thread(target=VropsAsync.loop.run_forever, name='vrops-async')
+                thread.daemon = True
+                thread.start()
+            return VropsAsync.loop
+
+    def run(coroutine):
+        return asyncio.run_coroutine_threadsafe(VropsAsync.on_behalf(caller.get(), deadline.get(), coroutine),
+                                                VropsAsync.get_loop()).result()
+
+    # tasks on the loop don't inherit the context of the calling thread, the governor needs to know who is asking
+    # and until when
+    async def on_behalf(flow, until, coroutine):
+        caller.set(flow)
+        deadline.set(until)
+        return await coroutine
+
+    # only ever called on the event loop, so no lock is needed
+    async def get_async_session(target):
+        if target not in VropsAsync.async_sessions:
+            connector = aiohttp.TCPConnector(ssl=False,
+                                             limit_per_host=int(os.environ.get('TARGET_CONCURRENCY', '8')))
+            VropsAsync.async_sessions[target] = aiohttp.ClientSession(connector=connector)
+        return VropsAsync.async_sessions[target]
+
+    def headers(token):
+        return {
+            'Content-Type': "application/json",
+            'Accept': "application/json",
+            'Authorization': "vRealizeOpsToken " + token
+        }
+
+    # returns the status and the json body, or the text body if the request was not successful.
+    # with a JsonStream the body is decoded while it arrives and only the tuples of every array element are kept.
+    # like Vrops.request, the breaker only learns from the status, a body that can't be read is not counted.
+    # ungoverned requests don't queue at the governor, like token renewals of the blocking transport, or hold a
+    # slot taken by the caller already
+    async def send_async(target, method, url, headers, retry=True, stream=None, tuples=None, governed=True,
+                         **kwargs):
+        if Vrops.past_deadline():
+            raise DeadlineError("deadline has passed, not sending request to " + target)
+        kwargs.setdefault('timeout', aiohttp.ClientTimeout(sock_connect=10,
+                                                           sock_read=int(os.environ.get('REQUEST_TIMEOUT', '60'))))
+        session = await VropsAsync.get_async_session(target)
+        if governed:
+            await Governor.acquire_async(target)
+        try:
+            CircuitBreaker.before_request(target)
+            answered = False
+            try:
+                async with session.request(method, url, headers=headers, **kwargs) as response:
+                    answered = True
+                    if response.status >= 500:
+                        CircuitBreaker.failure(target)
+                    else:
+                        CircuitBreaker.success(target)
+                    if response.status == 200 and stream:
+                        return response.status, await VropsAsync.stream_async(response, stream, tuples)
+                    if response.status == 200:
+                        return response.status, await response.json()
+                    status, text = response.status, await response.text()
+            except Exception:
+                if not answered:
+                    CircuitBreaker.failure(target)
+                raise
+        finally:
+            if governed:
+                Governor.release(target)
+        if status == 401 and retry and 'Authorization' in headers:
+            # renewing is shared with the blocking transport, so it runs off the event loop on behalf of the caller
+            token = await asyncio.get_event_loop().run_in_executor(
+                None, copy_context().run, Vrops.refresh_token, target, headers['Authorization'].split()[-1])
+            if token:
+                headers = dict(headers, Authorization="vRealizeOpsToken " + token)
+                return await VropsAsync.send_async(target, method, url, headers, retry=False, stream=stream,
+                                                   tuples=tuples, governed=governed, **kwargs)
+        return status, text
+
+    async def stream_async(response, stream, tuples):
+        results = list()
+        async for data in response.content.iter_chunked(65536):
+            for element in stream.feed(data):
+                results.extend(tuples(element))
+        for element in stream.close():
+            results.extend(tuples(element))
+        return results
+
+    async def acquire_token_async(target):
+        url = "https://" + target + "/suite-api/api/auth/token/acquire"
+        headers = {
+            'Content-Type': "application/json",
+            'Accept': "application/json"
+        }
+        payload = {
+            "username": os.environ['USER'],
+            "authSource": "Local",
+            "password": os.environ['PASSWORD']
+        }
+        try:
+            # not queued at the governor: renewals happen while requests of the target wait for their slots
+            status, body = await VropsAsync.send_async(target, 'POST', url, headers, data=json.dumps(payload),
+                                                       governed=False, timeout=aiohttp.ClientTimeout(total=10))
+        except Exception as e:
+            if os.environ['DEBUG'] >= '1':
+                print("Problem connecting to " + target + ' Error: ' + str(e))
+            return False
+        if status == 200:
+            return {'token': body["token"], 'validity': body.get("validity")}
+        if os.environ['DEBUG'] >= '1':
+            print("problem getting token " + str(target) + ": " + body)
+        return False
+
+    async def get_adapter_async(target, token):
+        url = "https://" + target + "/suite-api/api/adapters"
+        querystring = {
+            "adapterKindKey": "VMWARE"
+        }
+        try:
+            status, body = await VropsAsync.send_async(target, 'GET', url, VropsAsync.headers(token),
+                                                       params=querystring)
+        except Exception as e:
+            print("Problem connecting to " + target + ' Error: ' + str(e))
+            return False
+        if status == 200:
+            return Vrops.parse_adapters(body)
+        print("problem getting adapter " + str(target))
+        return False
+
+    async def get_resources_async(target, token, resourcekind, parentid):
+        url = "https://" + target + "/suite-api/api/resources"
+        querystring = {
+            'adapterKind': 'VMware',
+            'resourceKind': resourcekind,
+            'pageSize': int(os.environ.get('PAGE_SIZE', '10000'))
+        }
+        # aiohttp does not drop empty query parameters like requests does
+        if parentid:
+            querystring['parentId'] = parentid
+        skeleton = dict()
+
+        def post(pages, chunk_iteration):
+            return VropsAsync.get_resource_page_async(target, url, token, querystring, pages[0], skeleton)
+
+        # pages are retried like chunks, a listing with pages missing would drop their resources from the inventory
+        resources, complete = await VropsAsync.retry_chunk_async([0], target, 'resources', post, 0)
+        if not complete:
+            raise IncompleteError("listing " + resourcekind + " of " + target + " failed")
+
+        total_count = skeleton.get('pageInfo', {}).get('totalCount', 0)
+        for page_result, complete in await asyncio.gather(
+                *[VropsAsync.retry_chunk_async([page], target, 'resources', post, page)
+                  for page in range(1, -(-total_count // querystring['pageSize']))]):
+            if not complete:
+                raise IncompleteError("listing " + resourcekind + " of " + target + " is missing pages")
+            resources += page_result
+        return resources
+
+    # the (uuid, name) tuples of one page, False if it failed and None if vrops refused it. the other top level
+    # members of the response end up in skeleton
+    async def get_resource_page_async(target, url, token, querystring, page, skeleton):
+        stream = JsonStream('resourceList')
+        try:
+            status, body = await VropsAsync.send_async(target, 'GET', url, VropsAsync.headers(token),
+                                                       params=dict(querystring, page=page), stream=stream,
+                                                       tuples=lambda resource: [Vrops.resource_tuple(resource)])
+        except json.decoder.JSONDecodeError as e:
+            print("Catching JSONDecodeError for target:", str(target), "and resourcekind:",
+                  str(querystring['resourceKind']), "page:", str(page), "\nerror msg:", str(e))
+            return False
+        except Exception as e:
+            print("Problem connecting to " + target + "Error: " + str(e))
+            return False
+        if status == 200:
+            skeleton.update(stream.skeleton)
+            return body
+        print("problem getting resource " + body)
+        return None if 400 <= status < 500 else False
+
+    # posts one chunk of size uuids and returns the parsed json body, False if the chunk failed and None if
+    # vrops refused it, which is not worth asking again. like retry_chunk of the blocking transport, the slot is
+    # taken before the chunk is timed, the wait at the governor says nothing about the latency of vrops
+    async def post_chunk_async(target, endpoint, url, headers, payload, size, chunk_iteration, timeout=10,
+                               **decode):
+        if os.environ['DEBUG'] >= '2':
+            print(target, url, 'chunk:', chunk_iteration)
+        await Governor.acquire_async(target)
+        try:
+            start = time.monotonic()
+            status, body = await VropsAsync.send_async(target, 'POST', url, headers, data=json.dumps(payload),
+                                                       timeout=aiohttp.ClientTimeout(total=timeout), governed=False,
+                                                       **decode)
+        except (CircuitOpenError, DeadlineError) as e:
+            print(str(e))
+            return False
+        except Exception as e:
+            AdaptiveChunker.record(target, endpoint, size, time.monotonic() - start, failed=True)
+            print("Problem getting chunk", str(chunk_iteration), "for target", str(target), "Error:", str(e))
+            return False
+        finally:
+            Governor.release(target)
+        AdaptiveChunker.record(target, endpoint, size, time.monotonic() - start, failed=status >= 500,
+                               received=decode['stream'].received if 'stream' in decode else None)
+        if status == 200:
+            return body
+        print("Return code not 200 for " + url + ": " + body)
+        return None if 400 <= status < 500 else False
+
+    # the asyncio counterpart of Vrops.map_chunks. at most TARGET_CONCURRENCY chunks of a list are in flight, the
+    # size of the next one is taken from the AdaptiveChunker once an earlier one is done. results are in chunk order.
+    # with complete, False once any uuids were given up on
+    async def gather_chunks_async(target, endpoint, uuids, post, complete=False):
+        chunks = AdaptiveChunker.chunks(target, endpoint, uuids)
+        concurrency = int(os.environ.get('TARGET_CONCURRENCY', '8'))
+        tasks = list()
+        running = set()
+        while True:
+            if len(running) >= concurrency:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            uuid_list = next(chunks, None)
+            if uuid_list is None:
+                break
+            task = asyncio.ensure_future(VropsAsync.retry_chunk_async(uuid_list, target, endpoint, post,
+                                                                      len(tasks) + 1))
+            tasks.append(task)
+            running.add(task)
+        chunk_results = await asyncio.gather(*tasks)
+        if complete and not all(done for results, done in chunk_results):
+            return False
+        return [results for results, done in chunk_results if results]
+
+    # the asyncio counterpart of Vrops.retry_chunk_results, post(uuids, chunk_iteration) sends one attempt.
+    # returns the results and whether nothing was given up on
+    async def retry_chunk_async(uuid_list, target, endpoint, post, chunk_iteration):
+        retry_deadline = time.monotonic() + float(os.environ.get('RETRY_DEADLINE', '30'))
+        attempts = int(os.environ.get('RETRY_ATTEMPTS', '3'))
+        backoff = float(os.environ.get('RETRY_BACKOFF', '0.5'))
+        results = list()
+        complete = True
+        pending = [uuid_list]
+        attempt = 0
+        while pending:
+            uuids = pending.pop(0)
+            result = await post(uuids, chunk_iteration)
+            if result is None:
+                complete = False
+                continue
+            if result is not False:
+                results += result
+                continue
+            attempt += 1
+            delay = random.uniform(0, backoff * 2 ** attempt)
+            if attempt > attempts or time.monotonic() + delay > retry_deadline or \
+                    CircuitBreaker.get_state(target) == 'open' or Vrops.past_deadline():
+                print("Giving up on", len(uuids), endpoint, "uuids for target", target, "after", attempt, "attempts")
+                complete = False
+                continue
+            await asyncio.sleep(delay)
+            # pages are asked one by one, there is nothing to cut
+            if len(uuids) > 1:
+                pending = list(AdaptiveChunker.chunks(target, endpoint, uuids)) + pending
+            else:
+                pending = [uuids] + pending
+        return results, complete
+
+    async def get_project_ids_async(target, token, uuids):
+        pairs = await VropsAsync.get_relationship_pairs_async(target, token, uuids, Vrops.project_ids_payload,
+                                                              Vrops.parse_project_ids)
+        return dict(pairs) if pairs is not False else False
+
+    async def get_relationships_async(target, token, uuids, relationship, resourcekind):
+        def payload(uuid_list):
+            return Vrops.relationships_payload(uuid_list, relationship, resourcekind)
+
+        pairs = await VropsAsync.get_relationship_pairs_async(target, token, uuids, payload, Vrops.parse_relationships)
+        if pairs is False:
+            return False
+        relationships = dict()
+        for uuid, related_uuid in pairs:
+            relationships.setdefault(uuid, list()).append(related_uuid)
+        return relationships
+
+    async def get_relationship_pairs_async(target, token, uuids, payload, parse):
+        url = "https://" + target + "/suite-api/api/resources/bulk/relationships"
+        headers = VropsAsync.headers(token)
+
+        async def post(uuid_list, chunk_iteration):
+            body = await VropsAsync.post_chunk_async(target, 'relationships', url, headers, payload(uuid_list),
+                                                     len(uuid_list), chunk_iteration)
+            return parse(body) if body else body
+
+        chunk_results = await VropsAsync.gather_chunks_async(target, 'relationships', uuids, post, complete=True)
+        if chunk_results is False:
+            return False
+        return [pair for chunk_result in chunk_results for pair in chunk_result]
+
+    async def get_latest_stats_multiple_async(target, token, uuids, keys):
+        url = "https://" + target + "/suite-api/api/resources/stats/latest/query"
+        headers = VropsAsync.headers(token)
+
+        def post(uuid_list, chunk_iteration):
+            return VropsAsync.post_chunk_async(target, 'stats', url, headers,
+                                               {"resourceId": uuid_list, "statKey": keys}, len(uuid_list),
+                                               chunk_iteration, stream=JsonStream('values'),
+                                               tuples=Vrops.stat_tuples)
+
+        chunk_results = await VropsAsync.gather_chunks_async(target, 'stats', uuids, post)
+        return_dict = dict()
+        for chunk_result in chunk_results:
+            for resource_id, statkey, value in chunk_result:
+                return_dict[(resource_id, statkey)] = value
+        return return_dict
+
+    async def get_latest_properties_multiple_async(target, token, uuids, propkeys):
+        url = "https://" + target + "/suite-api/api/resources/properties/latest/query"
+        headers = VropsAsync.headers(token)
+
+        def post(uuid_list, chunk_iteration):
+            return VropsAsync.post_chunk_async(target, 'properties', url, headers,
+                                               {"resourceIds": uuid_list, "propertyKeys": propkeys}, len(uuid_list),
+                                               chunk_iteration, stream=JsonStream('values'),
+                                               tuples=Vrops.property_tuples)
+
+        chunk_results = await VropsAsync.gather_chunks_async(target, 'properties', uuids, post)
+        return_dict = dict()
+        for chunk_result in chunk_results:
+            for resource_id, propkey, content in chunk_result:
+                return_dict[(resource_id, propkey)] = content
+        return return_dict
+
+    # blocking counterparts with the signatures of Vrops
+
+    def acquire_token(target):
+        return VropsAsync.run(VropsAsync.acquire_token_async(target))
+
+    def get_adapter(target, token):
+        return VropsAsync.run(VropsAsync.get_adapter_async(target, token))
+
+    def get_resources(self, target, token, resourcekind, parentid):
+        return [{'name': name, 'uuid': uuid} for uuid, name in
+                VropsAsync.iter_resources(target, token, resourcekind, parentid)]
+
+    def iter_resources(target, token, resourcekind, parentid):
+        return iter(VropsAsync.run(VropsAsync.get_resources_async(target, token, resourcekind, parentid)))
+
+    def get_project_ids(target, token, uuids):
+        if not isinstance(uuids, list):
+            print("Error in get project_ids: uuids must be a list with multiple entries")
+            return False
+        return VropsAsync.run(VropsAsync.get_project_ids_async(target, token, uuids))
+
+    def get_relationships(target, token, uuids, relationship, resourcekind):
+        if not isinstance(uuids, list):
+            print("Error in get relationships: uuids must be a list with multiple entries")
+            return False
+        return VropsAsync.run(VropsAsync.get_relationships_async(target, token, uuids, relationship, resourcekind))
+
+    def get_latest_stats_multiple(target, token, uuids, keys):
+        if not isinstance(uuids, list):
+            print("Error in get multiple: uuids must be a list with multiple entries")
+            return False
+        if not isinstance(keys, list):
+            print("Error in get multiple: keys must be a list with multiple entries")
+            return False
+        return VropsAsync.run(VropsAsync.get_latest_stats_multiple_async(target, token, uuids, keys))
+
+    def get_latest_properties_multiple(target, token, uuids, propkeys):
+        if not isinstance(uuids, list):
+            print("Error in get multiple: uuids must be a list with multiple entries")
+            return False
+        if not isinstance(propkeys, list):
+            print("Error in get multiple: propkeys must be a list with multiple entries")
+            return False
+        return VropsAsync.run(VropsAsync.get_latest_properties_multiple_async(target, token, uuids, propkeys))
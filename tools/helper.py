@@ -1,7 +1,3 @@
-def chunk_list(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
-
 def yaml_read(path):
     import yaml
     yml = dict()